@@ -0,0 +1,381 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+import cv2
+
+from src.adb_client import AdbClient
+from src import bot
+from src.adb_commands import send_gestures
+from src.buffer_pool import get_buffer_pool
+from src.fake_adb_server import FakeAdbServer, FakeDevice
+from src.image_decision_maker import find_images_over_threshold
+from src.image_service import screen_scale
+from src.image_template_loader import load_image_templates
+from src.metrics import STAGE_FIND_IMAGE, get_metrics
+from src.roi_index import RoiIndex
+from src.screenshot import capture_frame
+from src.session_recorder import is_session_file, read_session
+
+# Matching options of bot.run compared by the replay benchmark, on top of REPLAY_DEFAULTS
+REPLAY_DEFAULTS = dict(use_regions=True, pyramid_factor=1, use_scenes=False, priority_matching=False, batched_matching=False, downscale=1)
+REPLAY_CONFIGURATIONS = {
+    'full-frame': dict(use_regions=False),
+    'regions': dict(),
+    'pyramid-2': dict(pyramid_factor=2),
+    'pyramid-4': dict(pyramid_factor=4),
+    'downscale-2': dict(downscale=2),
+    'downscale-4': dict(downscale=4),
+    'batched': dict(batched_matching=True),
+    'priority': dict(priority_matching=True),
+    'scenes': dict(use_scenes=True),
+}
+
+
+def load_frames(directory):
+    frames = {}
+    for file in sorted(os.listdir(directory)):
+        if file.endswith('.png'):
+            frames[file] = cv2.imread(os.path.join(directory, file), cv2.IMREAD_GRAYSCALE)
+    return frames
+
+
+def natural_key(file):
+    """Sort screenshot2.png before screenshot10.png, like screenshot_manager numbers them."""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', file)]
+
+
+def load_recorded_frames(path):
+    """
+    The recorded frames as (capture mode, bytes as captured) in recording order,
+    from a directory of PNG screenshots or a session file of the session recorder.
+    """
+    if is_session_file(path):
+        return {
+            f'frame{i:06d}': (recorded.capture_mode, recorded.data)
+            for i, recorded in enumerate(read_session(path))
+        }
+
+    frames = {}
+    for file in sorted(os.listdir(path), key=natural_key):
+        if file.endswith('.png'):
+            with open(os.path.join(path, file), 'rb') as f:
+                frames[file] = ('png', f.read())
+    return frames
+
+
+def replay_find_matches(template_images, configuration):
+    """The find_matches function of bot.run for a replay configuration."""
+    options = dict(REPLAY_DEFAULTS, **REPLAY_CONFIGURATIONS[configuration])
+    roi_index = RoiIndex.load(learned_path=None) if options.pop('use_regions') else None
+    return bot.find_matches_factory(template_images, roi_index=roi_index, **options)()
+
+
+def set_screencap(device, capture_mode, data):
+    """Let the fake device answer the next screencap with a recorded frame."""
+    if capture_mode == 'png':
+        device.screencap_png = data
+    else:
+        device.screencap_raw = data
+
+
+def replay(template_images, frames, configuration, server, device):
+    """
+    Feed the frames through the capture, match, decide and tap path of the bot, with the device
+    stubbed by the fake adb server. Returns the decision per frame: the chosen template and the taps
+    the device received. Delayed taps are sent right away.
+    """
+    find_matches = replay_find_matches(template_images, configuration)
+    client = AdbClient(port=server.port)
+
+    decisions = {}
+    for file, (capture_mode, data) in frames.items():
+        set_screencap(device, capture_mode, data)
+        frame = capture_frame(capture_mode, session=client)
+        if frame is None:
+            logging.warning(f'Could not capture {file}')
+            decisions[file] = dict(action='capture_failed', template=None, position=None, taps=0)
+            continue
+
+        matches = find_matches(frame.gray)
+        tap = bot.choose_tap(matches, screen_scale(frame.gray.shape))
+        device.commands.clear()
+        if tap is not None:
+            send_gestures(bot.gestures_for_tap(*tap), session=client)
+        taps = [command.split()[2:] for command in device.commands if command.startswith('input tap ')]
+        decisions[file] = dict(
+            action=tap[2].action.name if tap is not None else 'no_action',
+            template=tap[0] if tap is not None else None,
+            position=[int(c) for c in taps[0]] if taps else None,
+            taps=len(taps),
+        )
+    return decisions
+
+
+def same_decision(expected, decided, tolerance):
+    """Whether two decisions tap the same button as often, at positions at most tolerance pixels apart."""
+    if expected is None:
+        return False
+    if (expected['action'], expected['template'], expected.get('taps')) != (decided['action'], decided['template'], decided['taps']):
+        return False
+    if expected['position'] is None or decided['position'] is None:
+        return expected['position'] == decided['position']
+    return max(abs(a - b) for a, b in zip(expected['position'], decided['position'])) <= tolerance
+
+
+def benchmark_replay(args):
+    """
+    Replay recorded frames through the bot's path for every matching configuration and compare
+    their speed, memory and decisions, against a golden file if there is one.
+    """
+    template_images = load_image_templates()
+    frames = load_recorded_frames(args.frames)
+    if not frames:
+        print(f'No recorded frames in {args.frames}')
+        return 1
+
+    golden = None
+    if args.golden and os.path.exists(args.golden) and not args.write_golden:
+        with open(args.golden) as f:
+            golden = json.load(f)
+
+    device = FakeDevice('replay')
+    failed = False
+    with FakeAdbServer([device]) as server:
+        # Warm up the caches of the templates (greyscale, pyramids, spectra) outside of the timings
+        for configuration in args.configurations:
+            replay(template_images, dict([next(iter(frames.items()))]), configuration, server, device)
+
+        print(f'{len(frames)} frames, {len(template_images)} templates')
+        reference = None
+        for configuration in args.configurations:
+            get_metrics().reset()
+            start = time.perf_counter()
+            decisions = replay(template_images, frames, configuration, server, device)
+            elapsed = time.perf_counter() - start
+            template_costs = [entry for entry in get_metrics().snapshot() if entry['stage'] == STAGE_FIND_IMAGE]
+
+            peak_memory = None
+            if not args.skip_memory:
+                # A separate pass, tracing allocations slows down the timed one
+                tracemalloc.start()
+                replay(template_images, frames, configuration, server, device)
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+            expected = golden if golden is not None else reference
+            different = sorted(
+                file for file in frames
+                if expected is not None and not same_decision(expected.get(file), decisions[file], args.tolerance)
+            )
+            for file in different:
+                print(f'{configuration}: {file} decided {decisions[file]} instead of {expected.get(file)}')
+            failed = failed or bool(different)
+            if reference is None:
+                reference = decisions
+
+            memory = f'  peak memory {peak_memory / 2**20:6.1f} MiB' if peak_memory is not None else ''
+            against = 'golden file' if golden is not None else args.configurations[0]
+            print(
+                f'{configuration:12} {len(frames) / elapsed:7.2f} frames/s{memory}'
+                f'  decisions different from {against}: {len(different)}'
+            )
+            for entry in sorted(template_costs, key=lambda entry: -entry['sum'])[:args.templates]:
+                print(f'    {entry["template"]:40} {entry["sum"] / len(frames) * 1000:7.2f} ms/frame  p95 {entry["p95"] * 1000:7.2f} ms')
+
+    if args.write_golden:
+        with open(args.golden, 'w') as f:
+            json.dump(reference, f, indent=2, sort_keys=True)
+        print(f'Wrote the decisions of {args.configurations[0]} to {args.golden}')
+    return 1 if failed else 0
+
+
+def resident_memory():
+    """Resident set size of the process in bytes, None where it can not be read (only Linux has /proc)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_resident_memory():
+    """Largest resident set size of the process so far in bytes, None where it can not be read (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def benchmark_memory(args):
+    """
+    Replay recorded frames in a loop and report the memory allocated per frame and how the resident
+    memory develops over the run. Run it once with and once without --no-buffer-pool to compare,
+    in separate processes so the runs do not share the heap.
+    """
+    template_images = load_image_templates()
+    frames = load_recorded_frames(args.frames)
+    pool = get_buffer_pool()
+    pool.enabled = not args.no_buffer_pool
+    device = FakeDevice('replay')
+    with FakeAdbServer([device]) as server:
+        # Warm up: template caches, and the buffers of the pool reach their largest shapes
+        replay(template_images, frames, args.configuration, server, device)
+
+        # Transient allocations per frame, traced in a separate pass since tracing slows down the run.
+        # Capturing (receiving, decoding and converting to greyscale) is traced apart from matching and deciding.
+        find_matches = replay_find_matches(template_images, args.configuration)
+        client = AdbClient(port=server.port)
+        captured = matched = 0
+        tracemalloc.start()
+        for capture_mode, data in frames.values():
+            set_screencap(device, capture_mode, data)
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            frame = capture_frame(capture_mode, session=client)
+            gray = frame.gray
+            captured += tracemalloc.get_traced_memory()[1] - current
+
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            bot.choose_tap(find_matches(gray), screen_scale(gray.shape))
+            matched += tracemalloc.get_traced_memory()[1] - current
+            # Like the bot loop, the frame is gone before the next one is captured
+            del frame, gray
+        tracemalloc.stop()
+
+        allocations = pool.allocations
+        samples = []
+        start = time.monotonic()
+        replayed = 0
+        while time.monotonic() - start < args.duration:
+            replay(template_images, frames, args.configuration, server, device)
+            replayed += len(frames)
+            samples.append((time.monotonic() - start, resident_memory()))
+
+    label = 'without buffer pool' if args.no_buffer_pool else 'with buffer pool'
+    print(f'{args.configuration} {label}: {replayed} frames in {args.duration:.0f} s')
+    print(f'    peak allocation per frame: capture {captured / len(frames) / 2**20:.1f} MiB, matching {matched / len(frames) / 2**20:.2f} MiB')
+    if not args.no_buffer_pool:
+        print(f'    buffers allocated after warm-up: {pool.allocations - allocations}')
+    rss = [(t, m) for t, m in samples if m is not None]
+    if len(rss) >= 2:
+        growth = (rss[-1][1] - rss[0][1]) / 2**20
+        hours = (rss[-1][0] - rss[0][0]) / 3600
+        print(
+            f'    resident memory {rss[0][1] / 2**20:.1f} MiB -> {rss[-1][1] / 2**20:.1f} MiB'
+            f' (max {max(m for _, m in rss) / 2**20:.1f} MiB, {growth / hours if hours else 0:+.1f} MiB/h)'
+        )
+    peak = peak_resident_memory()
+    if peak is not None:
+        print(f'    peak resident memory {peak / 2**20:.1f} MiB')
+    return 0
+
+
+def benchmark_pyramid(args):
+    """Compare coarse-to-fine matching against full resolution matching on recorded frames."""
+    template_images = load_image_templates()
+    frames = load_frames(args.frames)
+    factors = [1] + [factor for factor in args.factors if factor > 1]
+    timings = {factor: 0.0 for factor in factors}
+    disagreements = {factor: 0 for factor in factors}
+    max_score_difference = {factor: 0.0 for factor in factors}
+
+    for file, frame in frames.items():
+        results = {}
+        for factor in factors:
+            start = time.perf_counter()
+            results[factor] = find_images_over_threshold(template_images, frame, args.threshold, pyramid_factor=factor)
+            timings[factor] += time.perf_counter() - start
+
+        expected = {name: result for name, result in results[1]}
+        for factor in factors[1:]:
+            found = {name: result for name, result in results[factor]}
+            if {name: r.coords for name, r in found.items()} != {name: r.coords for name, r in expected.items()}:
+                disagreements[factor] += 1
+                print(f'{file}: 1/{factor} found {sorted(found)} instead of {sorted(expected)}')
+            for name in found.keys() & expected.keys():
+                difference = abs(found[name].val - expected[name].val)
+                max_score_difference[factor] = max(max_score_difference[factor], difference)
+
+    print(f'{len(frames)} frames, {len(template_images)} templates')
+    for factor in factors:
+        label = 'full resolution' if factor == 1 else f'pyramid 1/{factor}'
+        print(
+            f'{label:16} {timings[factor] / len(frames) * 1000:8.1f} ms/frame'
+            f'  speedup {timings[1] / timings[factor]:5.2f}x'
+            f'  frames with different matches {disagreements[factor]}'
+            f'  max score difference {max_score_difference[factor]:.5f}'
+        )
+    return 1 if any(disagreements.values()) else 0
+
+
+def benchmark_batched(args):
+    """Compare FFT batched matching against matching template by template on recorded frames."""
+    template_images = load_image_templates()
+    frames = load_frames(args.frames)
+    timings = {False: 0.0, True: 0.0}
+    disagreements = 0
+    # Transform the templates once before timing, like the bot does on its first frame
+    find_images_over_threshold(template_images, next(iter(frames.values())), args.threshold, batched=True)
+
+    for file, frame in frames.items():
+        results = {}
+        for batched in (False, True):
+            start = time.perf_counter()
+            results[batched] = find_images_over_threshold(template_images, frame, args.threshold, batched=batched)
+            timings[batched] += time.perf_counter() - start
+        if [(name, r.coords) for name, r in results[True]] != [(name, r.coords) for name, r in results[False]]:
+            disagreements += 1
+            print(f'{file}: batched found {[name for name, _ in results[True]]} instead of {[name for name, _ in results[False]]}')
+
+    print(f'{len(frames)} frames, {len(template_images)} templates')
+    for batched, label in ((False, 'template by template'), (True, 'batched FFT')):
+        print(f'{label:20} {timings[batched] / len(frames) * 1000:8.1f} ms/frame  speedup {timings[False] / timings[batched]:5.2f}x')
+    print(f'frames with different matches {disagreements}')
+    return 1 if disagreements else 0
+
+
+parser = argparse.ArgumentParser(description="Benchmarks for the image matching of PogoPVPLossBot.")
+subparsers = parser.add_subparsers(dest='command', required=True)
+
+pyramid_parser = subparsers.add_parser('pyramid', help='Accuracy and speed of coarse-to-fine pyramid matching')
+pyramid_parser.add_argument('--frames', default=os.path.join('tests', 'images'), help='Directory with recorded screenshots')
+pyramid_parser.add_argument('--factors', type=int, nargs='+', default=[2, 4], help='Pyramid downscale factors to compare')
+pyramid_parser.add_argument('--threshold', type=float, default=0.90, help='Match threshold')
+pyramid_parser.set_defaults(func=benchmark_pyramid)
+
+batched_parser = subparsers.add_parser('batched', help='Accuracy and speed of FFT batched matching')
+batched_parser.add_argument('--frames', default=os.path.join('tests', 'images'), help='Directory with recorded screenshots')
+batched_parser.add_argument('--threshold', type=float, default=0.90, help='Match threshold')
+batched_parser.set_defaults(func=benchmark_batched)
+
+replay_parser = subparsers.add_parser('replay', help='Speed, memory and decisions of the matching configurations on a recorded session')
+replay_parser.add_argument('--frames', default=os.path.join('tests', 'images'), help='Session file of --record-session, or a directory with recorded screenshots')
+replay_parser.add_argument('--configurations', nargs='+', choices=list(REPLAY_CONFIGURATIONS), default=list(REPLAY_CONFIGURATIONS), help='Matching configurations to compare, the first one is the reference')
+replay_parser.add_argument('--golden', help='JSON file with the expected decision per frame')
+replay_parser.add_argument('--write-golden', action='store_true', help='Write the decisions of the first configuration to the golden file')
+replay_parser.add_argument('--tolerance', type=int, default=8, help='Pixels a tap position may differ by and still count as the same decision')
+replay_parser.add_argument('--templates', type=int, default=5, help='Number of most expensive templates to list per configuration')
+replay_parser.add_argument('--skip-memory', action='store_true', help='Do not measure the peak memory (saves a second pass)')
+replay_parser.set_defaults(func=benchmark_replay)
+
+memory_parser = subparsers.add_parser('memory', help='Memory allocated per frame and resident memory over a long run')
+memory_parser.add_argument('--frames', default=os.path.join('tests', 'images'), help='Session file of --record-session, or a directory with recorded screenshots')
+memory_parser.add_argument('--configuration', choices=list(REPLAY_CONFIGURATIONS), default='regions', help='Matching configuration to run')
+memory_parser.add_argument('--duration', type=float, default=60, help='Seconds to run, e.g. 86400 for a day')
+memory_parser.add_argument('--no-buffer-pool', action='store_true', help='Let OpenCV allocate its result and greyscale arrays per call, to compare')
+memory_parser.set_defaults(func=benchmark_memory)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    args = parser.parse_args()
+    raise SystemExit(args.func(args))
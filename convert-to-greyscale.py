@@ -1,20 +1,11 @@
 import os
-import cv2
 
-input_dir = 'images'
+from src.image_template_loader import GREYSCALE_CACHE_DIR, IMAGE_DIR, TEMPLATE_PACK_NAME, build_template_pack
 
-# Loop through all the files in the input directory
-for file in os.listdir(input_dir):
-    # Check if the file is a png file
-    if file.endswith('.png'):
-        # Load the image
-        img = cv2.imread(os.path.join(input_dir, file))
-
-        print(f'Converting image: {file}')
-        # Convert the image to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        # Save the grayscale image
-        cv2.imwrite(os.path.join(input_dir, file), gray)
+# The greyscale templates are written to a pack in the cache directory, the images directory is not modified
+problems = build_template_pack()
 
+for image, template_problems in problems.items():
+    print(f'{image}: {", ".join(template_problems)}')
+print(f'Converted the images from {IMAGE_DIR} to {os.path.join(GREYSCALE_CACHE_DIR, TEMPLATE_PACK_NAME)}')
 print('Done!')
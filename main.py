@@ -2,6 +2,15 @@ import argparse
 import logging
 
 from src import bot
+from src.adb_client import AdbClient
+from src.adb_session import close_sessions, set_session_factory
+from src.async_adb import AsyncAdbClient, set_async_session_factory
+from src import screenshot
+from src.change_detector import CHANGE_DETECTORS
+from src.image_decision_maker import DECISION_CACHE_FILE, DecisionCache
+from src.matching_engine import close_matching_engine
+from src.metrics import METRICS_FORMATS, MetricsExporter, get_metrics
+from src.scheduler import POLLING_POLICIES
 
 
 def set_up_logging_configuration(log_level):
@@ -14,13 +23,87 @@ def set_up_logging_configuration(log_level):
 parser = argparse.ArgumentParser(description="PVPokeLossBot is a bot designed for the PVP mode of the mobile game Pokemon Go.")
 parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose logging')
 parser.add_argument('--skip-adb-check', action='store_true', help='Skip ADB connectivity check at startup (advanced users only)')
+parser.add_argument('--save-screenshots', action='store_true', help='Write every captured screenshot to disk for debugging')
+parser.add_argument('--capture-mode', choices=screenshot.CAPTURE_MODES, default=screenshot.CAPTURE_MODE_PNG, help='Transfer screenshots PNG encoded or as raw framebuffer (faster, falls back to PNG)')
+parser.add_argument('--adb-transport', choices=['process', 'socket'], default='process', help='Talk to the device through adb processes or directly to the adb server socket')
+parser.add_argument('--fleet', action='store_true', help='Run one bot loop per connected phone, picking up phones as they are plugged in or removed')
+parser.add_argument('--full-frame', action='store_true', help='Search every template on the whole screenshot instead of only its region of the screen')
+parser.add_argument('--pyramid', type=int, choices=[1, 2, 4], default=1, help='Locate templates on a 1/2 or 1/4 downscaled screenshot first and only refine them at full resolution (1 = off)')
+parser.add_argument('--downscale', type=int, choices=[1, 2, 4], default=1, help='Match on a 1/2 or 1/4 downscaled screenshot with templates scaled to that size, much faster but misses buttons, 4 too many for real games (1 = off)')
+parser.add_argument('--change-detector', choices=list(CHANGE_DETECTORS), default='mad', help='How to decide that a screenshot is unchanged and can be skipped: difference hash, tile checksums or mean absolute difference')
+parser.add_argument('--all-templates', action='store_true', help='Match every template on every screenshot instead of only the templates that can follow the current screen')
+parser.add_argument('--priority-matching', action='store_true', help='Match templates in priority order and stop at the first priority template on the screen, then tap that one')
+parser.add_argument('--batched-matching', action='store_true', help='Match the templates that share a screen region together by FFT cross-correlation, transforming the screenshot only once')
+parser.add_argument('--pipelined', action='store_true', help='Capture the next screenshot while the current one is matched and send taps in the background')
+parser.add_argument('--polling', choices=list(POLLING_POLICIES), default='adaptive', help='When to capture the next screenshot: adaptive to the screen, as fast as possible, or the fixed pauses of earlier versions')
+parser.add_argument('--async', dest='async_runtime', action='store_true', help='Run on one asyncio event loop: capturing, tapping and device checks of all phones wait without blocking, matching runs on worker threads')
+parser.add_argument('--record-session', help='Record the matched screenshots with their matches and decisions to this file, for benchmark.py replay')
+parser.add_argument('--decision-cache', type=int, default=0, help='Remember the decisions of up to this many screens and reuse them when a screen looks the same, without matching (0 = off)')
+parser.add_argument('--decision-cache-ttl', type=float, default=600, help='Seconds after which a remembered decision is matched again')
+parser.add_argument('--decision-cache-file', default=DECISION_CACHE_FILE, help='Load the remembered decisions from this file at start and save them on exit (empty to keep them in memory only)')
+parser.add_argument('--metrics-file', help='Export the latency of every bot loop stage and template (p50/p95/p99) to this file')
+parser.add_argument('--metrics-format', choices=METRICS_FORMATS, default='prometheus', help='Prometheus text format (replaced on every export) or JSON lines (appended)')
+parser.add_argument('--metrics-interval', type=float, default=10, help='Seconds between metrics exports')
 
 args = parser.parse_args()
 
 set_up_logging_configuration(logging.DEBUG if args.verbose else logging.INFO)
 
+adb_client = None
+if args.adb_transport == 'socket':
+    adb_client = AdbClient()
+    set_session_factory(AdbClient)
+    set_async_session_factory(AsyncAdbClient)
+
+metrics_exporter = None
+if args.metrics_file:
+    metrics_exporter = MetricsExporter(get_metrics(), args.metrics_file, args.metrics_format, args.metrics_interval)
+    metrics_exporter.start()
+
+decision_cache = None
+if args.decision_cache > 0:
+    decision_cache = DecisionCache.load(
+        args.decision_cache_file,
+        fingerprint=bot.decision_cache_fingerprint(
+            use_regions=not args.full_frame,
+            pyramid_factor=args.pyramid,
+            downscale=args.downscale,
+            use_scenes=not args.all_templates,
+            priority_matching=args.priority_matching,
+            batched_matching=args.batched_matching,
+        ),
+        max_entries=args.decision_cache,
+        ttl=args.decision_cache_ttl,
+    )
+
 try:
-    bot.run(skip_adb_check=args.skip_adb_check)
+    bot.run(
+        skip_adb_check=args.skip_adb_check,
+        save_screenshots=args.save_screenshots,
+        capture_mode=args.capture_mode,
+        fleet=args.fleet,
+        adb_client=adb_client,
+        use_regions=not args.full_frame,
+        pyramid_factor=args.pyramid,
+        downscale=args.downscale,
+        change_detector=args.change_detector,
+        use_scenes=not args.all_templates,
+        priority_matching=args.priority_matching,
+        batched_matching=args.batched_matching,
+        pipelined=args.pipelined,
+        polling_policy=args.polling,
+        async_runtime=args.async_runtime,
+        record_session=args.record_session,
+        decision_cache=decision_cache,
+    )
 except KeyboardInterrupt:
     print("")
     print("Exiting program...")
+finally:
+    close_sessions()
+    close_matching_engine()
+    if metrics_exporter is not None:
+        metrics_exporter.stop()
+    if decision_cache is not None:
+        decision_cache.save()
+        logging.info(f"Decision cache: {decision_cache.counters}")
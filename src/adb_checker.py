@@ -1,13 +1,27 @@
+import asyncio
 import subprocess
 import logging
 from typing import Tuple, Optional
 
+from src.adb_client import AdbClient
+from src.adb_session import AdbSession, get_session
+from src.async_adb import AsyncAdbClient, AsyncAdbSession, get_async_session
+from src.scheduler import sleep_async
 
-def is_adb_installed() -> bool:
+
+def is_adb_installed(client: Optional[AdbClient] = None) -> bool:
     """
     Check if ADB (Android Debug Bridge) is installed and available in PATH.
+    With a socket client, checks that the adb server answers instead.
     Returns True if ADB is installed, False otherwise.
     """
+    if client is not None:
+        try:
+            client.server_version()
+            return True
+        except OSError:
+            return False
+
     try:
         result = subprocess.run(
             ["adb", "version"],
@@ -20,11 +34,29 @@ def is_adb_installed() -> bool:
         return False
 
 
-def get_connected_devices() -> Tuple[bool, list]:
+def parse_devices(lines: list[str]) -> list:
+    """Return the IDs of devices that are ready from `serial<TAB>state` lines."""
+    devices = []
+    for line in lines:
+        if line.strip() and '\t' in line:
+            device_id, status = line.split('\t')
+            if status.strip() == 'device':  # Only count devices that are ready
+                devices.append(device_id.strip())
+    return devices
+
+
+def get_connected_devices(client: Optional[AdbClient] = None) -> Tuple[bool, list]:
     """
     Get list of connected ADB devices.
+    With a socket client the adb server is asked directly (host:devices).
     Returns (success, devices_list) where devices_list contains device IDs.
     """
+    if client is not None:
+        try:
+            return True, parse_devices(client.devices_output().split('\n'))
+        except (subprocess.TimeoutExpired, OSError):
+            return False, []
+
     try:
         result = subprocess.run(
             ["adb", "devices"],
@@ -38,47 +70,36 @@ def get_connected_devices() -> Tuple[bool, list]:
         
         # Parse adb devices output
         lines = result.stdout.strip().split('\n')
-        devices = []
-        
-        for line in lines[1:]:  # Skip "List of devices attached" header
-            if line.strip() and '\t' in line:
-                device_id, status = line.split('\t')
-                if status.strip() == 'device':  # Only count devices that are ready
-                    devices.append(device_id.strip())
-        
-        return True, devices
+        return True, parse_devices(lines[1:])  # Skip "List of devices attached" header
     except (subprocess.TimeoutExpired, FileNotFoundError, OSError):
         return False, []
 
 
-def check_adb_connectivity() -> bool:
+def check_adb_connectivity(session: Optional[AdbSession] = None) -> bool:
     """
     Test if ADB can execute a simple command on the connected device.
+    Uses the persistent shell session, so a successful check also warms it up.
     Returns True if ADB is working properly, False otherwise.
     """
     try:
-        result = subprocess.run(
-            ["adb", "shell", "echo", "test"],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        return result.returncode == 0 and "test" in result.stdout
+        returncode, output = (session or get_session()).run("echo test", timeout=10)
+        return returncode == 0 and "test" in output
     except (subprocess.TimeoutExpired, FileNotFoundError, OSError):
         return False
 
 
-def check_adb_status() -> Tuple[bool, str]:
+def check_adb_status(client: Optional[AdbClient] = None) -> Tuple[bool, str]:
     """
     Comprehensive ADB status check.
+    Pass a socket client to check over the adb server protocol instead of adb processes.
     Returns (is_ready, status_message) where is_ready indicates if ADB is ready to use.
     """
     # Check if ADB is installed
-    if not is_adb_installed():
+    if not is_adb_installed(client):
         return False, "ADB (Android Debug Bridge) is not installed or not in PATH. Please install Android SDK platform tools."
     
     # Check for connected devices
-    success, devices = get_connected_devices()
+    success, devices = get_connected_devices(client)
     if not success:
         return False, "Failed to query ADB devices. ADB may not be working properly."
     
@@ -86,10 +107,10 @@ def check_adb_status() -> Tuple[bool, str]:
         return False, "No Android devices connected. Please connect your Android device and enable USB debugging."
     
     if len(devices) > 1:
-        logging.warning(f"Multiple devices detected: {devices}. Using the first one.")
+        logging.warning(f"Multiple devices detected: {devices}. Using the first one, use --fleet to run all of them.")
     
     # Test ADB connectivity
-    if not check_adb_connectivity():
+    if not check_adb_connectivity(client):
         return False, "ADB is installed and devices are connected, but unable to communicate with device. Check USB debugging permissions."
     
     device_count = len(devices)
@@ -97,7 +118,7 @@ def check_adb_status() -> Tuple[bool, str]:
     return True, f"ADB is ready. {device_count} {device_word} connected: {', '.join(devices)}"
 
 
-def wait_for_device(timeout_seconds: int = 30) -> bool:
+def wait_for_device(timeout_seconds: int = 30, client: Optional[AdbClient] = None) -> bool:
     """
     Wait for an ADB device to be connected and ready.
     Returns True if device becomes available within timeout, False otherwise.
@@ -106,7 +127,7 @@ def wait_for_device(timeout_seconds: int = 30) -> bool:
     
     start_time = time.time()
     while time.time() - start_time < timeout_seconds:
-        is_ready, message = check_adb_status()
+        is_ready, message = check_adb_status(client)
         if is_ready:
             logging.info(message)
             return True
@@ -114,4 +135,85 @@ def wait_for_device(timeout_seconds: int = 30) -> bool:
         logging.info("Waiting for ADB device...")
         time.sleep(2)
     
-    return False
\ No newline at end of file
+    return False
+
+
+async def get_connected_devices_async(session: Optional[AsyncAdbSession] = None) -> Tuple[bool, list]:
+    """Like get_connected_devices, with an async session (see async_adb)."""
+    try:
+        return True, parse_devices((await (session or get_async_session()).devices_output()).split('\n'))
+    except (subprocess.TimeoutExpired, FileNotFoundError, OSError):
+        return False, []
+
+
+async def check_adb_connectivity_async(session: Optional[AsyncAdbSession] = None, serial: Optional[str] = None) -> bool:
+    """Like check_adb_connectivity, with an async session (see async_adb) of the phone with this serial."""
+    try:
+        returncode, output = await (session or get_async_session(serial)).run("echo test", timeout=10)
+        return returncode == 0 and "test" in output
+    except (subprocess.TimeoutExpired, FileNotFoundError, OSError):
+        return False
+
+
+async def check_adb_status_async(session: Optional[AsyncAdbSession] = None, serial: Optional[str] = None) -> Tuple[bool, str]:
+    """
+    Like check_adb_status, with an async session (see async_adb).
+    With a serial, checks the phone with that serial instead of the only connected one.
+    """
+    session = session or get_async_session(serial)
+    if isinstance(session, AsyncAdbClient):
+        try:
+            await session.server_version()
+        except (subprocess.TimeoutExpired, OSError):
+            return False, "The adb server does not answer. Start it with `adb start-server`."
+
+    success, devices = await get_connected_devices_async(session)
+    if not success:
+        return False, "Failed to query ADB devices. ADB may not be working properly."
+
+    if not devices:
+        return False, "No Android devices connected. Please connect your Android device and enable USB debugging."
+
+    if serial and serial not in devices:
+        return False, f"Device {serial} is not connected."
+
+    if not serial and len(devices) > 1:
+        logging.warning(f"Multiple devices detected: {devices}. Use --fleet to run all of them.")
+
+    if not await check_adb_connectivity_async(session):
+        return False, "ADB is installed and devices are connected, but unable to communicate with device. Check USB debugging permissions."
+
+    device_count = len(devices)
+    device_word = "device" if device_count == 1 else "devices"
+    return True, f"ADB is ready. {device_count} {device_word} connected: {', '.join(devices)}"
+
+
+async def wait_for_device_async(
+    timeout_seconds: Optional[float] = 30,
+    session: Optional[AsyncAdbSession] = None,
+    poll_interval: float = 2,
+    serial: Optional[str] = None,
+    stop_event: Optional[asyncio.Event] = None,
+) -> bool:
+    """
+    Like wait_for_device, but waits on the event loop instead of sleeping,
+    so other coroutines (e.g. other phones) go on in the meantime.
+    Waits for the phone with this serial if given, and without a timeout if timeout_seconds is None.
+    Returns False early if stop_event is set.
+    """
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    last_message = None
+    while timeout_seconds is None or loop.time() - start_time < timeout_seconds:
+        is_ready, message = await check_adb_status_async(session, serial)
+        if is_ready:
+            logging.info(message)
+            return True
+
+        if message != last_message:
+            logging.info(f"{message} Waiting for ADB device...")
+            last_message = message
+        if await sleep_async(poll_interval, stop_event):
+            return False
+
+    return False
@@ -0,0 +1,134 @@
+import os
+import socket
+import subprocess
+import uuid
+import itertools
+from typing import Optional, Tuple
+
+ADB_SERVER_HOST = "127.0.0.1"
+ADB_SERVER_PORT = int(os.environ.get("ANDROID_ADB_SERVER_PORT", 5037))
+
+
+class AdbProtocolError(OSError):
+    """The adb server answered a request with FAIL or an unexpected response."""
+
+
+class AdbClient:
+    """
+    Talks the adb server's smart-socket protocol directly instead of spawning adb processes.
+    Every request is sent as a 4 digit hex length followed by the payload; the server answers
+    OKAY or FAIL. Device services (shell:, exec:) are opened after selecting a transport.
+
+    Offers the same run()/exec_out() interface as AdbSession, so it can be used anywhere a
+    session is expected.
+    """
+
+    def __init__(
+        self,
+        serial: Optional[str] = None,
+        host: str = ADB_SERVER_HOST,
+        port: int = ADB_SERVER_PORT,
+    ):
+        self.serial = serial
+        self.host = host
+        self.port = port
+        self._marker = f"__ADB_CLIENT_{uuid.uuid4().hex}__"
+        self._counter = itertools.count()
+
+    def _connect(self, timeout: float) -> socket.socket:
+        return socket.create_connection((self.host, self.port), timeout=timeout)
+
+    @staticmethod
+    def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise AdbProtocolError("adb server closed the connection")
+            data.extend(chunk)
+        return bytes(data)
+
+    @staticmethod
+    def _recv_all(sock: socket.socket) -> bytes:
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+    def _read_hex_string(self, sock: socket.socket) -> bytes:
+        length = int(self._recv_exactly(sock, 4), 16)
+        return self._recv_exactly(sock, length)
+
+    def _request(self, sock: socket.socket, payload: str):
+        data = payload.encode("utf-8")
+        sock.sendall(f"{len(data):04x}".encode("ascii") + data)
+        status = self._recv_exactly(sock, 4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            message = self._read_hex_string(sock).decode("utf-8", errors="replace")
+            raise AdbProtocolError(f"{payload}: {message}")
+        raise AdbProtocolError(f"{payload}: unexpected response {status!r}")
+
+    def _open_service(self, service: str, timeout: float) -> socket.socket:
+        sock = self._connect(timeout)
+        try:
+            transport = f"host:transport:{self.serial}" if self.serial else "host:transport-any"
+            self._request(sock, transport)
+            self._request(sock, service)
+            return sock
+        except BaseException:
+            sock.close()
+            raise
+
+    def _host_query(self, service: str, timeout: float) -> str:
+        with self._connect(timeout) as sock:
+            self._request(sock, service)
+            return self._read_hex_string(sock).decode("utf-8", errors="replace")
+
+    def server_version(self, timeout: float = 10) -> int:
+        """Return the adb server's protocol version (host:version)."""
+        return int(self._host_query("host:version", timeout), 16)
+
+    def devices_output(self, timeout: float = 10) -> str:
+        """Return the device listing (host:devices) as `serial\\tstate` lines."""
+        return self._host_query("host:devices", timeout)
+
+    def shell(self, command: str, timeout: float = 10) -> bytes:
+        """Run a command with the shell: service and return everything it printed."""
+        try:
+            with self._open_service(f"shell:{command}", timeout) as sock:
+                return self._recv_all(sock)
+        except socket.timeout:
+            raise subprocess.TimeoutExpired(command, timeout)
+
+    def run(self, command: str, timeout: float = 10) -> Tuple[int, str]:
+        """
+        Run a shell command on the device.
+        The shell: service does not report exit codes, so the command is followed by a
+        sentinel echo carrying $?.
+        Returns (returncode, output) where output contains stdout and stderr.
+        """
+        marker = f"{self._marker}{next(self._counter)}"
+        raw = self.shell(f"{{ {command} ; }} 2>&1; echo {marker}$?", timeout)
+        output, found, returncode = raw.decode("utf-8", errors="replace").rpartition(marker)
+        if not found:
+            raise AdbProtocolError(f"{command}: shell exited without reporting an exit code")
+        return int(returncode.strip() or 1), output.replace("\r\n", "\n").rstrip("\n")
+
+    def exec_out(self, args: list[str], timeout: float = 15) -> subprocess.CompletedProcess:
+        """Run a command with the exec: service, which returns binary-safe stdout (e.g. screencap)."""
+        command = " ".join(args)
+        try:
+            with self._open_service(f"exec:{command}", timeout) as sock:
+                stdout = self._recv_all(sock)
+        except socket.timeout:
+            raise subprocess.TimeoutExpired(command, timeout)
+        except AdbProtocolError as e:
+            return subprocess.CompletedProcess(args, 1, b"", str(e).encode("utf-8"))
+        return subprocess.CompletedProcess(args, 0, stdout, b"")
+
+    def close(self):
+        """Nothing to close, every request uses its own short-lived socket to the server."""
@@ -1,28 +1,200 @@
 import subprocess
 import logging
+import queue
+import threading
+from concurrent.futures import Future
 from typing import Optional
 
+from attrs import define
 
-def send_adb_tap(x: int, y: int) -> bool:
+from src.adb_session import AdbSession, get_session
+from src.async_adb import AsyncAdbSession, get_async_session
+from src.metrics import STAGE_TAP, span
+
+
+# Printed with the index and exit code of every command of a gesture batch (see send_gestures)
+GESTURE_MARKER = "__GESTURE__"
+
+# Stops the sender thread of a GestureQueue
+_STOP = object()
+
+
+@define(frozen=True)
+class Gesture:
+    command: str  # An input command, like "input tap 100 200"
+    delay_after: float = 0.0  # Seconds to wait on the device before the next gesture of the batch
+
+
+@define(frozen=True)
+class GestureResult:
+    command: str
+    returncode: Optional[int]  # None if the command did not report back (timeout, lost connection)
+    output: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+
+def tap(x: int, y: int, delay_after: float = 0.0) -> Gesture:
+    return Gesture(f"input tap {x} {y}", delay_after)
+
+
+def keyevent(keycode: int, delay_after: float = 0.0) -> Gesture:
+    return Gesture(f"input keyevent {keycode}", delay_after)
+
+
+def gesture_script(gestures: list[Gesture]) -> str:
+    """
+    One shell command line that runs all gestures in order, each followed by GESTURE_MARKER,
+    its index and its exit code, and by a sleep on the device for its delay_after.
+    """
+    parts = []
+    for index, gesture in enumerate(gestures):
+        parts.append(f"{gesture.command}; echo {GESTURE_MARKER} {index} $?")
+        if gesture.delay_after > 0 and index < len(gestures) - 1:
+            parts.append(f"sleep {gesture.delay_after:g}")
+    return "; ".join(parts)
+
+
+def parse_gesture_output(gestures: list[Gesture], output: str) -> list[GestureResult]:
+    """Split the output of gesture_script into the result of every gesture."""
+    results = [GestureResult(gesture.command, None) for gesture in gestures]
+    lines = []
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 3 and fields[0] == GESTURE_MARKER and fields[1].isdigit() and int(fields[1]) < len(gestures):
+            index = int(fields[1])
+            returncode = int(fields[2]) if fields[2].lstrip("-").isdigit() else 1
+            results[index] = GestureResult(gestures[index].command, returncode, "\n".join(lines))
+            lines = []
+        else:
+            lines.append(line)
+    return results
+
+
+def send_gestures(gestures: list[Gesture], session: Optional[AdbSession] = None) -> list[GestureResult]:
+    """
+    Send several taps and keyevents to the Android device as one shell command line, instead of
+    a round trip to the device per command.
+    Returns the result of every gesture; gestures that did not report back have returncode None.
+    """
+    if not gestures:
+        return []
+    timeout = 10 + sum(gesture.delay_after for gesture in gestures)
+    try:
+        with span(STAGE_TAP):
+            _, output = (session or get_session()).run(gesture_script(gestures), timeout=timeout)
+    except subprocess.TimeoutExpired:
+        logging.error(f"ADB gestures timed out: {[gesture.command for gesture in gestures]}")
+        return [GestureResult(gesture.command, None) for gesture in gestures]
+    except (FileNotFoundError, OSError) as e:
+        logging.error(f"ADB gestures failed: {e}")
+        return [GestureResult(gesture.command, None) for gesture in gestures]
+
+    results = parse_gesture_output(gestures, output)
+    for result in results:
+        if result.ok:
+            logging.debug(f"ADB gesture sent: {result.command}")
+        else:
+            logging.error(f"ADB gesture {result.command} failed: {result.output}")
+    return results
+
+
+class GestureQueue:
+    """
+    Sends taps and keyevents to one device from a background thread, so the bot loop does not wait for them.
+    Gestures that are submitted while a batch is being sent are coalesced into the next batch,
+    one shell command line for up to max_batch gestures (see send_gestures).
+    The gestures of one submit are sent in the same batch, in order.
+    """
+
+    def __init__(self, session: Optional[AdbSession] = None, max_batch: int = 32, name: str = "gestures"):
+        self.session = session
+        self.max_batch = max_batch
+        self.counters = dict(submitted=0, batches=0, failed=0)
+        self._submitted: queue.Queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._send_batches, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, *gestures: Gesture) -> Future:
+        """
+        Queue gestures for sending. Returns a Future of their GestureResults.
+        Raises RuntimeError if the queue was closed.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Gesture queue is closed")
+            self.counters["submitted"] += len(gestures)
+            self._submitted.put((list(gestures), future))
+        return future
+
+    def _send_batches(self):
+        while True:
+            item = self._submitted.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stop = False
+            while sum(len(gestures) for gestures, _ in batch) < self.max_batch:
+                try:
+                    item = self._submitted.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._send_batch(batch)
+            if stop:
+                return
+
+    def _send_batch(self, batch: list[tuple[list[Gesture], Future]]):
+        try:
+            results = send_gestures([gesture for gestures, _ in batch for gesture in gestures], self.session)
+        except Exception as e:
+            # The sender stays alive for later gestures, the submitters of this batch get the error
+            logging.exception(f"Sending gestures failed: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.counters["batches"] += 1
+        self.counters["failed"] += sum(not result.ok for result in results)
+        for gestures, future in batch:
+            future.set_result(results[:len(gestures)])
+            results = results[len(gestures):]
+
+    def close(self):
+        """Send the queued gestures and stop the sender thread. Gestures can not be submitted afterwards."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._submitted.put(_STOP)
+        self._thread.join()
+        logging.debug(f"Gesture queue closed: {self.counters}")
+
+
+def send_adb_tap(x: int, y: int, session: Optional[AdbSession] = None) -> bool:
     """
     Send a tap command to the Android device via ADB.
     Returns True if the command was successful, False otherwise.
     """
     try:
-        result = subprocess.run(
-            ["adb", "shell", "input", "tap", str(x), str(y)],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        
-        if result.returncode != 0:
-            logging.error(f"ADB tap command failed: {result.stderr}")
+        with span(STAGE_TAP):
+            returncode, output = (session or get_session()).run(f"input tap {x} {y}", timeout=10)
+
+        if returncode != 0:
+            logging.error(f"ADB tap command failed: {output}")
             return False
-        
+
         logging.debug(f"ADB tap sent to coordinates ({x}, {y})")
         return True
-    
+
     except subprocess.TimeoutExpired:
         logging.error(f"ADB tap command timed out for coordinates ({x}, {y})")
         return False
@@ -31,26 +203,21 @@ def send_adb_tap(x: int, y: int) -> bool:
         return False
 
 
-def turn_screen_off() -> bool:
+def turn_screen_off(session: Optional[AdbSession] = None) -> bool:
     """
     Turn off the Android device screen using power button keyevent.
     Returns True if the command was successful, False otherwise.
     """
     try:
-        result = subprocess.run(
-            ["adb", "shell", "input", "keyevent", "26"],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        
-        if result.returncode != 0:
-            logging.error(f"ADB screen off command failed: {result.stderr}")
+        returncode, output = (session or get_session()).run("input keyevent 26", timeout=10)
+
+        if returncode != 0:
+            logging.error(f"ADB screen off command failed: {output}")
             return False
-        
+
         logging.debug("Screen turned off via ADB")
         return True
-    
+
     except subprocess.TimeoutExpired:
         logging.error("ADB screen off command timed out")
         return False
@@ -59,29 +226,92 @@ def turn_screen_off() -> bool:
         return False
 
 
-def send_adb_keyevent(keycode: int) -> bool:
+def send_adb_keyevent(keycode: int, session: Optional[AdbSession] = None) -> bool:
     """
     Send a keyevent to the Android device via ADB.
     Returns True if the command was successful, False otherwise.
     """
     try:
-        result = subprocess.run(
-            ["adb", "shell", "input", "keyevent", str(keycode)],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        
-        if result.returncode != 0:
-            logging.error(f"ADB keyevent {keycode} command failed: {result.stderr}")
+        returncode, output = (session or get_session()).run(f"input keyevent {keycode}", timeout=10)
+
+        if returncode != 0:
+            logging.error(f"ADB keyevent {keycode} command failed: {output}")
+            return False
+
+        logging.debug(f"ADB keyevent {keycode} sent")
+        return True
+
+    except subprocess.TimeoutExpired:
+        logging.error(f"ADB keyevent {keycode} command timed out")
+        return False
+    except (FileNotFoundError, OSError) as e:
+        logging.error(f"ADB keyevent {keycode} command failed: {e}")
+        return False
+
+
+async def send_adb_tap_async(x: int, y: int, session: Optional[AsyncAdbSession] = None) -> bool:
+    """Like send_adb_tap, with an async session (see async_adb)."""
+    try:
+        with span(STAGE_TAP):
+            returncode, output = await (session or get_async_session()).run(f"input tap {x} {y}", timeout=10)
+
+        if returncode != 0:
+            logging.error(f"ADB tap command failed: {output}")
+            return False
+
+        logging.debug(f"ADB tap sent to coordinates ({x}, {y})")
+        return True
+
+    except subprocess.TimeoutExpired:
+        logging.error(f"ADB tap command timed out for coordinates ({x}, {y})")
+        return False
+    except (FileNotFoundError, OSError) as e:
+        logging.error(f"ADB tap command failed: {e}")
+        return False
+
+
+async def send_gestures_async(gestures: list[Gesture], session: Optional[AsyncAdbSession] = None) -> list[GestureResult]:
+    """Like send_gestures, with an async session (see async_adb)."""
+    if not gestures:
+        return []
+    timeout = 10 + sum(gesture.delay_after for gesture in gestures)
+    try:
+        with span(STAGE_TAP):
+            _, output = await (session or get_async_session()).run(gesture_script(gestures), timeout=timeout)
+    except subprocess.TimeoutExpired:
+        logging.error(f"ADB gestures timed out: {[gesture.command for gesture in gestures]}")
+        return [GestureResult(gesture.command, None) for gesture in gestures]
+    except (FileNotFoundError, OSError) as e:
+        logging.error(f"ADB gestures failed: {e}")
+        return [GestureResult(gesture.command, None) for gesture in gestures]
+
+    results = parse_gesture_output(gestures, output)
+    for result in results:
+        if not result.ok:
+            logging.error(f"ADB gesture {result.command} failed: {result.output}")
+    return results
+
+
+async def send_adb_keyevent_async(keycode: int, session: Optional[AsyncAdbSession] = None) -> bool:
+    """Like send_adb_keyevent, with an async session (see async_adb)."""
+    try:
+        returncode, output = await (session or get_async_session()).run(f"input keyevent {keycode}", timeout=10)
+
+        if returncode != 0:
+            logging.error(f"ADB keyevent {keycode} command failed: {output}")
             return False
-        
+
         logging.debug(f"ADB keyevent {keycode} sent")
         return True
-    
+
     except subprocess.TimeoutExpired:
         logging.error(f"ADB keyevent {keycode} command timed out")
         return False
     except (FileNotFoundError, OSError) as e:
         logging.error(f"ADB keyevent {keycode} command failed: {e}")
         return False
+
+
+async def turn_screen_off_async(session: Optional[AsyncAdbSession] = None) -> bool:
+    """Like turn_screen_off, with an async session (see async_adb)."""
+    return await send_adb_keyevent_async(26, session)
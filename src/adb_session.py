@@ -0,0 +1,176 @@
+import itertools
+import logging
+import queue
+import subprocess
+import threading
+import time
+import uuid
+from typing import Callable, Optional, Tuple
+
+
+class AdbSession:
+    """
+    A persistent `adb shell` connection to one device.
+    Commands are written into the open shell instead of spawning a new adb process for every command.
+    The end of a command's output is detected with a unique sentinel line that also carries the exit code.
+    If the shell dies (device unplugged, adb server restarted) it is restarted on the next command.
+    """
+
+    def __init__(self, serial: Optional[str] = None, adb_path: str = "adb"):
+        self.serial = serial
+        self.adb_path = adb_path
+        self._process: Optional[subprocess.Popen] = None
+        self._lines: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._marker = f"__ADB_SESSION_{uuid.uuid4().hex}__"
+        self._counter = itertools.count()
+
+    def adb_command(self, *args: str) -> list[str]:
+        """Return an adb command line addressed to this session's device."""
+        command = [self.adb_path]
+        if self.serial:
+            command += ["-s", self.serial]
+        return command + list(args)
+
+    def _shell_command(self) -> list[str]:
+        return self.adb_command("shell")
+
+    def is_alive(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        """Start the shell process. Raises FileNotFoundError/OSError if adb can not be started."""
+        self.close()
+        self._lines = queue.Queue()
+        self._process = subprocess.Popen(
+            self._shell_command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        reader = threading.Thread(
+            target=self._read_lines, args=(self._process, self._lines), daemon=True
+        )
+        reader.start()
+        logging.debug(f"ADB shell session started for {self.serial or 'default device'}")
+
+    @staticmethod
+    def _read_lines(process: subprocess.Popen, lines: queue.Queue):
+        for line in iter(process.stdout.readline, b""):
+            lines.put(line.decode("utf-8", errors="replace").rstrip("\r\n"))
+        lines.put(None)  # End of stream: the shell has exited
+
+    def close(self):
+        process, self._process = self._process, None
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        try:
+            process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def _send(self, command: str, marker: str):
+        # stderr is folded into stdout so every line of output arrives before the marker
+        line = f"{{ {command} ; }} 2>&1; echo {marker} $?\n"
+        self._process.stdin.write(line.encode("utf-8"))
+        self._process.stdin.flush()
+
+    def run(self, command: str, timeout: float = 10) -> Tuple[int, str]:
+        """
+        Run a shell command on the device and wait for it to finish.
+        Returns (returncode, output) where output contains stdout and stderr.
+        Raises subprocess.TimeoutExpired if the command does not finish in time and
+        OSError if the shell could not be (re)started or exited while the command ran.
+        """
+        with self._lock:
+            marker = f"{self._marker}{next(self._counter)}"
+            if not self.is_alive():
+                self.start()
+            try:
+                self._send(command, marker)
+            except (BrokenPipeError, ValueError):
+                # The shell went away since the last command; the command was not sent, so retry once
+                logging.info("ADB shell session lost. Reconnecting...")
+                self.start()
+                self._send(command, marker)
+
+            output = []
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    line = self._lines.get(timeout=max(remaining, 0))
+                except queue.Empty:
+                    # The shell is out of sync now; start a fresh one for the next command
+                    self.close()
+                    raise subprocess.TimeoutExpired(command, timeout)
+
+                if line is None:
+                    self.close()
+                    raise OSError(f"ADB shell session closed: {' '.join(output)}".strip())
+
+                # Output without a trailing newline (e.g. printf) puts the marker in the middle of the line
+                text, found, returncode = line.partition(marker)
+                if found:
+                    if text:
+                        output.append(text)
+                    return int(returncode.strip() or 1), "\n".join(output)
+
+                output.append(line)
+
+    def exec_out(self, args: list[str], timeout: float = 15) -> subprocess.CompletedProcess:
+        """
+        Run a command whose binary stdout is needed (e.g. screencap) through `adb exec-out`.
+        Binary output can not share the text shell, so this still uses its own adb process.
+        """
+        return subprocess.run(
+            self.adb_command("exec-out", *args),
+            capture_output=True,
+            timeout=timeout
+        )
+
+
+_sessions: dict[Optional[str], AdbSession] = {}
+_sessions_lock = threading.Lock()
+_session_factory: Callable[[Optional[str]], AdbSession] = AdbSession
+
+
+def set_session_factory(factory: Callable[[Optional[str]], AdbSession]):
+    """
+    Choose how shared sessions are created, e.g. AdbClient to talk to the adb server
+    over its socket instead of through adb processes. Existing sessions are closed.
+    """
+    global _session_factory
+    close_sessions()
+    _session_factory = factory
+
+
+def get_session(serial: Optional[str] = None) -> AdbSession:
+    """Return the shared session for a device, creating it on first use."""
+    with _sessions_lock:
+        session = _sessions.get(serial)
+        if session is None:
+            session = _session_factory(serial)
+            _sessions[serial] = session
+        return session
+
+
+def close_session(serial: Optional[str] = None):
+    """Close and forget the shared session of one device."""
+    with _sessions_lock:
+        session = _sessions.pop(serial, None)
+    if session is not None:
+        session.close()
+
+
+def close_sessions():
+    """Close all shared sessions."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,201 @@
+import asyncio
+import itertools
+import subprocess
+import uuid
+from typing import Callable, Optional, Tuple, Union
+
+from src.adb_client import ADB_SERVER_HOST, ADB_SERVER_PORT, AdbProtocolError
+
+
+class AsyncAdbProcess:
+    """
+    The run()/exec_out() interface of AdbSession as coroutines, with an adb process per command
+    started by asyncio instead of a blocking subprocess call.
+    The exit code of shell commands is carried by a sentinel echo like in AdbClient.run.
+    """
+
+    def __init__(self, serial: Optional[str] = None, adb_path: str = "adb"):
+        self.serial = serial
+        self.adb_path = adb_path
+        self._marker = f"__ADB_ASYNC_{uuid.uuid4().hex}__"
+        self._counter = itertools.count()
+
+    def adb_command(self, *args: str) -> list[str]:
+        """Return an adb command line addressed to this device."""
+        command = [self.adb_path]
+        if self.serial:
+            command += ["-s", self.serial]
+        return command + list(args)
+
+    async def _communicate(self, command: list[str], timeout: float) -> subprocess.CompletedProcess:
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise subprocess.TimeoutExpired(command, timeout)
+        return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+    async def run(self, command: str, timeout: float = 10) -> Tuple[int, str]:
+        """
+        Run a shell command on the device.
+        Returns (returncode, output) where output contains stdout and stderr.
+        """
+        marker = f"{self._marker}{next(self._counter)}"
+        result = await self._communicate(self.adb_command("shell", f"{{ {command} ; }} 2>&1; echo {marker}$?"), timeout)
+        output, found, returncode = result.stdout.decode("utf-8", errors="replace").rpartition(marker)
+        if not found:
+            raise OSError(f"{command}: {result.stderr.decode('utf-8', errors='replace').strip()}")
+        return int(returncode.strip() or 1), output.replace("\r\n", "\n").rstrip("\n")
+
+    async def exec_out(self, args: list[str], timeout: float = 15) -> subprocess.CompletedProcess:
+        """Run a command whose binary stdout is needed (e.g. screencap) through `adb exec-out`."""
+        return await self._communicate(self.adb_command("exec-out", *args), timeout)
+
+    async def devices_output(self, timeout: float = 10) -> str:
+        """Return the device listing as `serial\\tstate` lines."""
+        result = await self._communicate([self.adb_path, "devices"], timeout)
+        if result.returncode != 0:
+            raise OSError(result.stderr.decode("utf-8", errors="replace").strip())
+        # Skip "List of devices attached" header
+        return "\n".join(result.stdout.decode("utf-8", errors="replace").strip().split("\n")[1:])
+
+    async def close(self):
+        """Nothing to close, every command uses its own adb process."""
+
+
+class AsyncAdbClient:
+    """
+    AdbClient as coroutines: the adb server's smart-socket protocol over asyncio streams.
+    Every request uses its own connection to the server, so many can be in flight on one event loop.
+    """
+
+    def __init__(
+        self,
+        serial: Optional[str] = None,
+        host: str = ADB_SERVER_HOST,
+        port: int = ADB_SERVER_PORT,
+    ):
+        self.serial = serial
+        self.host = host
+        self.port = port
+        self._marker = f"__ADB_CLIENT_{uuid.uuid4().hex}__"
+        self._counter = itertools.count()
+
+    @staticmethod
+    async def _read_exactly(reader: asyncio.StreamReader, size: int) -> bytes:
+        try:
+            return await reader.readexactly(size)
+        except asyncio.IncompleteReadError:
+            raise AdbProtocolError("adb server closed the connection")
+
+    async def _read_hex_string(self, reader: asyncio.StreamReader) -> bytes:
+        length = int(await self._read_exactly(reader, 4), 16)
+        return await self._read_exactly(reader, length)
+
+    async def _request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, payload: str):
+        data = payload.encode("utf-8")
+        writer.write(f"{len(data):04x}".encode("ascii") + data)
+        await writer.drain()
+        status = await self._read_exactly(reader, 4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            message = (await self._read_hex_string(reader)).decode("utf-8", errors="replace")
+            raise AdbProtocolError(f"{payload}: {message}")
+        raise AdbProtocolError(f"{payload}: unexpected response {status!r}")
+
+    async def _service_output(self, service: str) -> bytes:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            transport = f"host:transport:{self.serial}" if self.serial else "host:transport-any"
+            await self._request(reader, writer, transport)
+            await self._request(reader, writer, service)
+            return await reader.read()
+        finally:
+            writer.close()
+
+    async def _host_query(self, service: str, timeout: float) -> str:
+        async def query():
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                await self._request(reader, writer, service)
+                return (await self._read_hex_string(reader)).decode("utf-8", errors="replace")
+            finally:
+                writer.close()
+
+        try:
+            return await asyncio.wait_for(query(), timeout)
+        except asyncio.TimeoutError:
+            raise subprocess.TimeoutExpired(service, timeout)
+
+    async def server_version(self, timeout: float = 10) -> int:
+        """Return the adb server's protocol version (host:version)."""
+        return int(await self._host_query("host:version", timeout), 16)
+
+    async def devices_output(self, timeout: float = 10) -> str:
+        """Return the device listing (host:devices) as `serial\\tstate` lines."""
+        return await self._host_query("host:devices", timeout)
+
+    async def shell(self, command: str, timeout: float = 10) -> bytes:
+        """Run a command with the shell: service and return everything it printed."""
+        try:
+            return await asyncio.wait_for(self._service_output(f"shell:{command}"), timeout)
+        except asyncio.TimeoutError:
+            raise subprocess.TimeoutExpired(command, timeout)
+
+    async def run(self, command: str, timeout: float = 10) -> Tuple[int, str]:
+        """
+        Run a shell command on the device.
+        Returns (returncode, output) where output contains stdout and stderr.
+        """
+        marker = f"{self._marker}{next(self._counter)}"
+        raw = await self.shell(f"{{ {command} ; }} 2>&1; echo {marker}$?", timeout)
+        output, found, returncode = raw.decode("utf-8", errors="replace").rpartition(marker)
+        if not found:
+            raise AdbProtocolError(f"{command}: shell exited without reporting an exit code")
+        return int(returncode.strip() or 1), output.replace("\r\n", "\n").rstrip("\n")
+
+    async def exec_out(self, args: list[str], timeout: float = 15) -> subprocess.CompletedProcess:
+        """Run a command with the exec: service, which returns binary-safe stdout (e.g. screencap)."""
+        command = " ".join(args)
+        try:
+            stdout = await asyncio.wait_for(self._service_output(f"exec:{command}"), timeout)
+        except asyncio.TimeoutError:
+            raise subprocess.TimeoutExpired(command, timeout)
+        except AdbProtocolError as e:
+            return subprocess.CompletedProcess(args, 1, b"", str(e).encode("utf-8"))
+        return subprocess.CompletedProcess(args, 0, stdout, b"")
+
+    async def close(self):
+        """Nothing to close, every request uses its own connection to the server."""
+
+
+AsyncAdbSession = Union[AsyncAdbProcess, AsyncAdbClient]
+
+_async_sessions: dict[Optional[str], AsyncAdbSession] = {}
+_async_session_factory: Callable[[Optional[str]], AsyncAdbSession] = AsyncAdbProcess
+
+
+def set_async_session_factory(factory: Callable[[Optional[str]], AsyncAdbSession]):
+    """Choose how shared async sessions are created, e.g. AsyncAdbClient to use the adb server socket."""
+    global _async_session_factory
+    _async_sessions.clear()
+    _async_session_factory = factory
+
+
+def get_async_session(serial: Optional[str] = None) -> AsyncAdbSession:
+    """Return the shared async session for a device, creating it on first use."""
+    session = _async_sessions.get(serial)
+    if session is None:
+        session = _async_session_factory(serial)
+        _async_sessions[serial] = session
+    return session
+
+
+def forget_async_session(serial: Optional[str] = None):
+    """Drop the shared async session of a device, e.g. when it was unplugged."""
+    _async_sessions.pop(serial, None)
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import Callable, Optional
+
+from src import bot
+from src import constants
+from src import screenshot
+from src.adb_checker import get_connected_devices_async, wait_for_device_async
+from src.adb_commands import send_gestures_async
+from src.async_adb import forget_async_session, get_async_session
+from src.change_detector import create_change_detector
+from src.find_image_result import FindImageResult
+from src.game_action import GameAction
+from src.scheduler import POLLING_POLICIES, PollingScheduler, sleep_async
+from src.session_recorder import SessionRecorder, session_file_name
+
+
+async def run_device(
+    find_matches: Callable,
+    serial: Optional[str] = None,
+    save_screenshots: bool = False,
+    capture_mode: str = screenshot.CAPTURE_MODE_PNG,
+    stop_event: Optional[asyncio.Event] = None,
+    change_detector: str = "mad",
+    polling_policy: str = "adaptive",
+    executor: Optional[Executor] = None,
+    record_session: Optional[str] = None,
+    wait_for_device: bool = False,
+):
+    """
+    The bot loop of bot.run_device as a coroutine.
+    Capturing and tapping wait on the event loop, matching runs on the executor (the loop's default
+    thread pool if None), so one event loop can drive several phones.
+    With wait_for_device, waits until the phone answers over ADB before the first capture.
+    Runs until stop_event is set or the task is cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    session = get_async_session(serial)
+    log_prefix = f"[{serial}] " if serial else ""
+    screenshot_file_name = constants.SCREENSHOT_FILE_NAME
+    if serial:
+        screenshot_file_name = screenshot_file_name.replace(".png", f".{serial}.png")
+
+    detector = create_change_detector(change_detector)
+    scheduler = PollingScheduler(POLLING_POLICIES[polling_policy])
+    delayed_tap: Optional[asyncio.Task] = None
+    recorder = SessionRecorder(session_file_name(record_session, serial), serial) if record_session else None
+    waiting_for_device = False
+
+    async def tap_now(img_name: str, result: FindImageResult, action: GameAction, delay: float = 0.0):
+        if delay > 0:
+            await asyncio.sleep(delay)
+        logging.info(f"{log_prefix}Tapping {img_name} at {result.coords} (confidence {result.val*100:.2f}%)")
+        await send_gestures_async(bot.gestures_for_tap(img_name, result, action), session=session)
+        scheduler.tapped()
+
+    try:
+        if wait_for_device and not await wait_for_device_async(None, session, serial=serial, stop_event=stop_event):
+            return
+
+        while stop_event is None or not stop_event.is_set():
+            await scheduler.wait_async(stop_event)
+
+            frame = await screenshot.capture_frame_async(capture_mode, session=session)
+            if frame is None:
+                if not waiting_for_device:
+                    logging.info(f"{log_prefix}Error capturing screenshot. Waiting until phone is connected.")
+                    waiting_for_device = True
+                await sleep_async(5, stop_event)
+                continue
+
+            waiting_for_device = False
+            scheduler.captured()
+
+            # Writing to disk is only a debug sink
+            if save_screenshots:
+                await asyncio.to_thread(screenshot.save_frame, frame, screenshot_file_name)
+
+            # Change detection and matching run on the executor, the decision is shared with bot.run_device
+            decision = await loop.run_in_executor(
+                executor, bot.process_frame, frame, detector, find_matches, recorder, log_prefix
+            )
+            if decision is None:
+                scheduler.schedule(changed=False)
+                continue
+
+            tapped = False
+            tap = decision.tap
+            if tap is not None and delayed_tap is not None and not delayed_tap.done():
+                logging.debug(f"{log_prefix}A delayed tap is pending; skipping tap on {tap[0]}.")
+            elif tap is not None:
+                img_name, result, action = tap
+                if action.delay_before_tap > 0:
+                    logging.info(f"{log_prefix}Tapping {img_name} in {action.delay_before_tap} seconds...")
+                    delayed_tap = asyncio.create_task(tap_now(img_name, result, action, action.delay_before_tap))
+                else:
+                    await tap_now(img_name, result, action)
+                    tapped = True
+
+            scheduler.schedule(changed=True, scene=decision.scene, tapped=tapped)
+            logging.debug(f"{log_prefix}Capture cadence: {scheduler.cadence()}")
+    finally:
+        if delayed_tap is not None:
+            delayed_tap.cancel()
+        if recorder is not None:
+            await asyncio.to_thread(recorder.close)
+
+
+async def run_fleet(
+    make_find_matches: Callable[[], Callable],
+    poll_interval: float = 5,
+    stop_event: Optional[asyncio.Event] = None,
+    **device_kwargs,
+):
+    """
+    Like FleetRunner, with one task per connected phone on the event loop instead of a thread.
+    make_find_matches returns the find_matches function of a new phone.
+    Phones that are plugged in or removed are picked up every poll_interval seconds.
+    """
+    tasks: dict[str, asyncio.Task] = {}
+    try:
+        while stop_event is None or not stop_event.is_set():
+            success, serials = await get_connected_devices_async()
+            if not success:
+                logging.warning("Failed to query ADB devices. Keeping the current bot loops.")
+            else:
+                for serial in serials:
+                    task = tasks.get(serial)
+                    if task is None or task.done():
+                        tasks[serial] = asyncio.create_task(
+                            run_device(make_find_matches(), serial=serial, stop_event=stop_event, **device_kwargs),
+                            name=f"bot-{serial}",
+                        )
+                        logging.info(f"Device {serial} connected. Started bot loop.")
+                for serial in list(tasks):
+                    if serial not in serials:
+                        tasks.pop(serial).cancel()
+                        forget_async_session(serial)
+                        logging.info(f"Device {serial} disconnected. Stopped bot loop.")
+
+            await sleep_async(poll_interval, stop_event)
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+
+async def run(make_find_matches: Callable[[], Callable], fleet: bool = False, skip_adb_check: bool = False, **device_kwargs):
+    """
+    Entry point of the asyncio runtime: one phone, or with fleet every connected phone.
+    Unless skip_adb_check, every bot loop waits until its phone answers over ADB, for as long as it takes
+    (like bot.run_device, which keeps capturing until the phone is connected).
+    """
+    device_kwargs["wait_for_device"] = not skip_adb_check
+    if fleet:
+        await run_fleet(make_find_matches, **device_kwargs)
+        return
+
+    await run_device(make_find_matches(), **device_kwargs)
@@ -1,88 +1,407 @@
-import sys
+import json
 import time
 import logging
-import hashlib
+import threading
+from typing import Callable, Optional
+
+from attrs import define
 
 from src import constants
+from src import image_service
 from src import screenshot
-from src.adb_commands import send_adb_tap, turn_screen_off
-from src.game_action import GameActions
-from src.image_decision_maker import find_images_over_threshold
-from src.image_template_loader import load_image_templates
+from src.adb_commands import Gesture, GestureQueue, tap
+from src.adb_session import get_session
+from src.change_detector import ChangeDetector, create_change_detector
+from src.find_image_result import FindImageResult
+from src.frame import Frame
+from src.game_action import GameAction
+from src.image_decision_maker import (
+    DecisionCache,
+    analyze_results_and_return_action,
+    analyze_results_and_return_action_with_priority,
+    find_images_over_threshold,
+    find_priority_match,
+    is_screen_to_attack,
+)
+from src.image_template_loader import load_image_templates, read_template_sources
+from src.metrics import STAGE_DECISION, STAGE_MATCH, span
+from src.roi_index import RoiIndex
+from src.scene_tracker import SceneTracker, scene_of
+from src.scheduler import POLLING_POLICIES, DelayedTaps, PollingScheduler
+from src.session_recorder import SessionRecorder, session_file_name
+from src.template_pack import content_hash
+
+
+def wait(seconds: float, stop_event: Optional[threading.Event] = None):
+    """Sleep, but wake up early if the loop is asked to stop."""
+    if stop_event is None:
+        time.sleep(seconds)
+    else:
+        stop_event.wait(seconds)
+
+
+def run(
+    skip_adb_check=False,
+    save_screenshots=False,
+    capture_mode=screenshot.CAPTURE_MODE_PNG,
+    fleet=False,
+    adb_client=None,
+    use_regions=True,
+    pyramid_factor=1,
+    change_detector="mad",
+    use_scenes=True,
+    priority_matching=False,
+    batched_matching=False,
+    pipelined=False,
+    polling_policy="adaptive",
+    async_runtime=False,
+    record_session=None,
+    downscale=1,
+    decision_cache=None,
+):
+    if fleet and not async_runtime:
+        # One bot loop per connected phone, sharing a matching process pool
+        from src.fleet import FleetRunner
+        FleetRunner(
+            save_screenshots=save_screenshots,
+            capture_mode=capture_mode,
+            adb_client=adb_client,
+            use_regions=use_regions,
+            pyramid_factor=pyramid_factor,
+            change_detector=change_detector,
+            use_scenes=use_scenes,
+            priority_matching=priority_matching,
+            batched_matching=batched_matching,
+            pipelined=pipelined,
+            polling_policy=polling_policy,
+            record_session=record_session,
+            downscale=downscale,
+            decision_cache=decision_cache,
+        ).run()
+        return
+
+    template_images = load_image_templates()
+    roi_index = RoiIndex.load() if use_regions else None
+    make_find_matches = find_matches_factory(
+        template_images,
+        roi_index=roi_index,
+        pyramid_factor=pyramid_factor,
+        use_scenes=use_scenes,
+        priority_matching=priority_matching,
+        batched_matching=batched_matching,
+        downscale=downscale,
+        decision_cache=decision_cache,
+    )
+
+    if async_runtime:
+        # One event loop for capturing, tapping and device checks of all phones
+        import asyncio
+        from src import async_bot
+        asyncio.run(async_bot.run(
+            make_find_matches,
+            fleet=fleet,
+            skip_adb_check=skip_adb_check,
+            save_screenshots=save_screenshots,
+            capture_mode=capture_mode,
+            change_detector=change_detector,
+            polling_policy=polling_policy,
+            record_session=record_session,
+        ))
+        return
+
+    find_matches = make_find_matches()
+    if pipelined:
+        from src.pipeline import run_device_pipelined
+        run_device_pipelined(
+            find_matches,
+            save_screenshots=save_screenshots,
+            capture_mode=capture_mode,
+            change_detector=change_detector,
+            polling_policy=polling_policy,
+            record_session=record_session,
+        )
+        return
+
+    run_device(
+        find_matches,
+        save_screenshots=save_screenshots,
+        capture_mode=capture_mode,
+        change_detector=change_detector,
+        polling_policy=polling_policy,
+        record_session=record_session,
+    )
+
+
+def find_matches_factory(
+    template_images: dict,
+    roi_index: Optional[RoiIndex] = None,
+    pyramid_factor: int = 1,
+    use_scenes: bool = True,
+    priority_matching: bool = False,
+    batched_matching: bool = False,
+    downscale: int = 1,
+    decision_cache: Optional[DecisionCache] = None,
+) -> Callable[[], Callable]:
+    """
+    Return a function that creates the find_matches function of a phone (see run_device)
+    for the matching options of bot.run.
+    """
+
+    def find_images(image, template_names=None):
+        if priority_matching:
+            # Only the match the priority list acts on, lower priority templates are not matched
+            match = find_priority_match(
+                template_images,
+                image,
+                roi_index=roi_index,
+                pyramid_factor=pyramid_factor,
+                template_names=template_names,
+                batched=batched_matching,
+            )
+            return [match] if match else []
+        return find_images_over_threshold(
+            template_images,
+            image,
+            roi_index=roi_index,
+            pyramid_factor=pyramid_factor,
+            template_names=template_names,
+            batched=batched_matching,
+        )
+
+    def make_find_matches():
+        # Every phone tracks its own scene
+        if not use_scenes:
+            return cached_find_matches(downscaled_find_matches(find_images, downscale), decision_cache)
+        scene_tracker = SceneTracker(template_images)
+        find_matches = downscaled_find_matches(lambda image: scene_tracker.find_matches(find_images, image), downscale)
+        return cached_find_matches(find_matches, decision_cache, scene_tracker)
+
+    return make_find_matches
+
+
+def decision_cache_fingerprint(**matching_options) -> str:
+    """What the decisions of a DecisionCache depend on: the template images and the matching options."""
+    return f"{content_hash(read_template_sources())}:{json.dumps(matching_options, sort_keys=True)}"
+
+
+def downscaled_find_matches(find_matches: Callable, factor: int) -> Callable:
+    """
+    Wrap find_matches to match on the screenshot downscaled by factor (area averaged), against templates
+    rescaled to that size (see image_service.templates_for_screen). The matches are scaled back up to
+    the pixels of the screen, so everything after matching, taps included, works at full resolution.
+    """
+    if factor == 1:
+        return find_matches
+
+    def find_downscaled(image):
+        matches = find_matches(image_service.downscale(image, factor))
+        return [(img_name, image_service.upscale_result(result, factor)) for img_name, result in matches]
+
+    return find_downscaled
+
+
+def cached_find_matches(
+    find_matches: Callable, decision_cache: Optional[DecisionCache], scene_tracker: Optional[SceneTracker] = None
+) -> Callable:
+    """
+    Wrap find_matches to skip matching for screens the decision cache knows (see DecisionCache).
+    Matched screens are remembered with their matches and the GameAction of the priority list.
+    The scene tracker that find_matches updates is updated with the remembered matches on a hit,
+    so it follows the screens that were not matched.
+    """
+    if decision_cache is None:
+        return find_matches
 
-last_hash = None
+    def find_cached(image):
+        cached = decision_cache.get(image)
+        if cached is not None:
+            logging.debug(f"Screen decided before, reusing {len(cached.matches)} matches.")
+            if scene_tracker is not None:
+                scene_tracker.update(cached.matches)
+            return cached.matches
+        matches = find_matches(image)
+        action = analyze_results_and_return_action_with_priority(matches, image_service.screen_scale(image.shape))
+        decision_cache.put(image, matches, action)
+        return matches
 
-def hash_image(path):
-    with open(path, 'rb') as f:
-        return hashlib.md5(f.read()).hexdigest()
+    return find_cached
 
-def run(skip_adb_check=False):
-    global last_hash 
+
+def choose_tap(matches: list[tuple[str, FindImageResult]], scale: float = 1.0) -> Optional[tuple[str, FindImageResult, GameAction]]:
+    """
+    Pick the best match with y > 296 from the sorted matches, with the GameAction that decides the delay.
+    scale is the factor of the screen to the reference resolution (see image_service.screen_scale).
+    Returns None if no match can be tapped.
+    """
+    for img_name, result in matches:
+        if result.coords[1] > constants.MIN_TAP_Y * scale:
+            # Use GameAction decision for delay
+            return img_name, result, analyze_results_and_return_action(img_name, result, scale)
+    return None
+
+
+def gestures_for_tap(img_name: str, result: FindImageResult, action: GameAction) -> list[Gesture]:
+    """
+    The gestures to send for a chosen tap (see choose_tap): on a screen to attack, a burst of
+    ATTACK_TAPS taps at the attack position, otherwise one tap on the match.
+    """
+    if is_screen_to_attack(img_name):
+        x, y = action.position
+        return [tap(x, y, constants.ATTACK_TAP_INTERVAL) for _ in range(constants.ATTACK_TAPS)]
+    return [tap(result.coords[0], result.coords[1])]
+
+
+@define(frozen=True)
+class FrameDecision:
+    matches: list[tuple[str, FindImageResult]]
+    tap: Optional[tuple[str, FindImageResult, GameAction]]  # See choose_tap, None if nothing is tapped
+
+    @property
+    def scene(self) -> Optional[str]:
+        """The scene of the best match, for the polling scheduler."""
+        return scene_of(self.matches[0][0]) if self.matches else None
+
+
+def match_frame(
+    frame: Frame, find_matches: Callable, recorder: Optional[SessionRecorder] = None, log_prefix: str = ""
+) -> FrameDecision:
+    """
+    The step of the bot loops for a frame that changed: match, choose the tap and record the frame.
+    Matching and the decision are timed in the metrics.
+    """
+    logging.info(f"{log_prefix}Running image matching...")
+    with span(STAGE_MATCH):
+        matches = find_matches(frame.gray)
+    logging.info(f"{log_prefix}Found images over threshold: {matches}")
+
+    with span(STAGE_DECISION):
+        tap = choose_tap(matches, image_service.screen_scale(frame.gray.shape))
+    if recorder is not None:
+        recorder.record(frame, matches, tap[2] if tap is not None else GameAction())
+    if tap is None and matches:
+        logging.info(f"{log_prefix}No matches with y > 296 found; skipping tap.")
+    return FrameDecision(matches, tap)
+
+
+def process_frame(
+    frame: Frame,
+    detector: ChangeDetector,
+    find_matches: Callable,
+    recorder: Optional[SessionRecorder] = None,
+    log_prefix: str = "",
+) -> Optional[FrameDecision]:
+    """
+    The step of the bot loops for a captured frame: skip it if the change detector considers it unchanged,
+    otherwise match_frame. Returns None for an unchanged frame.
+    """
+    change = detector.detect(frame.gray)
+    if not change.changed:
+        return None
+    logging.debug(f"{log_prefix}Screenshot changed in {len(change.changed_tiles)} tiles: {change.changed_region()}")
+    return match_frame(frame, find_matches, recorder, log_prefix)
+
+
+def dispatch_tap(
+    tap: Optional[tuple[str, FindImageResult, GameAction]],
+    delayed_taps: DelayedTaps,
+    tap_now: Callable[[tuple[str, FindImageResult, GameAction]], None],
+    log_prefix: str = "",
+) -> bool:
+    """
+    Send the chosen tap with tap_now, or on a timer of delayed_taps if it has a delay_before_tap.
+    While a delayed tap is pending no other tap is sent.
+    Returns True if the tap was sent right away.
+    """
+    if tap is None:
+        return False
+    if delayed_taps.pending():
+        logging.debug(f"{log_prefix}A delayed tap is pending; skipping tap on {tap[0]}.")
+        return False
+    img_name, _, action = tap
+    if action.delay_before_tap > 0:
+        logging.info(f"{log_prefix}Tapping {img_name} in {action.delay_before_tap} seconds...")
+        delayed_taps.schedule(action.delay_before_tap, lambda: tap_now(tap))
+        return False
+    tap_now(tap)
+    return True
+
+
+def run_device(
+    find_matches: Callable,
+    serial: Optional[str] = None,
+    save_screenshots=False,
+    capture_mode=screenshot.CAPTURE_MODE_PNG,
+    stop_event: Optional[threading.Event] = None,
+    change_detector: str = "mad",
+    polling_policy: str = "adaptive",
+    record_session: Optional[str] = None,
+):
+    """
+    The bot loop for one phone: capture, match, tap.
+    find_matches takes a greyscale image and returns the sorted matches over threshold.
+    Frames that the change detector (see change_detector.CHANGE_DETECTORS) considers unchanged are skipped.
+    When the next screenshot is captured is decided by the polling policy (see scheduler.POLLING_POLICIES),
+    taps with a delay are sent by a timer while the loop goes on. Taps are sent by a GestureQueue, so the loop
+    does not wait for the device.
+    With record_session, the matched frames and decisions are recorded to that file (see session_recorder).
+    Runs until stop_event is set (forever if there is none).
+    """
     time_to_stay_in_game = 3
     start_time = time.time()
-    template_images = load_image_templates()
+    session = get_session(serial)
+    log_prefix = f"[{serial}] " if serial else ""
+    screenshot_file_name = constants.SCREENSHOT_FILE_NAME
+    if serial:
+        screenshot_file_name = screenshot_file_name.replace(".png", f".{serial}.png")
 
+    detector = create_change_detector(change_detector)
+    scheduler = PollingScheduler(POLLING_POLICIES[polling_policy])
+    delayed_taps = DelayedTaps()
+    recorder = SessionRecorder(session_file_name(record_session, serial), serial) if record_session else None
+    gestures = GestureQueue(session, name=f"gestures-{serial}" if serial else "gestures")
     game_entered = False
     waiting_for_device = False
 
-    while True:
-        # Capture screenshot
-        if not screenshot.capture_screenshot(constants.SCREENSHOT_FILE_NAME):
-            if waiting_for_device:
-                print(".", end="", flush=True)
-            else:
-                logging.info("Error capturing screenshot. Waiting until phone is connected.")
-                waiting_for_device = True
-            time.sleep(5)
-            continue
-
-        if waiting_for_device:
+    def tap_now(tap: tuple[str, FindImageResult, GameAction]):
+        img_name, result, _ = tap
+        logging.info(f"{log_prefix}Tapping {img_name} at {result.coords} (confidence {result.val*100:.2f}%)")
+        gestures.submit(*gestures_for_tap(*tap))
+        scheduler.tapped()
+
+    try:
+        while stop_event is None or not stop_event.is_set():
+            scheduler.wait(stop_event)
+
+            # Capture screenshot into memory
+            frame = screenshot.capture_frame(capture_mode, session=session)
+            if frame is None:
+                if waiting_for_device:
+                    print(".", end="", flush=True)
+                else:
+                    logging.info(f"{log_prefix}Error capturing screenshot. Waiting until phone is connected.")
+                    waiting_for_device = True
+                wait(5, stop_event)
+                continue
+
             waiting_for_device = False
-            new_hash = hash_image(constants.SCREENSHOT_FILE_NAME)
-            if new_hash == last_hash:
-                time.sleep(2.5)
+            scheduler.captured()
+
+            # Writing to disk is only a debug sink
+            if save_screenshots:
+                screenshot.save_frame(frame, screenshot_file_name)
+
+            # Frame-skip: skip processing if screenshot hasn't changed enough since the last processed one
+            decision = process_frame(frame, detector, find_matches, recorder, log_prefix)
+            if decision is None:
+                interval = scheduler.schedule(changed=False)
+                logging.debug(f"{log_prefix}Screenshot unchanged. Next capture in {interval:.2f} seconds.")
                 continue
-            last_hash = new_hash
-
-        # Frame-skip: skip processing if screenshot hasn't changed
-        new_hash = hash_image(constants.SCREENSHOT_FILE_NAME)
-        logging.debug(f"Screenshot hash: {new_hash}")
-        if new_hash == last_hash:
-            time.sleep(2.5)
-            continue
-        last_hash = new_hash
-
-        # --- NEW LOGIC: Pick best match with y > 296, or second best if top is not valid ---
-        logging.info("Running image matching...")
-
-        # Get all matches above threshold (assuming this returns sorted list of (img_name, FindImageResult))
-        matches = find_images_over_threshold(template_images, constants.SCREENSHOT_FILE_NAME)
-        logging.info(f"Found images over threshold: {matches}")
-
-        tapped = False
-        for img_name, result in matches:
-            if result.coords[1] > 296:
-                # Use GameAction decision for delay
-                from src.image_decision_maker import analyze_results_and_return_action
-                action = analyze_results_and_return_action(img_name, result)
-                if getattr(action, "delay_before_tap", 0.0) > 0:
-                    logging.info(f"Waiting {action.delay_before_tap} seconds before tapping for '{img_name}'...")
-                    time.sleep(action.delay_before_tap)
-                logging.info(f"Tapping {img_name} at {result.coords} (confidence {result.val*100:.2f}%)")
-                send_adb_tap(result.coords[0], result.coords[1])
-                tapped = True
-                break  # only tap the best match with y > 296
-
-        if not tapped and matches:
-            # log a warning if no valid taps found
-            logging.info(f"No matches with y > 296 found; skipping tap.")
-
-        # Exit logic if needed
-        # (implement your exit logic here as before)
-        # Example:
-        # if some_exit_condition:
-        #     turn_screen_off()
-        #     logging.info("Max number of games played. Exit program.")
-        #     sys.exit()
-
-        time.sleep(1.5)
+
+            tapped = dispatch_tap(decision.tap, delayed_taps, tap_now, log_prefix)
+            scheduler.schedule(changed=True, scene=decision.scene, tapped=tapped)
+            logging.debug(f"{log_prefix}Capture cadence: {scheduler.cadence()}")
+    finally:
+        delayed_taps.cancel()
+        gestures.close()
+        if recorder is not None:
+            recorder.close()
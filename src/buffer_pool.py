@@ -0,0 +1,84 @@
+import sys
+import threading
+
+import numpy as np
+
+
+class BufferPool:
+    """
+    Scratch arrays for the dst/result out-parameters of OpenCV, reused from frame to frame instead of
+    allocating a new array per call (e.g. a float32 result map per template and frame in find_image).
+    Every thread has its own buffers, since templates are matched on several threads, and a buffer per
+    slot for arrays that are in use at the same time. A buffer only grows: smaller arrays are views
+    into it, which OpenCV writes to in place. Once the largest shapes were seen, no more allocations happen.
+    Arrays that outlive the call, like the greyscale image of a frame, come from acquire instead.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.allocations = 0  # Buffers allocated or grown, stays constant in the steady state
+        self._local = threading.local()
+        self._shared: list[np.ndarray] = []
+        self._shared_lock = threading.Lock()
+
+    def get(self, shape: tuple[int, int], dtype=np.float32, slot: int = 0) -> np.ndarray | None:
+        """
+        An array of shape to pass as OpenCV out-parameter, valid until the next get of the same
+        slot on this thread. None if the pool is disabled or the shape is empty, so OpenCV allocates
+        the array itself (or reports the error).
+        """
+        if not self.enabled or min(shape) < 1:
+            return None
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            buffers = self._local.buffers = {}
+        key = (slot, np.dtype(dtype))
+        buffer = buffers.get(key)
+        height, width = shape
+        if buffer is None or buffer.shape[0] < height or buffer.shape[1] < width:
+            if buffer is not None:
+                height, width = max(height, buffer.shape[0]), max(width, buffer.shape[1])
+            buffer = buffers[key] = np.empty((height, width), dtype=dtype)
+            self.allocations += 1
+        return buffer[:shape[0], :shape[1]]
+
+    def acquire(self, shape: tuple[int, ...], dtype=np.uint8) -> np.ndarray | None:
+        """
+        An array of shape for an OpenCV dst that is kept beyond the call, e.g. a frame converted to greyscale.
+        It is not handed out again while it or any view of it is referenced, from whichever thread,
+        so frames queued for matching or read by a timed-out worker keep their pixels.
+        None if the pool is disabled or the shape is empty, like get.
+        """
+        if not self.enabled or min(shape) < 1:
+            return None
+        dtype = np.dtype(dtype)
+        with self._shared_lock:
+            free = []
+            for buffer in self._shared:
+                # Only referenced by the list, the loop variable and the argument of getrefcount:
+                # every view of the buffer holds a reference to it, so none is left
+                if sys.getrefcount(buffer) == 3:
+                    if buffer.shape == shape and buffer.dtype == dtype:
+                        return buffer[...]
+                    free.append(buffer)
+            # Free buffers of other shapes are not needed any more, e.g. after the phone rotated
+            for buffer in free:
+                self._shared.remove(buffer)
+            buffer = np.empty(shape, dtype=dtype)
+            self._shared.append(buffer)
+            self.allocations += 1
+            return buffer[...]
+
+    def clear(self):
+        """Release the buffers of this thread and the free acquired buffers."""
+        self._local.buffers = {}
+        with self._shared_lock:
+            self._shared = [buffer for buffer in self._shared if sys.getrefcount(buffer) > 3]
+
+
+_buffer_pool = BufferPool()
+
+
+def get_buffer_pool() -> BufferPool:
+    """Return the buffer pool shared by all matching functions."""
+    return _buffer_pool
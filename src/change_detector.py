@@ -0,0 +1,194 @@
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import Optional
+
+import cv2
+import numpy as np
+from attrs import define, field
+
+from src.metrics import STAGE_CHANGE_DETECTION, span
+
+
+@define(frozen=True)
+class FrameChange:
+    changed: bool
+    changed_tiles: list[tuple[int, int, int, int]] = field(factory=list)  # (x, y, width, height) in pixels
+
+    def changed_region(self) -> Optional[tuple[int, int, int, int]]:
+        """Bounding box (x0, y0, x1, y1) of all changed tiles, or None if nothing changed."""
+        if not self.changed_tiles:
+            return None
+        x0 = min(x for x, _, _, _ in self.changed_tiles)
+        y0 = min(y for _, y, _, _ in self.changed_tiles)
+        x1 = max(x + w for x, _, w, _ in self.changed_tiles)
+        y1 = max(y + h for _, y, _, h in self.changed_tiles)
+        return x0, y0, x1, y1
+
+
+class ChangeDetector(ABC):
+    """
+    Decides whether a frame is different enough from the last processed frame to be matched again.
+    The frame is split into a grid of tiles; every tile gets a compact signature and a tile counts as
+    changed if its signature differs too much from the reference. The reference is the last frame
+    that was reported as changed, so slow drift can not hide a change.
+    A frame is reported as changed anyway once the reference is max_age seconds old, so a screen that
+    stays the same because a tap got lost (or a dialog needs a second tap) is matched and tapped again.
+    """
+
+    def __init__(self, columns: int = 4, rows: int = 8, min_changed_tiles: int = 1, max_age: Optional[float] = 15.0):
+        self.columns = columns
+        self.rows = rows
+        self.min_changed_tiles = min_changed_tiles
+        self.max_age = max_age
+        self._reference = None
+        self._reference_at = 0.0
+
+    def reset(self):
+        self._reference = None
+
+    @abstractmethod
+    def _signatures(self, gray: np.ndarray):
+        """Return the signatures of all tiles of a greyscale frame."""
+
+    @abstractmethod
+    def _changed(self, reference, signatures) -> np.ndarray:
+        """Return a (rows, columns) boolean array of the tiles that changed."""
+
+    def _tile_rects(self, shape: tuple[int, int]) -> list[list[tuple[int, int, int, int]]]:
+        height, width = shape[:2]
+        xs = [width * column // self.columns for column in range(self.columns + 1)]
+        ys = [height * row // self.rows for row in range(self.rows + 1)]
+        return [
+            [(xs[column], ys[row], xs[column + 1] - xs[column], ys[row + 1] - ys[row]) for column in range(self.columns)]
+            for row in range(self.rows)
+        ]
+
+    def detect(self, gray: np.ndarray, now: Optional[float] = None) -> FrameChange:
+        now = time.monotonic() if now is None else now
+        if self.max_age is not None and self._reference is not None and now - self._reference_at > self.max_age:
+            self.reset()
+        with span(STAGE_CHANGE_DETECTION):
+            signatures = self._signatures(gray)
+        if self._reference is None or self._reference[0] != gray.shape:
+            self._reference = (gray.shape, signatures)
+            self._reference_at = now
+            rects = self._tile_rects(gray.shape)
+            return FrameChange(True, [rect for row in rects for rect in row])
+
+        changed = self._changed(self._reference[1], signatures)
+        if np.count_nonzero(changed) < self.min_changed_tiles:
+            return FrameChange(False)
+
+        self._reference = (gray.shape, signatures)
+        self._reference_at = now
+        rects = self._tile_rects(gray.shape)
+        rows, columns = np.nonzero(changed)
+        return FrameChange(True, [rects[row][column] for row, column in zip(rows, columns)])
+
+
+class DHashChangeDetector(ChangeDetector):
+    """
+    Difference hash per tile: every tile is averaged down to 9x8 pixels and each bit says whether
+    a pixel is brighter than its right neighbour. A tile changed if more than max_distance of its
+    64 bits flipped, so compression noise and small animations are ignored.
+    """
+
+    def __init__(
+        self, columns: int = 4, rows: int = 8, min_changed_tiles: int = 1, max_distance: int = 6, max_age: Optional[float] = 15.0
+    ):
+        super().__init__(columns, rows, min_changed_tiles, max_age)
+        self.max_distance = max_distance
+
+    def _signatures(self, gray):
+        small = cv2.resize(gray, (self.columns * 9, self.rows * 8), interpolation=cv2.INTER_AREA)
+        small = small.reshape(self.rows, 8, self.columns, 9).astype(np.int16)
+        return small[:, :, :, 1:] > small[:, :, :, :-1]  # (rows, 8, columns, 8) bits
+
+    def _changed(self, reference, signatures):
+        distances = np.count_nonzero(reference != signatures, axis=(1, 3))
+        return distances > self.max_distance
+
+
+class TileChecksumChangeDetector(ChangeDetector):
+    """
+    CRC32 per tile of the frame, downscaled by factor and with the lowest quantization_bits of every
+    pixel dropped. Any difference that survives downscaling and quantization marks the tile as changed.
+    With factor 1 and quantization_bits 0 this is an exact comparison.
+    """
+
+    def __init__(
+        self,
+        columns: int = 4,
+        rows: int = 8,
+        min_changed_tiles: int = 1,
+        factor: int = 4,
+        quantization_bits: int = 3,
+        max_age: Optional[float] = 15.0,
+    ):
+        super().__init__(columns, rows, min_changed_tiles, max_age)
+        self.factor = factor
+        self.quantization_bits = quantization_bits
+
+    def _signatures(self, gray):
+        small = gray
+        if self.factor > 1:
+            height, width = gray.shape
+            small = cv2.resize(gray, (width // self.factor, height // self.factor), interpolation=cv2.INTER_AREA)
+        small = small >> self.quantization_bits
+        return np.array([
+            [zlib.crc32(np.ascontiguousarray(small[y:y + h, x:x + w])) for x, y, w, h in row]
+            for row in self._tile_rects(small.shape)
+        ])
+
+    def _changed(self, reference, signatures):
+        return reference != signatures
+
+
+class MeanAbsDiffChangeDetector(ChangeDetector):
+    """
+    Mean absolute difference per tile between the frame and the reference frame, both downscaled
+    by factor. A tile changed if its pixels differ by more than threshold grey levels on average.
+    """
+
+    def __init__(
+        self,
+        columns: int = 4,
+        rows: int = 8,
+        min_changed_tiles: int = 1,
+        factor: int = 4,
+        threshold: float = 3.0,
+        max_age: Optional[float] = 15.0,
+    ):
+        super().__init__(columns, rows, min_changed_tiles, max_age)
+        self.factor = factor
+        self.threshold = threshold
+
+    def _signatures(self, gray):
+        height, width = gray.shape
+        # Crop to a multiple of the grid so tiles can be averaged with one reshape
+        tile_w = width // self.factor // self.columns
+        tile_h = height // self.factor // self.rows
+        small = cv2.resize(gray, (width // self.factor, height // self.factor), interpolation=cv2.INTER_AREA)
+        return small[:tile_h * self.rows, :tile_w * self.columns].astype(np.int16)
+
+    def _changed(self, reference, signatures):
+        difference = np.abs(signatures - reference)
+        tile_h, tile_w = difference.shape[0] // self.rows, difference.shape[1] // self.columns
+        means = difference.reshape(self.rows, tile_h, self.columns, tile_w).mean(axis=(1, 3))
+        return means > self.threshold
+
+
+CHANGE_DETECTORS = {
+    "dhash": DHashChangeDetector,
+    "tiles": TileChecksumChangeDetector,
+    "mad": MeanAbsDiffChangeDetector,
+}
+
+
+def create_change_detector(name: str, **kwargs) -> ChangeDetector:
+    """Create a change detector by name (see CHANGE_DETECTORS)."""
+    try:
+        return CHANGE_DETECTORS[name](**kwargs)
+    except KeyError:
+        raise ValueError(f"Unknown change detector {name}. Choose one of {', '.join(CHANGE_DETECTORS)}.")
@@ -1,3 +1,9 @@
 import os
+# Positions are in pixels of the reference resolution (see image_service.REFERENCE_RESOLUTION)
 ATTACK_TAP_POSITION = (500, 1400)
+# Taps per screen to attack and seconds between them, sent to the device as one batch
+ATTACK_TAPS = 5
+ATTACK_TAP_INTERVAL = 0.1
+# Matches above this line are not tapped
+MIN_TAP_Y = 296
 SCREENSHOT_FILE_NAME = os.path.join("screenshots", "screenshot.png")
@@ -0,0 +1,194 @@
+import logging
+import re
+import socketserver
+import threading
+from typing import Callable, Optional, Tuple
+
+# Shell commands wrapped by AdbClient.run/AdbSession.run: "{ cmd ; } 2>&1; echo MARKER$?"
+WRAPPED_COMMAND = re.compile(r"^\{ (?P<command>.*) ; \} 2>&1; echo (?P<marker>\S+?)(?P<separator> ?)\$\?$", re.DOTALL)
+
+
+class FakeDevice:
+    """
+    A device served by FakeAdbServer.
+    Records every shell command and answers `echo`, `input` and `screencap`
+    the way a phone would; other commands can be answered with custom handlers.
+    """
+
+    def __init__(
+        self,
+        serial: str,
+        state: str = "device",
+        screencap_png: bytes = b"",
+        screencap_raw: bytes = b"",
+    ):
+        self.serial = serial
+        self.state = state
+        self.screencap_png = screencap_png
+        self.screencap_raw = screencap_raw
+        self.commands: list[str] = []
+        self.handlers: dict[str, Callable[[str], Tuple[int, str]]] = {}
+        self._lock = threading.Lock()
+
+    def execute(self, command: str) -> Tuple[int, str]:
+        """
+        Run a shell command line, several commands separated by ";" one after another.
+        `$?` in an echo is the exit code of the previous command. Returns (returncode, output).
+        """
+        returncode, output = 0, ""
+        for part in command.split(";"):
+            part = part.strip()
+            if part.startswith("echo "):
+                part = part.replace("$?", str(returncode))
+            returncode, part_output = self._execute_one(part)
+            output += part_output
+        return returncode, output
+
+    def _execute_one(self, command: str) -> Tuple[int, str]:
+        with self._lock:
+            self.commands.append(command)
+        for prefix, handler in self.handlers.items():
+            if command.startswith(prefix):
+                return handler(command)
+        if command.startswith("echo "):
+            return 0, command[len("echo "):] + "\n"
+        if command.startswith("input "):
+            return 0, ""
+        if command.startswith("sleep "):
+            return 0, ""
+        return 127, f"/system/bin/sh: {command.split()[0]}: inaccessible or not found\n"
+
+    def shell(self, command: str) -> bytes:
+        wrapped = WRAPPED_COMMAND.match(command)
+        if not wrapped:
+            return self.execute(command)[1].encode("utf-8")
+        returncode, output = self.execute(wrapped.group("command"))
+        return f"{output}{wrapped.group('marker')}{wrapped.group('separator')}{returncode}\n".encode("utf-8")
+
+    def exec(self, command: str) -> bytes:
+        with self._lock:
+            self.commands.append(command)
+        if command == "screencap -p":
+            return self.screencap_png
+        if command == "screencap":
+            return self.screencap_raw
+        return self.shell(command)
+
+
+class _AdbRequestHandler(socketserver.BaseRequestHandler):
+
+    def _read_request(self) -> Optional[str]:
+        header = self._recv_exactly(4)
+        if header is None:
+            return None
+        payload = self._recv_exactly(int(header, 16))
+        return None if payload is None else payload.decode("utf-8")
+
+    def _recv_exactly(self, size: int) -> Optional[bytes]:
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return None
+            data.extend(chunk)
+        return bytes(data)
+
+    def _okay(self, payload: Optional[bytes] = None):
+        response = b"OKAY"
+        if payload is not None:
+            response += f"{len(payload):04x}".encode("ascii") + payload
+        self.request.sendall(response)
+
+    def _fail(self, message: str):
+        data = message.encode("utf-8")
+        self.request.sendall(b"FAIL" + f"{len(data):04x}".encode("ascii") + data)
+
+    def handle(self):
+        server: FakeAdbServer = self.server.fake
+        device: Optional[FakeDevice] = None
+        while True:
+            request = self._read_request()
+            if request is None:
+                return
+            server.requests.append(request)
+
+            if request == "host:version":
+                self._okay(b"0029")
+                return
+            if request == "host:devices":
+                listing = "".join(f"{d.serial}\t{d.state}\n" for d in server.devices.values())
+                self._okay(listing.encode("utf-8"))
+                return
+            if request.startswith("host:transport"):
+                device = server.find_device(request)
+                if device is None:
+                    self._fail("device not found")
+                    return
+                self._okay()
+                continue
+            if device is not None and request.startswith("shell:"):
+                self._okay()
+                self.request.sendall(device.shell(request[len("shell:"):]))
+                return
+            if device is not None and request.startswith("exec:"):
+                self._okay()
+                self.request.sendall(device.exec(request[len("exec:"):]))
+                return
+
+            self._fail(f"unknown request {request}")
+            return
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeAdbServer:
+    """
+    An in-process adb server speaking the smart-socket protocol on a local port.
+    Lets the adb helpers be exercised over real sockets without a phone or the adb binary.
+
+    with FakeAdbServer([FakeDevice("device1")]) as server:
+        AdbClient(port=server.port).run("input tap 1 2")
+    """
+
+    def __init__(self, devices: Optional[list[FakeDevice]] = None, host: str = "127.0.0.1", port: int = 0):
+        self.devices = {device.serial: device for device in devices or []}
+        self.requests: list[str] = []
+        self._server = _ThreadingServer((host, port), _AdbRequestHandler)
+        self._server.fake = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def add_device(self, device: FakeDevice):
+        self.devices[device.serial] = device
+
+    def remove_device(self, serial: str):
+        self.devices.pop(serial, None)
+
+    def find_device(self, request: str) -> Optional[FakeDevice]:
+        ready = [d for d in self.devices.values() if d.state == "device"]
+        if request == "host:transport-any":
+            return ready[0] if len(ready) == 1 else None
+        serial = request[len("host:transport:"):]
+        return next((d for d in ready if d.serial == serial), None)
+
+    def start(self) -> "FakeAdbServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        logging.debug(f"Fake adb server listening on port {self.port}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeAdbServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,191 @@
+import logging
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Optional
+
+from src import bot
+from src import screenshot
+from src.adb_checker import get_connected_devices
+from src.adb_client import AdbClient
+from src.adb_session import close_session
+from src.image_decision_maker import DecisionCache, find_images_over_threshold, find_priority_match
+from src.image_template_loader import list_template_names, load_image_templates
+from src.matching_engine import set_matching_threads
+from src.roi_index import RoiIndex
+from src.scene_tracker import SceneTracker
+
+# Template images and regions of a matching worker process, loaded once when the worker starts
+_worker_template_images = None
+_worker_roi_index = None
+_worker_pyramid_factor = 1
+_worker_priority_matching = False
+_worker_batched_matching = False
+
+
+def _init_matching_worker(
+    use_regions: bool, pyramid_factor: int, priority_matching: bool = False, batched_matching: bool = False
+):
+    global _worker_template_images, _worker_roi_index, _worker_pyramid_factor
+    global _worker_priority_matching, _worker_batched_matching
+    # The parent built the pack before starting the pool, workers only map it
+    _worker_template_images = load_image_templates(write_pack=False)
+    _worker_pyramid_factor = pyramid_factor
+    _worker_priority_matching = priority_matching
+    _worker_batched_matching = batched_matching
+    # The pool already has a process per core, more matching threads per process would only compete
+    set_matching_threads(1)
+    # Workers learn regions but do not write them, they would overwrite each other's file
+    _worker_roi_index = RoiIndex.load(learned_path=None) if use_regions else None
+
+
+def _find_matches_in_worker(image, template_names=None):
+    if _worker_priority_matching:
+        match = find_priority_match(
+            _worker_template_images,
+            image,
+            roi_index=_worker_roi_index,
+            pyramid_factor=_worker_pyramid_factor,
+            template_names=template_names,
+            batched=_worker_batched_matching,
+        )
+        return [match] if match else []
+    return find_images_over_threshold(
+        _worker_template_images,
+        image,
+        roi_index=_worker_roi_index,
+        pyramid_factor=_worker_pyramid_factor,
+        template_names=template_names,
+        batched=_worker_batched_matching,
+    )
+
+
+class FleetRunner:
+    """
+    Runs one bot loop per connected phone.
+    Every loop has its own capture/tap channel (a session addressed to the phone's serial),
+    while template matching goes to one process pool shared by all phones, sized to the host's cores.
+    Phones that are plugged in or removed are picked up every poll_interval seconds.
+    With use_scenes, every phone tracks its own scene and only sends the plausible templates to the pool.
+    """
+
+    def __init__(
+        self,
+        save_screenshots: bool = False,
+        capture_mode: str = screenshot.CAPTURE_MODE_PNG,
+        adb_client: Optional[AdbClient] = None,
+        poll_interval: float = 5,
+        processes: Optional[int] = None,
+        use_regions: bool = True,
+        pyramid_factor: int = 1,
+        change_detector: str = "mad",
+        use_scenes: bool = True,
+        priority_matching: bool = False,
+        batched_matching: bool = False,
+        pipelined: bool = False,
+        polling_policy: str = "adaptive",
+        record_session: Optional[str] = None,
+        downscale: int = 1,
+        decision_cache: Optional[DecisionCache] = None,
+    ):
+        self.save_screenshots = save_screenshots
+        self.capture_mode = capture_mode
+        self.adb_client = adb_client
+        self.poll_interval = poll_interval
+        self.processes = processes or os.cpu_count() or 1
+        self.use_regions = use_regions
+        self.pyramid_factor = pyramid_factor
+        self.change_detector = change_detector
+        self.use_scenes = use_scenes
+        self.priority_matching = priority_matching
+        self.batched_matching = batched_matching
+        self.pipelined = pipelined
+        self.polling_policy = polling_policy
+        self.record_session = record_session
+        self.downscale = downscale
+        self.decision_cache = decision_cache
+        self.workers: dict[str, tuple[threading.Thread, threading.Event]] = {}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        """Run until stop() is called or the program is interrupted."""
+        logging.info(f"Starting fleet mode with {self.processes} matching processes.")
+        # Build the template pack once if it is out of date, instead of in every worker at the same time
+        load_image_templates()
+        with ProcessPoolExecutor(
+            max_workers=self.processes,
+            initializer=_init_matching_worker,
+            initargs=(self.use_regions, self.pyramid_factor, self.priority_matching, self.batched_matching),
+        ) as pool:
+            try:
+                while not self._stop_event.is_set():
+                    self.sync_devices(pool)
+                    self._stop_event.wait(self.poll_interval)
+            finally:
+                for serial in list(self.workers):
+                    self.stop_device(serial)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def sync_devices(self, pool: Executor):
+        """Start a bot loop for every new phone and stop the loops of phones that are gone."""
+        success, serials = get_connected_devices(self.adb_client)
+        if not success:
+            logging.warning("Failed to query ADB devices. Keeping the current bot loops.")
+            return
+
+        for serial in serials:
+            thread_and_event = self.workers.get(serial)
+            if thread_and_event is None or not thread_and_event[0].is_alive():
+                self.start_device(serial, pool)
+
+        for serial in list(self.workers):
+            if serial not in serials:
+                self.stop_device(serial)
+
+    def start_device(self, serial: str, pool: Executor):
+        def find_images(image, template_names=None):
+            return pool.submit(_find_matches_in_worker, image, template_names).result()
+
+        find_matches = find_images
+        scene_tracker = None
+        if self.use_scenes:
+            scene_tracker = SceneTracker(list_template_names())
+            find_matches = lambda image: scene_tracker.find_matches(find_images, image)
+        # Downscaled before it is sent to the pool, which also cuts the data passed to the processes
+        find_matches = bot.downscaled_find_matches(find_matches, self.downscale)
+        # Screens decided before are not sent to the pool at all
+        find_matches = bot.cached_find_matches(find_matches, self.decision_cache, scene_tracker)
+
+        run_loop = bot.run_device
+        if self.pipelined:
+            from src.pipeline import run_device_pipelined
+            run_loop = run_device_pipelined
+
+        stop_event = threading.Event()
+        thread = threading.Thread(
+            target=run_loop,
+            args=(find_matches,),
+            kwargs=dict(
+                serial=serial,
+                save_screenshots=self.save_screenshots,
+                capture_mode=self.capture_mode,
+                stop_event=stop_event,
+                change_detector=self.change_detector,
+                polling_policy=self.polling_policy,
+                record_session=self.record_session,
+            ),
+            name=f"bot-{serial}",
+            daemon=True,
+        )
+        self.workers[serial] = (thread, stop_event)
+        thread.start()
+        logging.info(f"Device {serial} connected. Started bot loop.")
+
+    def stop_device(self, serial: str):
+        thread, stop_event = self.workers.pop(serial)
+        stop_event.set()
+        thread.join()
+        close_session(serial)
+        logging.info(f"Device {serial} disconnected. Stopped bot loop.")
@@ -0,0 +1,35 @@
+from functools import cached_property
+
+import attr
+import cv2
+
+from src.buffer_pool import get_buffer_pool
+
+
+@attr.s(frozen=True)
+class Frame:
+    data = attr.ib()  # Bytes exactly as received from the device (PNG or raw framebuffer)
+    pixels = attr.ib()  # Decoded pixels; a zero-copy view into data for raw captures
+    channel_order = attr.ib(default="BGR")  # "BGR", "RGBA" or "BGRA"
+
+    @cached_property
+    def image(self):
+        """The frame as a BGR image, converted at most once."""
+        if self.channel_order == "RGBA":
+            return cv2.cvtColor(self.pixels, cv2.COLOR_RGBA2BGR)
+        if self.channel_order == "BGRA":
+            return cv2.cvtColor(self.pixels, cv2.COLOR_BGRA2BGR)
+        return self.pixels
+
+    @cached_property
+    def gray(self):
+        """
+        The frame as a greyscale image, converted at most once and directly from the captured pixels,
+        into a buffer of the buffer pool that is reused once the frame and its greyscale image are gone.
+        """
+        dst = get_buffer_pool().acquire(self.pixels.shape[:2])
+        if self.channel_order == "RGBA":
+            return cv2.cvtColor(self.pixels, cv2.COLOR_RGBA2GRAY, dst=dst)
+        if self.channel_order == "BGRA":
+            return cv2.cvtColor(self.pixels, cv2.COLOR_BGRA2GRAY, dst=dst)
+        return cv2.cvtColor(self.pixels, cv2.COLOR_BGR2GRAY, dst=dst)
@@ -1,12 +1,23 @@
+import json
 import logging
 import cv2
 import os
 import threading
+import time
+from collections import OrderedDict
+from typing import Iterable
+
+import numpy as np
+from attrs import define
 
 from src import constants
 from src import image_service
 from src.find_image_result import FindImageResult
 from src.game_action import GameAction, GameActions
+from src.matching_engine import get_matching_engine
+from src.metrics import STAGE_FIND_IMAGE, STAGE_FIND_IMAGES_BATCHED, span
+from src.roi_index import RoiIndex
+from src.template import Template
 
 
 def is_ingame(image_file: str) -> bool:
@@ -17,87 +28,285 @@ def is_screen_to_attack(image_file: str) -> bool:
     return image_file.startswith("ingame_")
 
 
-def make_decision(template_images: dict[str, cv2.Mat], image_name: str) -> GameAction:
-    # Check if the image file exists
-    if not os.path.exists(image_name):
-        logging.error(f"Image file {image_name} does not exist.")
+def load_screenshot(screenshot: str | cv2.Mat) -> cv2.Mat | None:
+    """
+    Return the screenshot as an image.
+    Accepts an already decoded image (e.g. Frame.image) or the path of an image file.
+    Returns None if the file does not exist.
+    """
+    if not isinstance(screenshot, str):
+        return screenshot
+
+    if not os.path.exists(screenshot):
+        logging.error(f"Screenshot file {screenshot} does not exist.")
+        return None
+
+    return cv2.imread(screenshot, cv2.IMREAD_COLOR)
+
+
+# Size of the thumbnail a frame is reduced to for its signature (see frame_signature)
+SIGNATURE_COLUMNS = 16
+SIGNATURE_ROWS = 32
+DECISION_CACHE_FILE = os.path.join("cache", "decisions.json")
+
+
+def frame_signature(gray: cv2.Mat) -> bytes:
+    """
+    Perceptual signature of a greyscale frame: the frame averaged down to SIGNATURE_COLUMNS x SIGNATURE_ROWS
+    pixels, each covering a block of the screen. Noise and compression artefacts average out, a dialog
+    or a different screen changes the brightness of many blocks.
+    """
+    return cv2.resize(gray, (SIGNATURE_COLUMNS, SIGNATURE_ROWS), interpolation=cv2.INTER_AREA).tobytes()
+
+
+@define(frozen=True)
+class CachedDecision:
+    matches: list[tuple[str, FindImageResult]]
+    action: GameAction
+    timestamp: float  # time.time() when it was decided, survives restarts for the TTL
+
+
+class DecisionCache:
+    """
+    Remembers the matches and GameAction decided for a frame by its perceptual signature
+    (see frame_signature), so recurring screens like the league select are decided without matching.
+    Frames of the same size count as the same screen if at most max_distance blocks of their signatures
+    differ by more than block_threshold grey levels, so a small animation does not make a new screen.
+    The least recently used decision is evicted beyond max_entries, and decisions older than
+    ttl seconds are matched again, so a screen that changed in details too small for the signature
+    is only mistaken for a while.
+    With a snapshot_path, the decisions can be saved and loaded across restarts; a snapshot is only
+    used for the same fingerprint (the templates and matching options it was decided with).
+    The cache can be used by several bot loops at once.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl: float = 600,
+        max_distance: int = 8,
+        block_threshold: int = 8,
+        snapshot_path: str | None = None,
+        fingerprint: str = "",
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.block_threshold = block_threshold
+        self.snapshot_path = snapshot_path
+        self.fingerprint = fingerprint
+        self.counters = dict(hits=0, misses=0, evictions=0, expired=0)
+        # (frame shape, signature) -> CachedDecision, least recently used first
+        self._entries: OrderedDict[tuple[tuple[int, int], bytes], CachedDecision] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, gray: cv2.Mat, now: float | None = None) -> CachedDecision | None:
+        """Return the decision of the same screen, or None if it has to be matched."""
+        now = time.time() if now is None else now
+        key = (gray.shape[:2], frame_signature(gray))
+        with self._lock:
+            key = self._closest_key(key)
+            decision = self._entries.get(key) if key is not None else None
+            if decision is not None and now - decision.timestamp > self.ttl:
+                del self._entries[key]
+                self.counters["expired"] += 1
+                decision = None
+            if decision is None:
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return decision
+
+    def _closest_key(self, key: tuple[tuple[int, int], bytes]) -> tuple[tuple[int, int], bytes] | None:
+        if key in self._entries:
+            return key
+        shape, signature = key
+        keys = [other for other in self._entries if other[0] == shape]
+        if not keys or self.max_distance <= 0:
+            return None
+        blocks = np.frombuffer(signature, dtype=np.uint8).astype(np.int16)
+        others = np.frombuffer(b"".join(other for _, other in keys), dtype=np.uint8).reshape(len(keys), -1)
+        distances = np.count_nonzero(np.abs(others - blocks) > self.block_threshold, axis=1)
+        closest = int(np.argmin(distances))
+        return keys[closest] if distances[closest] <= self.max_distance else None
+
+    def put(
+        self, gray: cv2.Mat, matches: list[tuple[str, FindImageResult]], action: GameAction, now: float | None = None
+    ):
+        """Remember the decision for a frame that was matched."""
+        decision = CachedDecision(list(matches), action, time.time() if now is None else now)
+        key = (gray.shape[:2], frame_signature(gray))
+        with self._lock:
+            self._entries[key] = decision
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    @classmethod
+    def load(cls, snapshot_path: str | None = DECISION_CACHE_FILE, fingerprint: str = "", **kwargs) -> "DecisionCache":
+        """
+        Create a cache with the decisions of the snapshot, if there is one for the same fingerprint.
+        Decisions that expired in the meantime are left out.
+        """
+        cache = cls(snapshot_path=snapshot_path, fingerprint=fingerprint, **kwargs)
+        if not snapshot_path or not os.path.exists(snapshot_path):
+            return cache
+        try:
+            with open(snapshot_path) as f:
+                snapshot = json.load(f)
+            if snapshot["fingerprint"] != fingerprint:
+                logging.info(f"Ignoring decision cache {snapshot_path}: decided with other templates or options")
+                return cache
+            now = time.time()
+            for entry in snapshot["entries"][-cache.max_entries:]:
+                if now - entry["timestamp"] > cache.ttl:
+                    continue
+                matches = [
+                    (match["template"], FindImageResult(match["val"], tuple(match["coords"]), match["width"], match["height"]))
+                    for match in entry["matches"]
+                ]
+                action = GameAction(
+                    action=GameActions[entry["action"]["action"]],
+                    position=tuple(entry["action"]["position"]),
+                    is_ingame=entry["action"]["is_ingame"],
+                    delay_before_tap=entry["action"]["delay_before_tap"],
+                )
+                key = (tuple(entry["shape"]), bytes.fromhex(entry["signature"]))
+                cache._entries[key] = CachedDecision(matches, action, entry["timestamp"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Ignoring decision cache {snapshot_path}: {e}")
+            cache._entries.clear()
+        return cache
+
+    def save(self) -> bool:
+        """
+        Write the decisions to the snapshot file, replacing it atomically.
+        Returns True if the snapshot was written.
+        """
+        if not self.snapshot_path:
+            return False
+        with self._lock:
+            entries = [
+                dict(
+                    shape=list(shape),
+                    signature=signature.hex(),
+                    timestamp=decision.timestamp,
+                    matches=[
+                        dict(
+                            template=img_name,
+                            val=float(result.val),
+                            coords=[int(c) for c in result.coords],
+                            width=int(result.width),
+                            height=int(result.height),
+                        )
+                        for img_name, result in decision.matches
+                    ],
+                    action=dict(
+                        action=decision.action.action.name,
+                        position=[int(c) for c in decision.action.position],
+                        is_ingame=decision.action.is_ingame,
+                        delay_before_tap=decision.action.delay_before_tap,
+                    ),
+                )
+                for (shape, signature), decision in self._entries.items()
+            ]
+        temporary_path = f"{self.snapshot_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            with open(temporary_path, "w") as f:
+                json.dump(dict(fingerprint=self.fingerprint, entries=entries), f)
+            os.replace(temporary_path, self.snapshot_path)
+            return True
+        except OSError as e:
+            logging.warning(f"Could not write decision cache {self.snapshot_path}: {e}")
+            return False
+
+
+def make_decision(template_images: dict[str, Template], screenshot: str | cv2.Mat, timeout: float | None = None, decision_cache: DecisionCache | None = None) -> GameAction:
+    # Load the screenshot as an image, unless it is already in memory
+    img_screenshot = load_screenshot(screenshot)
+    if img_screenshot is None:
         raise FileNotFoundError
 
-    # Load the screenshot as an image
-    img_screenshot = cv2.imread(image_name, cv2.IMREAD_COLOR)
+    # Convert the screenshot to greyscale once instead of once per template
+    img_screenshot = image_service.ensure_greyscale(img_screenshot)
 
-    # Check if any of the image files match the screenshot
-    find_image_results: list[tuple[str, FindImageResult]] = []
+    # A screen that was decided before is not matched again
+    cached = decision_cache.get(img_screenshot) if decision_cache is not None else None
+    if cached is not None:
+        return cached.action
 
-    # Compare each image in its own thread
-    def compare_image(image_file, img_screenshot, img_template):
-        result = image_service.find_image(img_screenshot, img_template)
-        if result:
-            logging.debug(f"Image {image_file} matches with {result.val * 100}%")
-            if image_file.startswith("forfeit"):
-                template_h, template_w = img_template.shape[:2]
-                match_w = getattr(result, "width", None)
-                match_h = getattr(result, "height", None)
-                if match_w is not None and match_h is not None and (match_w == template_w and match_h == template_h) and result.val > 0.90:
-                        find_image_results.append((image_file, result))
-                else:
-                    if result.val > 0.90:
-                        find_image_results.append((image_file, result))
-                        
-    threads = []
-    for image_file, img_template in template_images.items():
-        thread = threading.Thread(target=compare_image, args=(image_file, img_screenshot, img_template))
-        thread.start()
-        threads.append(thread)
-
-    for thread in threads:
-        thread.join()
+    # Check if any of the image files match the screenshot, on the shared matching threads
+    template_images = image_service.templates_for_screen(template_images, img_screenshot.shape)
+    find_image_results = match_templates(img_screenshot, template_images, 0.90, timeout=timeout)
 
     logging.debug("Found images over threshold:")
     logging.debug(find_image_results)
-    return analyze_results_and_return_action_with_priority(find_image_results)
+    action = analyze_results_and_return_action_with_priority(find_image_results, image_service.screen_scale(img_screenshot.shape))
+    if decision_cache is not None:
+        decision_cache.put(img_screenshot, find_image_results, action)
+    return action
 
-    #priority option
-def analyze_results_and_return_action_with_priority(
-    find_image_results: list[tuple[str, FindImageResult]]
-) -> GameAction:
-    if len(find_image_results) == 0:
-        logging.debug("No image matches.")
-        return GameAction()
+# Template name prefixes in the order in which their matches are acted on
+PRIORITY_LIST = [
+    "max_number_of_games_played_text",
+    "reward_",
+    "start_",
+    "select_master",
+    "select_hypa",
+    "start_button_yes",
+    "welcome_to_gbl_button_text",
+    "Yes",
+    # TODO: Add other images here
+]
 
-    priority_list = [
-        "max_number_of_games_played_text",
-        "reward_",
-        "start_",
-        "select_master",
-        "select_hypa",
-        "start_button_yes",
-        "welcome_to_gbl_button_text",
-        "Yes",
-        # TODO: Add other images here
-    ]
 
+def select_priority_match(
+    find_image_results: list[tuple[str, FindImageResult]], scale: float = 1.0
+) -> tuple[str, FindImageResult] | None:
+    """
+    Return the match to act on: the highest-confidence match of the first prefix in PRIORITY_LIST
+    that has matches, otherwise the highest-confidence match with y > 296, otherwise None.
+    scale is the factor of the screen to the reference resolution (see image_service.screen_scale).
+    """
     # For each prefix (in order), find the highest-confidence match for that prefix and return it immediately
-    for priority_prefix in priority_list:
+    for priority_prefix in PRIORITY_LIST:
         matches = [r for r in find_image_results if r[0].startswith(priority_prefix)]
         if matches:
             # Pick highest confidence among matches
             best_file, best_result = max(matches, key=lambda x: x[1].val)
             logging.info(f"Priority match found: {best_file} with confidence {best_result.val}")
-            return analyze_results_and_return_action(best_file, best_result)
+            return best_file, best_result
 
     # PATCH: Only consider matches with y > 296
-    filtered_results = [r for r in find_image_results if r[1].coords[1] > 296]
+    filtered_results = [r for r in find_image_results if r[1].coords[1] > constants.MIN_TAP_Y * scale]
     if filtered_results:
-        max_image_file, max_result = max(filtered_results, key=lambda x: x[1].val)
-        return analyze_results_and_return_action(max_image_file, max_result)
-    else:
+        return max(filtered_results, key=lambda x: x[1].val)
+    return None
+
+
+    #priority option
+def analyze_results_and_return_action_with_priority(
+    find_image_results: list[tuple[str, FindImageResult]], scale: float = 1.0
+) -> GameAction:
+    if len(find_image_results) == 0:
+        logging.debug("No image matches.")
+        return GameAction()
+
+    match = select_priority_match(find_image_results, scale)
+    if match is None:
         logging.info("No matches with y > 296 found; skipping tap.")
         return GameAction()  # No action
+    return analyze_results_and_return_action(*match, scale)
 
     #image analyze
 def analyze_results_and_return_action(
-    image_file: str, find_image_result: FindImageResult
+    image_file: str, find_image_result: FindImageResult, scale: float = 1.0
 ) -> GameAction:
     logging.info(f"Image {image_file} matches with {find_image_result.val * 100}%")
 
@@ -118,7 +327,7 @@ def analyze_results_and_return_action(
         # Send tap to attack
         position_to_tap = find_image_result.coords
         if is_screen_to_attack(image_file):
-            position_to_tap = constants.ATTACK_TAP_POSITION
+            position_to_tap = image_service.to_screen(constants.ATTACK_TAP_POSITION, scale)
 
         return GameAction(
             action=GameActions.tap_position,
@@ -133,25 +342,165 @@ def analyze_results_and_return_action(
         )
 
     #threshold for image match
-def find_images_over_threshold(template_images: dict[str, cv2.Mat], screenshot_file: str, threshold: float = 0.90) -> list[tuple[str, FindImageResult]]:
+def check_region_result(
+    img_screenshot: cv2.Mat,
+    img_name: str,
+    img_template: Template,
+    roi_index: RoiIndex | None,
+    threshold: float,
+    window: tuple[int, int, int, int] | None,
+    result: FindImageResult | None,
+    fallback_threshold: float = 0.75,
+    pyramid: image_service.PyramidLevel | None = None,
+) -> FindImageResult | None:
     """
-    Finds all template images that match the screenshot above the given threshold.
-    Returns a sorted list of (img_name, FindImageResult), highest confidence first.
-    Also logs the match value for every template image.
+    Check a result that was found in the template's search window of the RoiIndex.
+    If the best match in the window is close to, but not over the threshold, the template may be
+    cut off by the window border, so the whole screenshot is searched as a fallback.
+    Confident matches teach the index where the template appears.
     """
-    if not os.path.exists(screenshot_file):
-        logging.error(f"Screenshot file {screenshot_file} does not exist.")
-        return []
+    if roi_index is None:
+        return result
 
-    img_screenshot = cv2.imread(screenshot_file, cv2.IMREAD_COLOR)
-    results = []
+    if window is not None and result and fallback_threshold <= result.val <= threshold:
+        logging.debug(f"Template '{img_name}' is uncertain in its region. Searching the whole screenshot.")
+        with span(STAGE_FIND_IMAGE, img_name):
+            result = image_service.find_image(img_screenshot, img_template, pyramid=pyramid)
+
+    if result and result.val > threshold and roi_index.record(img_name, result, img_screenshot.shape):
+        roi_index.save()
+    return result
+
+
+def match_templates(
+    img_screenshot: cv2.Mat,
+    template_images: dict[str, Template],
+    threshold: float,
+    roi_index: RoiIndex | None = None,
+    pyramid: image_service.PyramidLevel | None = None,
+    timeout: float | None = None,
+    batched: bool = False,
+) -> list[tuple[str, FindImageResult]]:
+    """
+    Match templates on a greyscale screenshot on the shared matching threads.
+    With batched, the templates that are searched in the same window are matched together by
+    image_service.find_images_batched, which transforms the window only once. Batching is not
+    combined with a pyramid.
+    Returns (img_name, FindImageResult) of the templates over the threshold, in the order of template_images.
+    Templates that are not matched within timeout seconds count as not found.
+    """
+    # Group the templates by search window if they are batched, otherwise every template is its own group
+    groups: dict = {}
     for img_name, img_template in template_images.items():
-        result = image_service.find_image(img_screenshot, img_template)
+        window = None
+        if roi_index is not None:
+            window = roi_index.search_window(img_name, img_screenshot.shape, img_template.shape)
+        key = window if batched and pyramid is None else img_name
+        groups.setdefault(key, (window, []))[1].append(img_name)
+
+    def match(group: tuple[tuple[int, int, int, int] | None, list[str]]) -> list[FindImageResult | None]:
+        window, img_names = group
+        templates = [template_images[img_name] for img_name in img_names]
+        if len(templates) > 1:
+            # The templates of a batch share one transform, so only the whole batch is timed
+            with span(STAGE_FIND_IMAGES_BATCHED):
+                found = image_service.find_images_batched(img_screenshot, templates, window)
+        else:
+            with span(STAGE_FIND_IMAGE, img_names[0]):
+                found = [image_service.find_image(img_screenshot, templates[0], window, pyramid)]
+        return [
+            check_region_result(img_screenshot, img_name, template, roi_index, threshold, window, result, pyramid=pyramid)
+            for img_name, template, result in zip(img_names, templates, found)
+        ]
+
+    found: dict[str, FindImageResult | None] = {}
+    for (_, img_names), group_results in zip(groups.values(), get_matching_engine().map(match, groups.values(), timeout)):
+        if group_results is not None:
+            found.update(zip(img_names, group_results))
+
+    results = []
+    for img_name in template_images:
+        result = found.get(img_name)
         if result:
             logging.info(f"Template '{img_name}': match confidence {result.val:.4f}")
             if result.val > threshold:
                 results.append((img_name, result))
+    return results
+
+
+def find_images_over_threshold(template_images: dict[str, Template], screenshot: str | cv2.Mat, threshold: float = 0.90, roi_index: RoiIndex | None = None, pyramid_factor: int = 1, template_names: Iterable[str] | None = None, timeout: float | None = None, batched: bool = False) -> list[tuple[str, FindImageResult]]:
+    """
+    Finds all template images that match the screenshot above the given threshold.
+    The screenshot can be an in-memory image (BGR or greyscale) or the path of an image file.
+    With a RoiIndex, each template is only searched in the part of the screen where it appears.
+    With a pyramid_factor of 2 or 4, candidates are located on a downscaled screenshot first
+    and only refined at full resolution.
+    With template_names, only those templates are matched.
+    Templates are matched on the shared matching threads, with batched by FFT per search window (see match_templates).
+    Returns a sorted list of (img_name, FindImageResult), highest confidence first.
+    Also logs the match value for every template image.
+    """
+    img_screenshot = load_screenshot(screenshot)
+    if img_screenshot is None:
+        return []
+
+    # Convert the screenshot to greyscale once instead of once per template
+    img_screenshot = image_service.ensure_greyscale(img_screenshot)
+    pyramid = None
+    if pyramid_factor > 1:
+        pyramid = image_service.build_pyramid_level(img_screenshot, pyramid_factor)
+
+    if template_names is not None:
+        template_images = {name: template_images[name] for name in template_names if name in template_images}
+    # Match in the pixels of the screen, whatever its resolution
+    template_images = image_service.templates_for_screen(template_images, img_screenshot.shape)
+
+    results = match_templates(img_screenshot, template_images, threshold, roi_index, pyramid, timeout, batched)
 
     # Sort by confidence descending
     results.sort(key=lambda x: x[1].val, reverse=True)
     return results
+
+
+def find_priority_match(template_images: dict[str, Template], screenshot: str | cv2.Mat, threshold: float = 0.90, roi_index: RoiIndex | None = None, pyramid_factor: int = 1, template_names: Iterable[str] | None = None, timeout: float | None = None, batched: bool = False) -> tuple[str, FindImageResult] | None:
+    """
+    Finds the match to act on, matching templates in the order of PRIORITY_LIST.
+    Returns as soon as the templates of a priority prefix match above the threshold, so lower priority
+    templates are only matched if no higher priority template is on the screen.
+    The result is the same as select_priority_match(find_images_over_threshold(...)), ties included.
+    The templates of one prefix are matched together on the shared matching threads.
+    """
+    img_screenshot = load_screenshot(screenshot)
+    if img_screenshot is None:
+        return None
+
+    img_screenshot = image_service.ensure_greyscale(img_screenshot)
+    pyramid = None
+    if pyramid_factor > 1:
+        pyramid = image_service.build_pyramid_level(img_screenshot, pyramid_factor)
+
+    if template_names is not None:
+        template_images = {name: template_images[name] for name in template_names if name in template_images}
+    # Match in the pixels of the screen, whatever its resolution
+    template_images = image_service.templates_for_screen(template_images, img_screenshot.shape)
+
+    # Results of the templates matched so far, None if below the threshold
+    scored: dict[str, FindImageResult | None] = {}
+
+    def score(img_names: list[str]) -> list[tuple[str, FindImageResult]]:
+        unscored = {name: template_images[name] for name in img_names if name not in scored}
+        scored.update(dict.fromkeys(unscored))
+        scored.update(match_templates(img_screenshot, unscored, threshold, roi_index, pyramid, timeout, batched))
+        # Matches in the order of template_images, like find_images_over_threshold
+        return [(name, scored[name]) for name in img_names if scored[name] is not None]
+
+    for priority_prefix in PRIORITY_LIST:
+        matches = score([name for name in template_images if name.startswith(priority_prefix)])
+        if matches:
+            return select_priority_match(matches)
+
+    # No priority template is on the screen, the remaining templates decide
+    results = score(list(template_images))
+    results.sort(key=lambda x: x[1].val, reverse=True)
+    return select_priority_match(results, image_service.screen_scale(img_screenshot.shape))
+
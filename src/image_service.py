@@ -1,6 +1,23 @@
 import cv2
+import numpy as np
+from attrs import define, field
 
+from src.buffer_pool import get_buffer_pool
 from src.find_image_result import FindImageResult
+from src.template import Template
+
+# Templates smaller than this at the coarse level are matched at full resolution only
+MIN_COARSE_TEMPLATE_SIZE = 8
+# Templates correlated in one vectorized FFT pass, bounds the memory of find_images_batched
+FFT_BATCH_SIZE = 4
+# Screen resolution (width, height) the templates were cut from and the tap positions are given in
+REFERENCE_RESOLUTION = (1080, 2400)
+
+
+@define(frozen=True)
+class PyramidLevel:
+    image: np.ndarray = field(repr=False)  # The greyscale screenshot, downscaled by factor
+    factor: int
 
 
 def show_image(img, top_left, bottom_right):
@@ -14,7 +31,124 @@ def convert_to_greyscale(img_to_convert):
     return cv2.cvtColor(img_to_convert, cv2.COLOR_BGR2GRAY)
 
 
-def find_image(img_large, img_small) -> FindImageResult | None:
+def ensure_greyscale(img):
+    """Return img as greyscale, converting BGR images and passing greyscale images through."""
+    if img.ndim == 2:
+        return img
+    return convert_to_greyscale(img)
+
+
+def screen_scale(screen_shape) -> float:
+    """
+    Factor from the reference resolution to a screen of screen_shape (height, width[, channels]).
+    The game scales its interface with the width of the screen; the factor is rounded so that
+    resolutions that are almost the same share one set of rescaled templates.
+    """
+    return round(screen_shape[1] / REFERENCE_RESOLUTION[0], 2)
+
+
+def to_screen(position: tuple[int, int], scale: float) -> tuple[int, int]:
+    """A position in reference pixels, in pixels of a screen with scale (see screen_scale)."""
+    return round(position[0] * scale), round(position[1] * scale)
+
+
+def templates_for_screen(template_images: dict[str, Template], screen_shape) -> dict[str, Template]:
+    """
+    The templates at the resolution of a screen, so that matches are found in its pixels.
+    Every template is rescaled once per scale (see Template.rescaled) instead of searching scales per frame.
+    """
+    scale = screen_scale(screen_shape)
+    if scale == 1:
+        return template_images
+    return {name: template.rescaled(scale) for name, template in template_images.items()}
+
+
+def downscale(gray, factor: int):
+    """Downscale by an integer factor, averaging the pixels of every factor x factor block."""
+    h, w = gray.shape
+    dst = get_buffer_pool().acquire((h // factor, w // factor), gray.dtype)
+    return cv2.resize(gray, (w // factor, h // factor), dst=dst, interpolation=cv2.INTER_AREA)
+
+
+def upscale_result(result: FindImageResult, factor: int) -> FindImageResult:
+    """A result found on a screenshot downscaled by factor, in the pixels of the full screenshot."""
+    x, y = result.coords
+    return FindImageResult(
+        result.val, (x * factor + factor // 2, y * factor + factor // 2), result.width * factor, result.height * factor
+    )
+
+
+def build_pyramid_level(gray_large, factor: int) -> PyramidLevel:
+    """Downscale a greyscale screenshot once per frame for coarse-to-fine matching."""
+    return PyramidLevel(downscale(gray_large, factor), factor)
+
+
+def _result_shape(image, template) -> tuple[int, int]:
+    """Shape of the result map of matchTemplate."""
+    return image.shape[0] - template.shape[0] + 1, image.shape[1] - template.shape[1] + 1
+
+
+def _find_coarse_to_fine(gray_large, gray_small, coarse_small, level: PyramidLevel, window, candidates: int):
+    """
+    Locate candidates on the coarse level, then refine small windows around them at full resolution.
+    Returns (max_val, max_loc) in full resolution coordinates, or None if the coarse search is not possible.
+    """
+    factor = level.factor
+    x0, y0, x1, y1 = window
+    coarse_x0, coarse_y0 = x0 // factor, y0 // factor
+    coarse_view = level.image[coarse_y0:-(-y1 // factor), coarse_x0:-(-x1 // factor)]
+    coarse_h, coarse_w = coarse_small.shape
+    if coarse_view.shape[0] < coarse_h or coarse_view.shape[1] < coarse_w:
+        return None
+
+    pool = get_buffer_pool()
+    coarse_res = cv2.matchTemplate(
+        coarse_view, coarse_small, cv2.TM_CCOEFF_NORMED,
+        result=pool.get(_result_shape(coarse_view, coarse_small), slot=1),
+    )
+    h, w = gray_small.shape
+    margin = 2 * factor  # Covers the position error of downscaling
+    best_val, best_loc = -1.0, (x0, y0)
+    for _ in range(candidates):
+        _, coarse_val, _, (cx, cy) = cv2.minMaxLoc(coarse_res)
+        if coarse_val <= -1.0:
+            break
+        # Suppress this candidate so the next iteration finds a different one
+        coarse_res[max(cy - coarse_h // 2, 0):cy + coarse_h // 2 + 1, max(cx - coarse_w // 2, 0):cx + coarse_w // 2 + 1] = -1.0
+
+        fx, fy = (coarse_x0 + cx) * factor, (coarse_y0 + cy) * factor
+        rx0, ry0 = max(fx - margin, x0), max(fy - margin, y0)
+        rx1, ry1 = min(fx + w + margin, x1), min(fy + h + margin, y1)
+        if rx1 - rx0 < w or ry1 - ry0 < h:
+            continue
+
+        fine_view = gray_large[ry0:ry1, rx0:rx1]
+        fine_res = cv2.matchTemplate(
+            fine_view, gray_small, cv2.TM_CCOEFF_NORMED, result=pool.get(_result_shape(fine_view, gray_small))
+        )
+        _, fine_val, _, (lx, ly) = cv2.minMaxLoc(fine_res)
+        if fine_val > best_val:
+            best_val, best_loc = fine_val, (rx0 + lx, ry0 + ly)
+
+    return best_val, best_loc
+
+
+def find_image(
+    img_large,
+    img_small: Template | cv2.Mat,
+    window: tuple[int, int, int, int] | None = None,
+    pyramid: PyramidLevel | None = None,
+    candidates: int = 3,
+) -> FindImageResult | None:
+    """
+    Find img_small in img_large.
+    img_large can be a BGR image or, to convert it only once per frame, an already greyscale image.
+    img_small is a Template (greyscale precomputed when loading) or an image.
+    window (x0, y0, x1, y1) limits the search to that part of img_large; coordinates in the
+    result are still relative to the whole image.
+    With a pyramid level of img_large, the best candidates are located at the coarse level and
+    only small windows around them are matched at full resolution.
+    """
     if img_large is None:
         print("Image large is none")
         return
@@ -23,22 +157,40 @@ def find_image(img_large, img_small) -> FindImageResult | None:
         print("Image small is none")
         return
 
-    # Convert the images to grayscale
-    gray_large = convert_to_greyscale(img_large)
-    gray_small = convert_to_greyscale(img_small)
+    # Convert the images to grayscale, unless that was done already
+    gray_large = ensure_greyscale(img_large)
+    gray_small = img_small.gray if isinstance(img_small, Template) else ensure_greyscale(img_small)
 
     # Find the dimensions of the smaller image
     h, w = gray_small.shape
 
-    # Perform template matching to find the position of the smaller image
-    res = cv2.matchTemplate(gray_large, gray_small, cv2.TM_CCOEFF_NORMED)
+    coarse_match = None
+    if pyramid is not None and isinstance(img_small, Template):
+        coarse_small = img_small.downscaled(pyramid.factor)
+        if min(coarse_small.shape) >= MIN_COARSE_TEMPLATE_SIZE:
+            full_window = window or (0, 0, gray_large.shape[1], gray_large.shape[0])
+            coarse_match = _find_coarse_to_fine(gray_large, gray_small, coarse_small, pyramid, full_window, candidates)
+
+    if coarse_match is not None:
+        max_val, (top_left_x, top_left_y) = coarse_match
+    else:
+        # Only search the window, as a view without copying
+        offset_x, offset_y = 0, 0
+        if window is not None:
+            offset_x, offset_y, x1, y1 = window
+            gray_large = gray_large[offset_y:y1, offset_x:x1]
 
-    # Get the minimum and maximum values in the result
-    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
+        # Perform template matching to find the position of the smaller image, into a reused result map
+        result_buffer = get_buffer_pool().get(_result_shape(gray_large, gray_small))
+        res = cv2.matchTemplate(gray_large, gray_small, cv2.TM_CCOEFF_NORMED, result=result_buffer)
+
+        # Get the minimum and maximum values in the result
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
+        top_left_x, top_left_y = offset_x + max_loc[0], offset_y + max_loc[1]
 
     # Calculate the center of the matching area
-    x = max_loc[0] + w // 2
-    y = max_loc[1] + h // 2
+    x = top_left_x + w // 2
+    y = top_left_y + h // 2
 
     # # For testing: Show image
     # top_left = max_loc
@@ -47,3 +199,90 @@ def find_image(img_large, img_small) -> FindImageResult | None:
 
     # Return the maximum value and the center of the matching area, plus matched region size
     return FindImageResult(max_val, (x, y), w, h)
+
+
+def _window_sums(integral: np.ndarray, h: int, w: int) -> np.ndarray:
+    """Sums of all h x w windows of an image, from its integral image."""
+    sums = integral[h:, w:] - integral[:-h, w:]
+    sums -= integral[h:, :-w]
+    sums += integral[:-h, :-w]
+    return sums
+
+
+def window_deviations(sums: np.ndarray, squared_sums: np.ndarray, h: int, w: int) -> np.ndarray:
+    """
+    Square root of the sum of the squared deviations from the window mean, for all h x w windows.
+    This is the image half of the TM_CCOEFF_NORMED denominator and the same for all templates of one size.
+    """
+    window_sums = _window_sums(sums, h, w)
+    deviations = _window_sums(squared_sums, h, w)
+    window_sums *= window_sums
+    window_sums /= h * w
+    deviations -= window_sums
+    np.maximum(deviations, 0, out=deviations)
+    np.sqrt(deviations, out=deviations)
+    return deviations.astype(np.float32)
+
+
+def _normalize_correlation(correlation: np.ndarray, deviations: np.ndarray, template: Template) -> np.ndarray:
+    """
+    Turn the cross-correlation with a mean-free template into TM_CCOEFF_NORMED scores.
+    Windows without contrast are handled the way OpenCV does.
+    """
+    numerator = correlation[:deviations.shape[0], :deviations.shape[1]]
+    denominator = deviations * np.float32(template.norm)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = numerator / denominator
+    # Rounding errors and windows without contrast, rare enough to fix up separately
+    invalid = ~(np.abs(scores) < 1)
+    if invalid.any():
+        abs_numerator = np.abs(numerator[invalid])
+        limit = denominator[invalid] * 1.125
+        scores[invalid] = np.where(abs_numerator < limit, np.sign(numerator[invalid]), 0)
+    return scores
+
+
+def find_images_batched(
+    img_large,
+    templates: list[Template],
+    window: tuple[int, int, int, int] | None = None,
+    batch_size: int = FFT_BATCH_SIZE,
+) -> list[FindImageResult | None]:
+    """
+    Find several templates in img_large at once, with the same results as find_image.
+    The spectrum of img_large (or of its window) is computed once and correlated with the cached
+    spectra of the templates, batch_size templates per vectorized pass. The scores are normalized
+    like TM_CCOEFF_NORMED with integral images, so the templates do not have to have the same size.
+    Returns a result per template, None for templates larger than the searched image.
+    """
+    gray_large = ensure_greyscale(img_large)
+    offset_x, offset_y = 0, 0
+    if window is not None:
+        offset_x, offset_y, x1, y1 = window
+        gray_large = gray_large[offset_y:y1, offset_x:x1]
+
+    height, width = gray_large.shape
+    fft_shape = (cv2.getOptimalDFTSize(height), cv2.getOptimalDFTSize(width))
+    spectrum = np.fft.rfft2(gray_large.astype(np.float32), s=fft_shape)
+    sums, squared_sums = cv2.integral2(gray_large, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+
+    results: list[FindImageResult | None] = [None] * len(templates)
+    matchable = [i for i, template in enumerate(templates) if template.height <= height and template.width <= width]
+    # Templates of the same size share the image half of the denominator
+    matchable.sort(key=lambda i: templates[i].shape)
+    deviations: dict[tuple[int, int], np.ndarray] = {}
+    for start in range(0, len(matchable), batch_size):
+        batch = matchable[start:start + batch_size]
+        spectra = np.stack([templates[i].spectrum(fft_shape) for i in batch])
+        correlations = np.fft.irfft2(spectra * spectrum, s=fft_shape)
+        for i, correlation in zip(batch, correlations):
+            template = templates[i]
+            if template.shape not in deviations:
+                deviations.clear()  # Sorted by size, an earlier size is not needed again
+                deviations[template.shape] = window_deviations(sums, squared_sums, template.height, template.width)
+            scores = _normalize_correlation(correlation, deviations[template.shape], template)
+            _, max_val, _, max_loc = cv2.minMaxLoc(scores)
+            x = offset_x + max_loc[0] + template.width // 2
+            y = offset_y + max_loc[1] + template.height // 2
+            results[i] = FindImageResult(max_val, (x, y), template.width, template.height)
+    return results
@@ -1,15 +1,102 @@
 import cv2
 import logging
 import os
+from typing import Optional
 
+import numpy as np
 
-def load_image_templates() -> dict[str, cv2.Mat]:
-    image_dir = "./images"
-    template_images = {}
-    images = os.listdir(image_dir)
-    for image in images:
-        if image.endswith(".png"):
-            img_template = cv2.imread(os.path.join(image_dir, image), cv2.IMREAD_COLOR)
-            template_images[image] = img_template
+from src.template import Template
+from src.template_pack import content_hash, read_template_pack, write_template_pack
+
+IMAGE_DIR = "./images"
+GREYSCALE_CACHE_DIR = os.path.join("cache", "greyscale")
+# The pack of all greyscale templates (see template_pack), in GREYSCALE_CACHE_DIR
+TEMPLATE_PACK_NAME = "templates.pack"
+
+# Leading bytes of the image formats cv2 decodes, to tell which format a template really has
+IMAGE_SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "PNG",
+    b"\xff\xd8\xff": "JPEG",
+    b"BM": "BMP",
+}
+
+
+def list_template_names(image_dir: str = IMAGE_DIR) -> list[str]:
+    """Return the file names of all template images without loading them."""
+    return sorted(image for image in os.listdir(image_dir) if image.endswith(".png"))
+
+
+def read_template_sources(image_dir: str = IMAGE_DIR) -> dict[str, bytes]:
+    """Return the file contents of all template images by name."""
+    sources = {}
+    for image in list_template_names(image_dir):
+        with open(os.path.join(image_dir, image), "rb") as f:
+            sources[image] = f.read()
+    return sources
+
+
+def validate_template(name: str, data: bytes) -> tuple[Optional[np.ndarray], list[str]]:
+    """
+    Decode a template image to greyscale and check that it can be matched.
+    Returns (greyscale image or None if it can not be used, problems found).
+    """
+    problems = []
+    image_format = next((f for signature, f in IMAGE_SIGNATURES.items() if data.startswith(signature)), None)
+    if image_format is None:
+        return None, ["not a PNG, JPEG or BMP image"]
+    if image_format != "PNG":
+        problems.append(f"is a {image_format} image with a .png name")
+
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None, problems + ["could not be decoded"]
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if gray.std() == 0:
+        # TM_CCOEFF_NORMED is undefined for a template without any contrast
+        return None, problems + ["has a single color"]
+    return gray, problems
+
+
+def build_template_pack(image_dir: str = IMAGE_DIR, cache_dir: str = GREYSCALE_CACHE_DIR) -> dict[str, list[str]]:
+    """
+    Validate the templates, convert them to greyscale and write them to the template pack.
+    Returns the problems found per template; templates that can not be used are left out of the pack.
+    """
+    sources = read_template_sources(image_dir)
+    templates, problems = _decode_templates(sources)
+    write_template_pack(os.path.join(cache_dir, TEMPLATE_PACK_NAME), templates, content_hash(sources))
+    return problems
+
+
+def _decode_templates(sources: dict[str, bytes]) -> tuple[dict[str, Template], dict[str, list[str]]]:
+    templates = {}
+    problems = {}
+    for image, data in sources.items():
+        gray, template_problems = validate_template(image, data)
+        if template_problems:
+            problems[image] = template_problems
+        if gray is not None:
+            templates[image] = Template.from_gray(image, gray)
+    return templates, problems
+
+
+def load_image_templates(
+    image_dir: str = IMAGE_DIR, cache_dir: str = GREYSCALE_CACHE_DIR, write_pack: bool = True
+) -> dict[str, Template]:
+    """
+    Load the greyscale templates from the template pack, which is memory-mapped instead of decoding
+    every image. If the template images changed since the pack was built (their content hash differs),
+    they are decoded and, with write_pack, the pack is built again.
+    """
+    sources = read_template_sources(image_dir)
+    source_hash = content_hash(sources)
+    pack_path = os.path.join(cache_dir, TEMPLATE_PACK_NAME)
+    template_images = read_template_pack(pack_path, source_hash)
+    if template_images is None:
+        template_images, problems = _decode_templates(sources)
+        for image, template_problems in problems.items():
+            logging.warning(f"Template image {os.path.join(image_dir, image)} {', '.join(template_problems)}")
+        if write_pack:
+            write_template_pack(pack_path, template_images, source_hash)
     logging.info(f"Loaded {len(template_images)} image templates.")
     return template_images
@@ -0,0 +1,69 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Optional, TypeVar
+
+Item = TypeVar("Item")
+Result = TypeVar("Result")
+
+
+class MatchingEngine:
+    """
+    A persistent pool of matching threads, sized to the host's cores by default.
+    OpenCV releases the GIL while it matches, so templates are matched on several cores at once
+    without starting a thread per template and frame.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="matcher")
+
+    def map(
+        self, function: Callable[[Item], Result], items: Iterable[Item], timeout: Optional[float] = None
+    ) -> list[Optional[Result]]:
+        """
+        Call function for every item on the pool and return the results in the order of the items.
+        Items that are not done within timeout seconds get None; items that did not start yet are cancelled.
+        Exceptions of function are raised again.
+        """
+        futures = [self._executor.submit(function, item) for item in items]
+        done, not_done = wait(futures, timeout)
+        if not_done:
+            for future in not_done:
+                future.cancel()
+            logging.warning(f"{len(not_done)} of {len(futures)} matching tasks did not finish within {timeout} seconds.")
+        return [future.result() if future in done else None for future in futures]
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_engine: Optional[MatchingEngine] = None
+_engine_lock = threading.Lock()
+_engine_max_workers: Optional[int] = None
+
+
+def set_matching_threads(max_workers: Optional[int]):
+    """Choose the size of the shared engine (None for one thread per core). An existing engine is closed."""
+    global _engine_max_workers
+    _engine_max_workers = max_workers
+    close_matching_engine()
+
+
+def get_matching_engine() -> MatchingEngine:
+    """Return the shared matching engine, creating it on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = MatchingEngine(_engine_max_workers)
+        return _engine
+
+
+def close_matching_engine():
+    """Stop the threads of the shared matching engine."""
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.close()
+            _engine = None
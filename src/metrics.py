@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+import numpy as np
+
+METRICS_FORMATS = ("prometheus", "jsonl")
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Stages of the bot loop that are timed (see span)
+STAGE_CAPTURE = "capture"  # Transferring the screenshot from the device
+STAGE_DECODE = "decode"  # Decoding the PNG or raw framebuffer
+STAGE_CHANGE_DETECTION = "change_detection"  # Hashing the frame to skip unchanged screens
+STAGE_FIND_IMAGE = "find_image"  # Matching one template, recorded per template
+STAGE_FIND_IMAGES_BATCHED = "find_images_batched"  # Matching a batch of templates by FFT
+STAGE_MATCH = "match"  # Matching all templates of a frame
+STAGE_DECISION = "decision"  # Choosing what to tap from the matches
+STAGE_TAP = "tap"  # send_adb_tap
+
+
+class LatencyHistogram:
+    """
+    The latencies of the last `window` samples of a stage, for quantiles over recent behaviour,
+    and the count and sum of all samples, which only grow (as Prometheus expects of a summary).
+    """
+
+    def __init__(self, window: int = 1000):
+        self._samples: deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+        self.count += 1
+        self.sum += seconds
+
+    def summary(self) -> dict[str, float]:
+        samples = np.array(self._samples)
+        summary = dict(count=self.count, sum=self.sum)
+        if len(samples):
+            for quantile, value in zip(QUANTILES, np.quantile(samples, QUANTILES)):
+                summary[f"p{round(quantile * 100)}"] = float(value)
+            summary["max"] = float(samples.max())
+        return summary
+
+
+class Metrics:
+    """
+    Latency histograms per stage of the bot loop and per template.
+    Recording a sample is a clock read and a deque append, cheap enough to leave on all the time;
+    the quantiles are only computed when the metrics are exported.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.enabled = True
+        self._histograms: dict[tuple[str, Optional[str]], LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float, template: Optional[str] = None):
+        if not self.enabled:
+            return
+        key = (stage, template)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram(self.window)
+            histogram.record(seconds)
+
+    @contextmanager
+    def span(self, stage: str, template: Optional[str] = None):
+        """Time the body of a with statement as a sample of stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, template)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def snapshot(self) -> list[dict]:
+        """The summary of every histogram, stages first, then templates by name."""
+        with self._lock:
+            items = [(key, histogram.summary()) for key, histogram in self._histograms.items()]
+        items.sort(key=lambda item: (item[0][1] is not None, item[0][0], item[0][1] or ""))
+        return [dict(stage=stage, template=template, **summary) for (stage, template), summary in items]
+
+    def to_prometheus(self) -> str:
+        """The metrics in the Prometheus text exposition format, as summaries in seconds."""
+        lines = []
+        for metric, per_template in (("pogobot_stage_latency_seconds", False), ("pogobot_template_latency_seconds", True)):
+            entries = [entry for entry in self.snapshot() if (entry["template"] is not None) == per_template]
+            if not entries:
+                continue
+            subject = "template matching" if per_template else "bot loop stage"
+            lines.append(f"# HELP {metric} Latency per {subject}, quantiles over the last {self.window} samples.")
+            lines.append(f"# TYPE {metric} summary")
+            for entry in entries:
+                labels = f'stage="{entry["stage"]}"'
+                if per_template:
+                    labels += f',template="{_escape_label(entry["template"])}"'
+                for quantile in QUANTILES:
+                    value = entry.get(f"p{round(quantile * 100)}")
+                    if value is not None:
+                        lines.append(f'{metric}{{{labels},quantile="{quantile}"}} {value:.6f}')
+                lines.append(f"{metric}_sum{{{labels}}} {entry['sum']:.6f}")
+                lines.append(f"{metric}_count{{{labels}}} {entry['count']}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def to_json_lines(self, timestamp: Optional[float] = None) -> str:
+        """The metrics as one JSON object per stage and template, stamped with the export time."""
+        timestamp = time.time() if timestamp is None else timestamp
+        return "".join(json.dumps(dict(timestamp=timestamp, **entry)) + "\n" for entry in self.snapshot())
+
+    def write(self, path: str, metrics_format: str = "prometheus") -> bool:
+        """
+        Export the metrics to a file.
+        The Prometheus file is replaced atomically (for the node exporter's textfile collector),
+        JSON lines are appended, one snapshot per call.
+        Returns True if the file was written.
+        """
+        try:
+            if metrics_format == "jsonl":
+                with open(path, "a") as file:
+                    file.write(self.to_json_lines())
+                return True
+
+            temporary_path = f"{path}.tmp"
+            with open(temporary_path, "w") as file:
+                file.write(self.to_prometheus())
+            os.replace(temporary_path, path)
+            return True
+        except OSError as e:
+            logging.error(f"Failed to write metrics to {path}: {e}")
+            return False
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsExporter:
+    """Writes the metrics to a file every interval seconds on a background thread, and once more when stopped."""
+
+    def __init__(self, metrics: Metrics, path: str, metrics_format: str = "prometheus", interval: float = 10):
+        self.metrics = metrics
+        self.path = path
+        self.metrics_format = metrics_format
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-exporter", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.metrics.write(self.path, self.metrics_format)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.metrics.write(self.path, self.metrics_format)
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """Return the metrics shared by all bot loops."""
+    return _metrics
+
+
+def span(stage: str, template: Optional[str] = None):
+    """Time the body of a with statement as a sample of stage in the shared metrics."""
+    return _metrics.span(stage, template)
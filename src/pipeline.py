@@ -0,0 +1,208 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+from src import bot
+from src import constants
+from src import screenshot
+from src.adb_commands import send_gestures
+from src.adb_session import get_session
+from src.change_detector import create_change_detector
+from src.find_image_result import FindImageResult
+from src.frame import Frame
+from src.game_action import GameAction
+from src.scheduler import POLLING_POLICIES, DelayedTaps, PollingScheduler
+from src.session_recorder import SessionRecorder, session_file_name
+
+# Put on a stage queue to stop the stage reading from it
+_STOP = object()
+
+
+def put_latest(stage_queue: queue.Queue, item) -> bool:
+    """
+    Put item on a bounded queue, dropping the oldest items if it is full.
+    Returns True if an item was dropped.
+    """
+    dropped = False
+    while True:
+        try:
+            stage_queue.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                stage_queue.get_nowait()
+                dropped = True
+            except queue.Empty:
+                pass
+
+
+class PipelinedRunner:
+    """
+    The bot loop for one phone as three stages on their own threads: capture, match and act.
+    The next screenshot is captured while the current one is matched and taps are sent while
+    matching goes on, so the loop runs at the pace of its slowest stage.
+    Stages hand over through queues of size 1: a newer frame replaces one that was not matched yet,
+    a newer tap replaces one that was not sent yet. Frames captured before the last tap had time
+    to settle show the screen before the tap and are dropped, so a button is not tapped twice.
+    """
+
+    def __init__(
+        self,
+        find_matches: Callable,
+        serial: Optional[str] = None,
+        save_screenshots: bool = False,
+        capture_mode: str = screenshot.CAPTURE_MODE_PNG,
+        stop_event: Optional[threading.Event] = None,
+        change_detector: str = "mad",
+        settle_time: float = 0.5,
+        polling_policy: str = "adaptive",
+        record_session: Optional[str] = None,
+    ):
+        self.find_matches = find_matches
+        self.serial = serial
+        self.save_screenshots = save_screenshots
+        self.capture_mode = capture_mode
+        self.stop_event = stop_event or threading.Event()
+        self.detector = create_change_detector(change_detector)
+        self.settle_time = settle_time  # Seconds the screen needs to show the result of a tap
+        self.scheduler = PollingScheduler(POLLING_POLICIES[polling_policy])
+        self.record_session = record_session
+        self.recorder: Optional[SessionRecorder] = None
+        self.log_prefix = f"[{serial}] " if serial else ""
+        self.screenshot_file_name = constants.SCREENSHOT_FILE_NAME
+        if serial:
+            self.screenshot_file_name = self.screenshot_file_name.replace(".png", f".{serial}.png")
+
+        self.frames: queue.Queue = queue.Queue(maxsize=1)  # (capture start time, Frame)
+        self.taps: queue.Queue = queue.Queue(maxsize=1)  # (img_name, FindImageResult, GameAction)
+        self.delayed_taps = DelayedTaps()
+        self._tapping = threading.Event()
+        self._rematch = threading.Event()  # Set when a frame was dropped that the change detector counted
+        self._settled_at = 0.0  # Frames captured before this time show the screen before the last tap
+        self._tapped_at = 0.0  # When the act stage sent the last tap
+        self._scene: Optional[str] = None  # Scene of the last matched frame, for the polling interval
+        self.counters = dict(captured=0, unchanged=0, dropped=0, stale=0, matched=0, tapped=0)
+
+    def run(self):
+        """Run the match and act stages on threads and capture on the calling thread until stopped."""
+        session = get_session(self.serial)
+        if self.record_session:
+            self.recorder = SessionRecorder(session_file_name(self.record_session, self.serial), self.serial)
+        stages = [
+            threading.Thread(target=self._match_stage, name=f"match-{self.serial}", daemon=True),
+            threading.Thread(target=self._act_stage, args=(session,), name=f"act-{self.serial}", daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+        try:
+            self._capture_stage(session)
+        finally:
+            self.stop_event.set()
+            self.delayed_taps.cancel()
+            put_latest(self.frames, _STOP)
+            put_latest(self.taps, _STOP)
+            for stage in stages:
+                stage.join()
+            if self.recorder is not None:
+                self.recorder.close()
+            logging.info(f"{self.log_prefix}Pipeline stopped: {self.counters}, capture cadence {self.scheduler.cadence()}")
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _capture_stage(self, session):
+        waiting_for_device = False
+        while not self.stop_event.is_set():
+            if self._tapping.is_set():
+                # Whatever is captured now shows the screen before the tap
+                bot.wait(self.settle_time, self.stop_event)
+                continue
+
+            self.scheduler.wait(self.stop_event)
+            captured_at = time.monotonic()
+            frame = screenshot.capture_frame(self.capture_mode, session=session)
+            if frame is None:
+                if waiting_for_device:
+                    print(".", end="", flush=True)
+                else:
+                    logging.info(f"{self.log_prefix}Error capturing screenshot. Waiting until phone is connected.")
+                    waiting_for_device = True
+                bot.wait(5, self.stop_event)
+                continue
+
+            waiting_for_device = False
+            self.counters["captured"] += 1
+            self.scheduler.captured()
+
+            # Writing to disk is only a debug sink
+            if self.save_screenshots:
+                screenshot.save_frame(frame, self.screenshot_file_name)
+
+            if self._rematch.is_set():
+                self._rematch.clear()
+                self.detector.reset()
+            change = self.detector.detect(frame.gray)
+            # After a tap the act stage scheduled the next capture for the transition (see _tap)
+            if not self._tapping.is_set() and captured_at > self._tapped_at:
+                self.scheduler.schedule(change.changed, scene=self._scene)
+            if not change.changed:
+                self.counters["unchanged"] += 1
+                continue
+
+            if put_latest(self.frames, (captured_at, frame)):
+                self.counters["dropped"] += 1
+                logging.debug(f"{self.log_prefix}Dropped a frame that was not matched before the next one")
+                # Same as above, the dropped frame may have been the only one showing a change
+                self._rematch.set()
+
+    def _match_stage(self):
+        while True:
+            item = self.frames.get()
+            if item is _STOP:
+                return
+            captured_at, frame = item
+            if self._tapping.is_set() or captured_at < self._settled_at:
+                self.counters["stale"] += 1
+                # Even if the screen looks the same as this frame after the tap, it has to be matched again
+                self._rematch.set()
+                continue
+            self._match(frame)
+
+    def _match(self, frame: Frame):
+        decision = bot.match_frame(frame, self.find_matches, self.recorder, self.log_prefix)
+        self.counters["matched"] += 1
+        self._scene = decision.scene
+        # Capturing and matching go on while a delayed tap waits
+        bot.dispatch_tap(decision.tap, self.delayed_taps, self._send_tap, self.log_prefix)
+
+    def _send_tap(self, tap: tuple[str, FindImageResult, GameAction]):
+        """Hand a tap to the act stage. Frames captured from now on show the screen before the tap."""
+        if self.stop_event.is_set():
+            return
+        self._tapping.set()
+        put_latest(self.taps, tap)
+
+    def _act_stage(self, session):
+        while True:
+            tap = self.taps.get()
+            if tap is _STOP:
+                return
+            try:
+                self._tap(session, *tap)
+            finally:
+                self._settled_at = time.monotonic() + self.settle_time
+                self._tapping.clear()
+
+    def _tap(self, session, img_name: str, result: FindImageResult, action: GameAction):
+        logging.info(f"{self.log_prefix}Tapping {img_name} at {result.coords} (confidence {result.val*100:.2f}%)")
+        send_gestures(bot.gestures_for_tap(img_name, result, action), session=session)
+        self.counters["tapped"] += 1
+        self._tapped_at = time.monotonic()
+        self.scheduler.schedule(changed=True, scene=self._scene, tapped=True)
+
+
+def run_device_pipelined(find_matches: Callable, **kwargs):
+    """Like bot.run_device, but with overlapping capture, match and act stages (see PipelinedRunner)."""
+    PipelinedRunner(find_matches, **kwargs).run()
@@ -0,0 +1,145 @@
+import json
+import logging
+import os
+import threading
+from typing import Optional
+
+from src.find_image_result import FindImageResult
+
+REGIONS_FILE = os.path.join("images", "regions.json")
+LEARNED_REGIONS_FILE = os.path.join("cache", "regions.learned.json")
+
+# (left, top, right, bottom) as fractions of the screen width and height
+Region = tuple[float, float, float, float]
+
+
+class RoiIndex:
+    """
+    Where on the screen each template can appear, so matching only has to search a part of it.
+
+    Regions describe where the centre of a match can be, as fractions of the screen size.
+    They are declared per template name prefix in a sidecar file (images/regions.json) or
+    learned from the coordinates of past matches. Learned regions are only used after
+    min_samples matches and grow by margin around the seen centres.
+    Every full_search_every searches of a template the whole screen is searched anyway,
+    so a template that moved out of its region is found again.
+    The index can be used by several matching threads at once.
+    """
+
+    def __init__(
+        self,
+        declared: Optional[dict[str, Region]] = None,
+        learned_path: Optional[str] = None,
+        min_samples: int = 3,
+        margin: float = 0.05,
+        full_search_every: int = 25,
+    ):
+        self.declared = declared or {}
+        self.learned_path = learned_path
+        self.min_samples = min_samples
+        self.margin = margin
+        self.full_search_every = full_search_every
+        self._searches: dict[str, int] = {}
+        # template name -> [left, top, right, bottom, samples] of seen match centres
+        self.learned: dict[str, list] = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(
+        cls,
+        regions_file: str = REGIONS_FILE,
+        learned_path: Optional[str] = LEARNED_REGIONS_FILE,
+    ) -> "RoiIndex":
+        declared = {}
+        if os.path.exists(regions_file):
+            with open(regions_file) as f:
+                declared = {
+                    prefix: tuple(region)
+                    for prefix, region in json.load(f).items()
+                    if not prefix.startswith("_")  # "_comment" and similar keys
+                }
+
+        roi_index = cls(declared, learned_path)
+        if learned_path and os.path.exists(learned_path):
+            try:
+                with open(learned_path) as f:
+                    roi_index.learned = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring learned regions in {learned_path}: {e}")
+        return roi_index
+
+    def save(self):
+        if not self.learned_path:
+            return
+        os.makedirs(os.path.dirname(self.learned_path) or ".", exist_ok=True)
+        with self._lock, open(self.learned_path, "w") as f:
+            json.dump(self.learned, f, indent=2)
+
+    def _declared_region(self, template_name: str) -> Optional[Region]:
+        prefixes = [prefix for prefix in self.declared if template_name.startswith(prefix)]
+        if not prefixes:
+            return None
+        return self.declared[max(prefixes, key=len)]
+
+    def region_for(self, template_name: str) -> Optional[Region]:
+        """Return the region of match centres for a template, or None to search the whole screen."""
+        learned = self.learned.get(template_name)
+        if learned is not None and learned[4] >= self.min_samples:
+            left, top, right, bottom, _ = learned
+            return (
+                max(left - self.margin, 0.0),
+                max(top - self.margin, 0.0),
+                min(right + self.margin, 1.0),
+                min(bottom + self.margin, 1.0),
+            )
+        return self._declared_region(template_name)
+
+    def search_window(
+        self, template_name: str, screen_shape: tuple[int, int], template_shape: tuple[int, int]
+    ) -> Optional[tuple[int, int, int, int]]:
+        """
+        Return the part of the screen (x0, y0, x1, y1) in pixels that has to be searched so that
+        every match centred in the template's region is found, or None to search the whole screen.
+        """
+        with self._lock:
+            region = self.region_for(template_name)
+            if region is None:
+                return None
+
+            searches = self._searches.get(template_name, 0) + 1
+            self._searches[template_name] = searches
+        if self.full_search_every and searches % self.full_search_every == 0:
+            return None
+
+        screen_h, screen_w = screen_shape[:2]
+        template_h, template_w = template_shape[:2]
+        left, top, right, bottom = region
+        x0 = max(int(left * screen_w) - template_w // 2 - 1, 0)
+        y0 = max(int(top * screen_h) - template_h // 2 - 1, 0)
+        x1 = min(int(right * screen_w) + template_w - template_w // 2 + 1, screen_w)
+        y1 = min(int(bottom * screen_h) + template_h - template_h // 2 + 1, screen_h)
+        if x1 - x0 < template_w or y1 - y0 < template_h:
+            return None
+        if (x0, y0, x1, y1) == (0, 0, screen_w, screen_h):
+            return None
+        return x0, y0, x1, y1
+
+    def record(self, template_name: str, result: FindImageResult, screen_shape: tuple[int, int]) -> bool:
+        """
+        Learn from a confident match. Returns True if the learned region changed.
+        """
+        screen_h, screen_w = screen_shape[:2]
+        x = result.coords[0] / screen_w
+        y = result.coords[1] / screen_h
+        with self._lock:
+            learned = self.learned.get(template_name)
+            if learned is None:
+                self.learned[template_name] = [x, y, x, y, 1]
+                return True
+
+            left, top, right, bottom, samples = learned
+            updated = [min(left, x), min(top, y), max(right, x), max(bottom, y), samples + 1]
+            grown = updated[:4] != learned[:4]
+            self.learned[template_name] = updated
+        # Only the sample count changed: report a change while the region is not in use yet
+        return grown or samples + 1 == self.min_samples
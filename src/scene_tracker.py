@@ -0,0 +1,90 @@
+import logging
+from typing import Callable, Iterable, Optional
+
+from attrs import define
+
+from src.find_image_result import FindImageResult
+from src.image_decision_maker import select_priority_match
+
+
+@define(frozen=True)
+class Scene:
+    prefixes: tuple[str, ...]  # Template name prefixes that identify the scene
+    next_scenes: tuple[str, ...]  # Scenes that can follow this one (besides itself)
+
+
+# The GBL cycle: welcome -> league select -> start -> in battle -> forfeit -> rewards -> next game
+SCENES = {
+    "welcome": Scene(("welcome_to_gbl_button_text",), ("league_select", "start")),
+    "league_select": Scene(("select_",), ("start",)),
+    "start": Scene(
+        ("start_", "confirm_party_search_button", "search_next_game_button_text"),
+        ("in_battle", "game_result"),
+    ),
+    "in_battle": Scene(("forfeit", "ingame_", "enemy_charge_attack", "Yes"), ("rewards", "game_result")),
+    "rewards": Scene(("reward_", "claim_rewards_button_text", "claim_rank"), ("start", "game_result")),
+    "game_result": Scene(
+        ("confirm_game_result_all_games_played_button", "max_number_of_games_played_text"),
+        ("welcome", "start", "rewards"),
+    ),
+}
+
+FindImages = Callable[[object, Optional[list[str]]], list[tuple[str, FindImageResult]]]
+
+
+def scene_of(template_name: str) -> Optional[str]:
+    """Return the scene a template belongs to, by the longest matching prefix."""
+    best_scene, best_length = None, -1
+    for name, scene in SCENES.items():
+        for prefix in scene.prefixes:
+            if template_name.startswith(prefix) and len(prefix) > best_length:
+                best_scene, best_length = name, len(prefix)
+    return best_scene
+
+
+class SceneTracker:
+    """
+    Tracks which screen of the game is shown, so only the templates that are plausible next are matched.
+    The scene is taken from the match that the priority list would act on. While the scene is
+    unknown, or when none of the plausible templates match, all other templates are matched too.
+    Templates that belong to no scene are always matched.
+    """
+
+    def __init__(self, template_names: Iterable[str]):
+        self.template_names = list(template_names)
+        self.current: Optional[str] = None
+        self._scene_templates: dict[Optional[str], list[str]] = {}
+        for template_name in self.template_names:
+            self._scene_templates.setdefault(scene_of(template_name), []).append(template_name)
+
+    def candidate_templates(self) -> Optional[list[str]]:
+        """Templates to match first, or None for all templates."""
+        if self.current is None:
+            return None
+        scenes = (self.current,) + SCENES[self.current].next_scenes
+        candidates = list(self._scene_templates.get(None, []))
+        for scene in scenes:
+            candidates += self._scene_templates.get(scene, [])
+        return candidates
+
+    def update(self, matches: list[tuple[str, FindImageResult]]):
+        match = select_priority_match(matches) if matches else None
+        scene = scene_of(match[0]) if match else None
+        if scene is not None and scene != self.current:
+            logging.debug(f"Scene changed from {self.current} to {scene}")
+            self.current = scene
+
+    def find_matches(self, find_images: FindImages, image) -> list[tuple[str, FindImageResult]]:
+        """
+        Match the plausible templates first and all others only if none of them matched.
+        find_images(image, template_names) returns the sorted matches of those templates (all if None).
+        """
+        candidates = self.candidate_templates()
+        matches = find_images(image, candidates)
+        if not matches and candidates is not None:
+            searched = set(candidates)
+            remaining = [name for name in self.template_names if name not in searched]
+            logging.debug(f"No match in scene {self.current}. Matching {len(remaining)} more templates.")
+            matches = find_images(image, remaining)
+        self.update(matches)
+        return matches
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import numpy as np
+from attrs import define, field
+
+
+async def sleep_async(seconds: float, stop_event: Optional[asyncio.Event] = None) -> bool:
+    """Sleep on the event loop, but wake up early if stop_event is set. Returns whether it was set."""
+    if stop_event is None:
+        await asyncio.sleep(seconds)
+        return False
+    try:
+        await asyncio.wait_for(stop_event.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+    return stop_event.is_set()
+
+
+@define(frozen=True)
+class PollingPolicy:
+    min_interval: float  # Seconds until the next capture after a frame that changed
+    max_interval: float  # Longest wait on a screen that does not change
+    backoff: float  # The wait grows by this factor with every unchanged frame
+    after_tap: float  # Seconds until the next capture after a tap, while the screen transitions
+    scene_intervals: dict[str, float] = field(factory=dict)  # min_interval per scene (see scene_tracker.SCENES)
+
+
+POLLING_POLICIES = {
+    # Poll quickly through menus, back off on screens that do not change
+    "adaptive": PollingPolicy(min_interval=0.5, max_interval=5.0, backoff=2.0, after_tap=1.0, scene_intervals={"in_battle": 1.0}),
+    # Poll as fast as possible, at the cost of more CPU on phone and host
+    "fast": PollingPolicy(min_interval=0.2, max_interval=2.0, backoff=1.5, after_tap=0.5),
+    # The fixed pauses of earlier versions: 1.5 s after a match, 2.5 s on unchanged screens
+    "fixed": PollingPolicy(min_interval=1.5, max_interval=2.5, backoff=2.0, after_tap=1.5),
+}
+
+
+class PollingScheduler:
+    """
+    Decides when the next screenshot is captured, from what happened to the last one.
+    After a tap the screen transitions, so it is captured again soon. A changed screen is captured
+    again after the min_interval of its scene. Every unchanged screen multiplies the wait by backoff,
+    up to max_interval. The intervals between captures are recorded to report the achieved cadence.
+    """
+
+    def __init__(self, policy: PollingPolicy, history: int = 100):
+        self.policy = policy
+        self.interval = policy.min_interval
+        self.next_capture_at = 0.0
+        self._last_capture_at: Optional[float] = None
+        self._intervals: deque[float] = deque(maxlen=history)
+
+    def captured(self):
+        """Record that a screenshot was captured now."""
+        now = time.monotonic()
+        if self._last_capture_at is not None:
+            self._intervals.append(now - self._last_capture_at)
+        self._last_capture_at = now
+
+    def schedule(self, changed: bool, scene: Optional[str] = None, tapped: bool = False) -> float:
+        """Schedule the next capture after a screenshot was processed. Returns the interval in seconds."""
+        if tapped:
+            self.interval = self.policy.after_tap
+        elif changed:
+            self.interval = self.policy.scene_intervals.get(scene, self.policy.min_interval)
+        else:
+            self.interval = min(self.interval * self.policy.backoff, self.policy.max_interval)
+        self.next_capture_at = time.monotonic() + self.interval
+        return self.interval
+
+    def tapped(self):
+        """A tap was sent outside of the loop, e.g. by a timer: capture the transition soon."""
+        self.next_capture_at = min(self.next_capture_at, time.monotonic() + self.policy.after_tap)
+
+    def wait(self, stop_event: Optional[threading.Event] = None):
+        """Wait until the next capture is due, waking up early if it is moved forward or the loop stops."""
+        while stop_event is None or not stop_event.is_set():
+            remaining = self.next_capture_at - time.monotonic()
+            if remaining <= 0:
+                return
+            # Short steps, so a capture moved forward by tapped() is not missed
+            step = min(remaining, 0.1)
+            if stop_event is None:
+                time.sleep(step)
+            else:
+                stop_event.wait(step)
+
+    async def wait_async(self, stop_event: Optional[asyncio.Event] = None):
+        """Like wait, but on the event loop."""
+        while stop_event is None or not stop_event.is_set():
+            remaining = self.next_capture_at - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(remaining, 0.1))
+
+    def cadence(self) -> dict[str, float]:
+        """Statistics of the recent intervals between captures, in seconds."""
+        if not self._intervals:
+            return dict(captures=0)
+        intervals = np.array(self._intervals)
+        return dict(
+            captures=len(intervals),
+            mean=float(intervals.mean()),
+            p50=float(np.percentile(intervals, 50)),
+            p95=float(np.percentile(intervals, 95)),
+            max=float(intervals.max()),
+        )
+
+
+class DelayedTaps:
+    """
+    Taps that have to wait before they are sent (GameAction.delay_before_tap), run on timers so
+    capturing and matching go on in the meantime. Only one delayed tap is pending at a time.
+    """
+
+    def __init__(self):
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+
+    def pending(self) -> bool:
+        with self._lock:
+            return self._timer is not None and self._timer.is_alive()
+
+    def schedule(self, delay: float, tap: Callable[[], None]) -> bool:
+        """Call tap after delay seconds. Returns False if another delayed tap is still pending."""
+        with self._lock:
+            if self._timer is not None and self._timer.is_alive():
+                return False
+            self._timer = threading.Timer(delay, self._run, args=(tap,))
+            self._timer.daemon = True
+            self._timer.start()
+            return True
+
+    def _run(self, tap: Callable[[], None]):
+        try:
+            tap()
+        except Exception:
+            logging.exception("Delayed tap failed")
+
+    def cancel(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
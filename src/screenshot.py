@@ -1,51 +1,201 @@
+import asyncio
 import os
+import struct
 import subprocess
-import platform
 import logging
+
+import cv2
+import numpy as np
+
+from src.adb_session import AdbSession, get_session
+from src.async_adb import AsyncAdbSession, get_async_session
+from src.frame import Frame
+from src.metrics import STAGE_CAPTURE, STAGE_DECODE, span
+
 os.makedirs("screenshots", exist_ok=True)
 
-def capture_screenshot(filename: str) -> bool:
+CAPTURE_MODE_PNG = "png"
+CAPTURE_MODE_RAW = "raw"
+CAPTURE_MODES = (CAPTURE_MODE_PNG, CAPTURE_MODE_RAW)
+
+# Pixel formats of `screencap` raw output (android.graphics.PixelFormat)
+RAW_PIXEL_FORMATS = {
+    1: "RGBA",  # RGBA_8888
+    2: "RGBA",  # RGBX_8888, alpha byte is ignored
+    5: "BGRA",  # BGRA_8888
+}
+
+
+def decode_png(data: bytes):
     """
-    Captures a screenshot of the Android screen using adb and saves it to a file.
-    Returns True if the adb command was successful, False otherwise.
+    Decode PNG bytes into a BGR image without going through the filesystem.
+    Returns None if the data can not be decoded.
+    """
+    if not data:
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def decode_raw(data: bytes) -> Frame | None:
+    """
+    Wrap raw `screencap` output (header followed by 32 bit pixels) as a Frame
+    without copying the pixel data.
+    The header is width, height and format, followed by a colour space field on Android 9+.
+    Returns None if the header can not be parsed.
+    """
+    if len(data) < 12:
+        return None
+
+    width, height, pixel_format = struct.unpack_from("<III", data, 0)
+    channel_order = RAW_PIXEL_FORMATS.get(pixel_format)
+    if channel_order is None or width == 0 or height == 0:
+        return None
+
+    pixel_bytes = width * height * 4
+    for header_size in (16, 12):
+        if len(data) == header_size + pixel_bytes:
+            pixels = np.frombuffer(data, dtype=np.uint8, count=pixel_bytes, offset=header_size)
+            return Frame(data, pixels.reshape(height, width, 4), channel_order)
+
+    return None
+
+
+def _exec_out_screencap(args: list[str], session: AdbSession | None) -> bytes | None:
+    with span(STAGE_CAPTURE):
+        result = (session or get_session()).exec_out(["screencap", *args], timeout=15)
+
+    if result.returncode != 0:
+        logging.error(f"ADB screenshot command failed: {result.stderr}")
+        return None
+
+    return result.stdout
+
+
+def capture_frame(mode: str = CAPTURE_MODE_PNG, session: AdbSession | None = None) -> Frame | None:
+    """
+    Captures a screenshot of the Android screen using adb and keeps it in memory.
+    In raw mode the framebuffer is transferred without PNG encoding; if its header
+    can not be parsed the capture falls back to PNG.
+    Returns a Frame with the received bytes and the decoded image, or None on failure.
     """
     try:
-        if platform.system() == "Windows":
-            # On Windows, use different approach to handle output redirection
-            result = subprocess.run(
-                ["adb", "exec-out", "screencap", "-p"],
-                capture_output=True,
-                timeout=15
-            )
-            
-            if result.returncode != 0:
-                logging.error(f"ADB screenshot command failed: {result.stderr}")
-                return False
-            
-            # Save the binary screenshot data to file
-            with open(filename, 'wb') as f:
-                f.write(result.stdout)
-        else:
-            # On Unix-like systems, use shell redirection
-            result = subprocess.run(
-                f"adb exec-out screencap -p > {filename} 2> /dev/null",
-                shell=True,
-                timeout=15
-            )
-            
-            if result.returncode != 0:
-                logging.error("ADB screenshot command failed")
-                return False
-        
-        logging.debug(f"Screenshot saved to {filename}")
-        return True
-    
+        if mode == CAPTURE_MODE_RAW:
+            data = _exec_out_screencap([], session)
+            if data is None:
+                return None
+
+            with span(STAGE_DECODE):
+                frame = decode_raw(data)
+            if frame is not None:
+                logging.debug(f"Raw screenshot captured ({len(data)} bytes)")
+                return frame
+
+            logging.warning("Could not parse raw screenshot header. Falling back to PNG capture.")
+
+        data = _exec_out_screencap(["-p"], session)
+        if data is None:
+            return None
+
+        with span(STAGE_DECODE):
+            image = decode_png(data)
+        if image is None:
+            logging.error("ADB screenshot could not be decoded")
+            return None
+
+        logging.debug(f"Screenshot captured ({len(data)} bytes)")
+        return Frame(data, image)
+
     except subprocess.TimeoutExpired:
         logging.error("ADB screenshot command timed out")
-        return False
+        return None
     except (FileNotFoundError, OSError) as e:
         logging.error(f"ADB screenshot command failed: {e}")
-        return False
+        return None
     except Exception as e:
         logging.error(f"Unexpected error during screenshot capture: {e}")
+        return None
+
+
+async def _exec_out_screencap_async(args: list[str], session: AsyncAdbSession | None) -> bytes | None:
+    with span(STAGE_CAPTURE):
+        result = await (session or get_async_session()).exec_out(["screencap", *args], timeout=15)
+
+    if result.returncode != 0:
+        logging.error(f"ADB screenshot command failed: {result.stderr}")
+        return None
+
+    return result.stdout
+
+
+async def capture_frame_async(mode: str = CAPTURE_MODE_PNG, session: AsyncAdbSession | None = None) -> Frame | None:
+    """
+    Like capture_frame, but with an async session (see async_adb) so the event loop is not blocked
+    while the screenshot is transferred. PNG decoding runs on a worker thread.
+    """
+    try:
+        if mode == CAPTURE_MODE_RAW:
+            data = await _exec_out_screencap_async([], session)
+            if data is None:
+                return None
+
+            with span(STAGE_DECODE):
+                frame = decode_raw(data)
+            if frame is not None:
+                logging.debug(f"Raw screenshot captured ({len(data)} bytes)")
+                return frame
+
+            logging.warning("Could not parse raw screenshot header. Falling back to PNG capture.")
+
+        data = await _exec_out_screencap_async(["-p"], session)
+        if data is None:
+            return None
+
+        with span(STAGE_DECODE):
+            image = await asyncio.to_thread(decode_png, data)
+        if image is None:
+            logging.error("ADB screenshot could not be decoded")
+            return None
+
+        logging.debug(f"Screenshot captured ({len(data)} bytes)")
+        return Frame(data, image)
+
+    except subprocess.TimeoutExpired:
+        logging.error("ADB screenshot command timed out")
+        return None
+    except (FileNotFoundError, OSError) as e:
+        logging.error(f"ADB screenshot command failed: {e}")
+        return None
+    except Exception as e:
+        logging.error(f"Unexpected error during screenshot capture: {e}")
+        return None
+
+
+def save_frame(frame: Frame, filename: str) -> bool:
+    """
+    Debug sink: write a frame to a PNG file.
+    PNG captures are written as received, raw captures are encoded first.
+    Returns True if the file was written, False otherwise.
+    """
+    data = frame.data
+    if frame.channel_order != "BGR":
+        data = cv2.imencode(".png", frame.image)[1].tobytes()
+
+    try:
+        with open(filename, 'wb') as f:
+            f.write(data)
+        logging.debug(f"Screenshot saved to {filename}")
+        return True
+    except OSError as e:
+        logging.error(f"Could not save screenshot to {filename}: {e}")
+        return False
+
+
+def capture_screenshot(filename: str, mode: str = CAPTURE_MODE_PNG) -> bool:
+    """
+    Captures a screenshot of the Android screen using adb and saves it to a file.
+    Returns True if the adb command was successful, False otherwise.
+    """
+    frame = capture_frame(mode)
+    if frame is None:
         return False
+    return save_frame(frame, filename)
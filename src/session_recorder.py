@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from typing import Iterator, Optional
+
+from attrs import define
+
+from src.find_image_result import FindImageResult
+from src.frame import Frame
+from src.game_action import GameAction
+
+# A session file starts with MAGIC, followed by records of
+# RECORD_HEADER (metadata length, frame length), the metadata as JSON and the frame bytes.
+MAGIC = b"PGSESS1\n"
+RECORD_HEADER = struct.Struct("<II")
+
+# Stops the writer thread
+_STOP = object()
+
+
+@define(frozen=True)
+class RecordedFrame:
+    metadata: dict  # timestamp, serial, capture mode, matches and the chosen action
+    data: bytes  # The frame as captured: PNG bytes or the raw framebuffer with its header
+
+    @property
+    def capture_mode(self) -> str:
+        return self.metadata["capture_mode"]
+
+
+def session_file_name(path: str, serial: Optional[str] = None) -> str:
+    """The session file of a phone: path with the serial before the extension, like the screenshot file."""
+    if not serial:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{serial}{extension}"
+
+
+class SessionRecorder:
+    """
+    Records the frames the bot loop matched, with their timestamp, match scores and the chosen GameAction,
+    into an append-only session file for replay (see benchmark.py replay) and debugging.
+    Frames are written from the buffer that was captured anyway, by a background thread. The queue to
+    that thread is bounded: if writing falls behind, frames are dropped instead of slowing down the loop.
+    Raw framebuffers are compressed with zlib, PNG captures are written as received.
+    """
+
+    def __init__(self, path: str, serial: Optional[str] = None, max_pending: int = 16):
+        self.path = path
+        self.serial = serial
+        self.counters = dict(recorded=0, dropped=0, written=0)
+        self._records: queue.Queue = queue.Queue(maxsize=max_pending)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._thread = threading.Thread(target=self._write_records, name=f"recorder-{serial}", daemon=True)
+        self._thread.start()
+
+    def record(
+        self,
+        frame: Frame,
+        matches: list[tuple[str, FindImageResult]],
+        action: Optional[GameAction] = None,
+        timestamp: Optional[float] = None,
+    ) -> bool:
+        """Queue a frame for writing. Returns False if it was dropped because the writer fell behind."""
+        metadata = dict(
+            timestamp=time.time() if timestamp is None else timestamp,
+            serial=self.serial,
+            capture_mode="png" if frame.channel_order == "BGR" else "raw",
+            matches=[dict(template=name, val=float(result.val), coords=list(result.coords)) for name, result in matches],
+            action=None if action is None else dict(
+                action=action.action.name,
+                position=list(action.position),
+                delay_before_tap=action.delay_before_tap,
+            ),
+        )
+        try:
+            self._records.put_nowait((metadata, frame.data))
+        except queue.Full:
+            self.counters["dropped"] += 1
+            logging.debug(f"Session recorder fell behind, dropped a frame of {self.path}")
+            return False
+        self.counters["recorded"] += 1
+        return True
+
+    def _write_records(self):
+        while True:
+            item = self._records.get()
+            if item is _STOP:
+                return
+            metadata, data = item
+            try:
+                if metadata["capture_mode"] == "raw":
+                    data = zlib.compress(data, 1)
+                    metadata["compression"] = "zlib"
+                encoded = json.dumps(metadata).encode("utf-8")
+                self._file.write(RECORD_HEADER.pack(len(encoded), len(data)) + encoded + data)
+                self._file.flush()
+                self.counters["written"] += 1
+            except (OSError, zlib.error) as e:
+                logging.error(f"Could not record frame to {self.path}: {e}")
+
+    def close(self):
+        """Write the queued frames and close the file."""
+        self._records.put(_STOP)
+        self._thread.join()
+        self._file.close()
+        logging.info(f"Session recording {self.path} closed: {self.counters}")
+
+
+def read_session(path: str) -> Iterator[RecordedFrame]:
+    """
+    Read the frames of a session file in recording order.
+    A record that was cut off (e.g. the bot was killed while writing it) ends the session.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a session recording")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            metadata_length, data_length = RECORD_HEADER.unpack(header)
+            encoded = f.read(metadata_length)
+            data = f.read(data_length)
+            if len(encoded) < metadata_length or len(data) < data_length:
+                logging.warning(f"{path} ends with an incomplete record")
+                return
+            metadata = json.loads(encoded)
+            if metadata.get("compression") == "zlib":
+                data = zlib.decompress(data)
+            yield RecordedFrame(metadata, data)
+
+
+def is_session_file(path: str) -> bool:
+    """Whether path is a session recording (rather than e.g. a directory of screenshots)."""
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
@@ -0,0 +1,64 @@
+import cv2
+import numpy as np
+from attrs import define, field
+
+
+@define(frozen=True, eq=False)
+class Template:
+    name: str
+    gray: np.ndarray = field(repr=False)  # Greyscale pixels, converted once when loading
+    width: int
+    height: int
+    mean: float  # Mean and standard deviation of the greyscale pixels
+    std: float
+    _downscaled: dict = field(factory=dict, init=False, repr=False)
+    _spectra: dict = field(factory=dict, init=False, repr=False)
+    _rescaled: dict = field(factory=dict, init=False, repr=False)
+
+    @classmethod
+    def from_gray(cls, name: str, gray: np.ndarray) -> "Template":
+        height, width = gray.shape
+        mean, std = cv2.meanStdDev(gray)
+        return cls(name, gray, width, height, float(mean[0][0]), float(std[0][0]))
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.gray.shape
+
+    def downscaled(self, factor: int) -> np.ndarray:
+        """The greyscale pixels downscaled by factor, computed once per factor."""
+        downscaled = self._downscaled.get(factor)
+        if downscaled is None:
+            downscaled = cv2.resize(
+                self.gray, (self.width // factor, self.height // factor), interpolation=cv2.INTER_AREA
+            )
+            self._downscaled[factor] = downscaled
+        return downscaled
+
+    def rescaled(self, factor: float) -> "Template":
+        """The template resized by factor for a screen of another resolution, computed once per factor."""
+        if factor == 1:
+            return self
+        rescaled = self._rescaled.get(factor)
+        if rescaled is None:
+            size = (max(1, round(self.width * factor)), max(1, round(self.height * factor)))
+            interpolation = cv2.INTER_AREA if factor < 1 else cv2.INTER_LINEAR
+            rescaled = Template.from_gray(self.name, cv2.resize(self.gray, size, interpolation=interpolation))
+            self._rescaled[factor] = rescaled
+        return rescaled
+
+    @property
+    def norm(self) -> float:
+        """Square root of the sum of the squared deviations from the mean, as TM_CCOEFF_NORMED divides by."""
+        return self.std * np.sqrt(self.width * self.height)
+
+    def spectrum(self, fft_shape: tuple[int, int]) -> np.ndarray:
+        """
+        The conjugated spectrum of the mean-free pixels, zero padded to fft_shape, computed once per shape.
+        Multiplying it with the spectrum of a screenshot cross-correlates the template with the screenshot.
+        """
+        spectrum = self._spectra.get(fft_shape)
+        if spectrum is None:
+            spectrum = np.conj(np.fft.rfft2(self.gray.astype(np.float32) - np.float32(self.mean), s=fft_shape))
+            self._spectra[fft_shape] = spectrum
+        return spectrum
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import logging
+import os
+import struct
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+from src.template import Template
+
+# A pack file starts with MAGIC and the length of the JSON index, followed by the index and the
+# greyscale pixels of every template as contiguous uint8 arrays, each aligned to ALIGNMENT bytes.
+MAGIC = b"PGTPACK1"
+INDEX_LENGTH = struct.Struct("<I")
+ALIGNMENT = 64
+
+
+def content_hash(sources: dict[str, bytes]) -> str:
+    """Hash of the names and contents of the template files, a pack is only used for the same hash."""
+    digest = hashlib.sha256()
+    for name in sorted(sources):
+        digest.update(name.encode("utf-8") + b"\0")
+        digest.update(hashlib.sha256(sources[name]).digest())
+    return digest.hexdigest()
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_template_pack(path: str, templates: dict[str, Template], source_hash: str) -> bool:
+    """
+    Write the templates to a pack file. The file is replaced atomically, so a bot starting at the
+    same time never maps a half written pack.
+    Returns True if the pack was written.
+    """
+    entries = [
+        dict(name=name, height=template.height, width=template.width, mean=template.mean, std=template.std)
+        for name, template in sorted(templates.items())
+    ]
+    # Offsets are relative to the start of the pixel data, which follows the index
+    offset = 0
+    for entry in entries:
+        entry["offset"] = offset
+        offset = _aligned(offset + entry["height"] * entry["width"])
+    index = json.dumps(dict(source_hash=source_hash, templates=entries)).encode("utf-8")
+    header = MAGIC + INDEX_LENGTH.pack(len(index)) + index
+    data_start = _aligned(len(header))
+
+    temporary_path = None
+    try:
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # A temporary file of its own, so processes writing the pack at the same time do not mix their writes
+        with tempfile.NamedTemporaryFile(
+            dir=directory, prefix=f"{os.path.basename(path)}.", suffix=".tmp", delete=False
+        ) as f:
+            temporary_path = f.name
+            f.write(header)
+            for entry in entries:
+                f.write(b"\0" * (data_start + entry["offset"] - f.tell()))
+                f.write(np.ascontiguousarray(templates[entry["name"]].gray, dtype=np.uint8).tobytes())
+        os.replace(temporary_path, path)
+        return True
+    except OSError as e:
+        logging.warning(f"Could not write template pack {path}: {e}")
+        if temporary_path is not None and os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        return False
+
+
+def read_template_pack(path: str, source_hash: Optional[str] = None) -> Optional[dict[str, Template]]:
+    """
+    Map a pack file into memory. The pixels of the templates are read-only views into the mapping,
+    so they are only paged in when they are used and shared between processes that load the same pack.
+    Returns None if there is no pack, it can not be read or it was built from other template files.
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                logging.warning(f"Ignoring template pack {path}: unknown format")
+                return None
+            index_length = INDEX_LENGTH.unpack(f.read(INDEX_LENGTH.size))[0]
+            index = json.loads(f.read(index_length))
+        if source_hash is not None and index["source_hash"] != source_hash:
+            logging.info(f"Template pack {path} is out of date.")
+            return None
+        data_start = _aligned(len(MAGIC) + INDEX_LENGTH.size + index_length)
+        pixels = np.memmap(path, dtype=np.uint8, mode="r")
+        templates = {}
+        for entry in index["templates"]:
+            height, width, offset = entry["height"], entry["width"], data_start + entry["offset"]
+            gray = np.asarray(pixels[offset:offset + height * width]).reshape(height, width)
+            templates[entry["name"]] = Template(entry["name"], gray, width, height, entry["mean"], entry["std"])
+        return templates
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, struct.error) as e:
+        logging.warning(f"Ignoring template pack {path}: {e}")
+        return None
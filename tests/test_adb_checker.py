@@ -2,6 +2,8 @@ import pytest
 from unittest.mock import patch, MagicMock
 import subprocess
 
+from src.adb_client import AdbClient
+from src.fake_adb_server import FakeAdbServer, FakeDevice
 from src.adb_checker import (
     is_adb_installed,
     get_connected_devices,
@@ -103,30 +105,36 @@ class TestAdbChecker:
         assert success is False
         assert devices == []
     
-    @patch('subprocess.run')
-    def test_check_adb_connectivity_success(self, mock_run):
+    def test_check_adb_connectivity_success(self):
         # Setup
-        mock_run.return_value = MagicMock(returncode=0, stdout="test\n")
+        session = MagicMock()
+        session.run.return_value = (0, "test")
         
         # Test
-        result = check_adb_connectivity()
+        result = check_adb_connectivity(session=session)
         
         # Assert
         assert result is True
-        mock_run.assert_called_once_with(
-            ["adb", "shell", "echo", "test"],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
+        session.run.assert_called_once_with("echo test", timeout=10)
     
-    @patch('subprocess.run')
-    def test_check_adb_connectivity_fails(self, mock_run):
+    def test_check_adb_connectivity_fails(self):
         # Setup
-        mock_run.return_value = MagicMock(returncode=1)
+        session = MagicMock()
+        session.run.return_value = (1, "")
         
         # Test
-        result = check_adb_connectivity()
+        result = check_adb_connectivity(session=session)
+        
+        # Assert
+        assert result is False
+    
+    def test_check_adb_connectivity_session_fails(self):
+        # Setup
+        session = MagicMock()
+        session.run.side_effect = OSError("ADB shell session closed")
+        
+        # Test
+        result = check_adb_connectivity(session=session)
         
         # Assert
         assert result is False
@@ -215,4 +223,53 @@ class TestAdbChecker:
         result = wait_for_device(timeout_seconds=30)
         
         # Assert
-        assert result is False
\ No newline at end of file
+        assert result is False
+
+@pytest.fixture
+def adb_server():
+    devices = [FakeDevice("device1"), FakeDevice("device2"), FakeDevice("device3", state="unauthorized")]
+    with FakeAdbServer(devices) as server:
+        yield server
+
+
+class TestAdbCheckerOverSocket:
+
+    def test_is_adb_installed(self, adb_server):
+        assert is_adb_installed(AdbClient(port=adb_server.port)) is True
+        assert adb_server.requests == ["host:version"]
+
+    def test_is_adb_installed_server_not_running(self, adb_server):
+        port = adb_server.port
+        adb_server.stop()
+
+        assert is_adb_installed(AdbClient(port=port)) is False
+
+    def test_get_connected_devices(self, adb_server):
+        success, devices = get_connected_devices(AdbClient(port=adb_server.port))
+
+        assert success is True
+        assert devices == ["device1", "device2"]  # unauthorized devices are not included
+
+    def test_check_adb_connectivity(self, adb_server):
+        assert check_adb_connectivity(AdbClient("device1", port=adb_server.port)) is True
+        assert adb_server.devices["device1"].commands == ["echo test"]
+
+    def test_check_adb_connectivity_unauthorized_device(self, adb_server):
+        assert check_adb_connectivity(AdbClient("device3", port=adb_server.port)) is False
+
+    def test_check_adb_status(self, adb_server):
+        adb_server.remove_device("device2")
+        adb_server.remove_device("device3")
+
+        is_ready, message = check_adb_status(AdbClient(port=adb_server.port))
+
+        assert is_ready is True
+        assert "device1" in message
+
+    def test_check_adb_status_no_devices(self, adb_server):
+        adb_server.devices.clear()
+
+        is_ready, message = check_adb_status(AdbClient(port=adb_server.port))
+
+        assert is_ready is False
+        assert "No Android devices connected" in message
@@ -1,114 +1,258 @@
 import pytest
 from unittest.mock import patch, MagicMock
 import subprocess
+import threading
 
-from src.adb_commands import send_adb_tap, turn_screen_off, send_adb_keyevent
+from src.adb_client import AdbClient
+from src.adb_commands import (
+    GestureQueue,
+    gesture_script,
+    keyevent,
+    send_adb_keyevent,
+    send_adb_tap,
+    send_gestures,
+    tap,
+    turn_screen_off,
+)
+from src.fake_adb_server import FakeAdbServer, FakeDevice
+
+
+def mock_session(returncode=0, output=""):
+    session = MagicMock()
+    session.run.return_value = (returncode, output)
+    return session
 
 
 class TestAdbCommands:
     
-    @patch('subprocess.run')
-    def test_send_adb_tap_success(self, mock_run):
+    def test_send_adb_tap_success(self):
+        # Setup
+        session = mock_session()
+        
+        # Test
+        result = send_adb_tap(100, 200, session=session)
+        
+        # Assert
+        assert result is True
+        session.run.assert_called_once_with("input tap 100 200", timeout=10)
+
+    @patch('src.adb_commands.get_session')
+    def test_send_adb_tap_uses_shared_session(self, mock_get_session):
         # Setup
-        mock_run.return_value = MagicMock(returncode=0, stderr="")
+        session = mock_session()
+        mock_get_session.return_value = session
         
         # Test
         result = send_adb_tap(100, 200)
         
         # Assert
         assert result is True
-        mock_run.assert_called_once_with(
-            ["adb", "shell", "input", "tap", "100", "200"],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
+        session.run.assert_called_once_with("input tap 100 200", timeout=10)
     
-    @patch('subprocess.run')
-    def test_send_adb_tap_failure(self, mock_run):
+    def test_send_adb_tap_failure(self):
         # Setup
-        mock_run.return_value = MagicMock(returncode=1, stderr="error message")
+        session = mock_session(1, "error message")
         
         # Test
-        result = send_adb_tap(100, 200)
+        result = send_adb_tap(100, 200, session=session)
         
         # Assert
         assert result is False
     
-    @patch('subprocess.run')
-    def test_send_adb_tap_timeout(self, mock_run):
+    def test_send_adb_tap_timeout(self):
         # Setup
-        mock_run.side_effect = subprocess.TimeoutExpired(["adb"], 10)
+        session = mock_session()
+        session.run.side_effect = subprocess.TimeoutExpired("input tap 100 200", 10)
         
         # Test
-        result = send_adb_tap(100, 200)
+        result = send_adb_tap(100, 200, session=session)
         
         # Assert
         assert result is False
     
-    @patch('subprocess.run')
-    def test_send_adb_tap_file_not_found(self, mock_run):
+    def test_send_adb_tap_file_not_found(self):
         # Setup
-        mock_run.side_effect = FileNotFoundError()
+        session = mock_session()
+        session.run.side_effect = FileNotFoundError()
         
         # Test
-        result = send_adb_tap(100, 200)
+        result = send_adb_tap(100, 200, session=session)
         
         # Assert
         assert result is False
     
-    @patch('subprocess.run')
-    def test_turn_screen_off_success(self, mock_run):
+    def test_turn_screen_off_success(self):
         # Setup
-        mock_run.return_value = MagicMock(returncode=0, stderr="")
+        session = mock_session()
         
         # Test
-        result = turn_screen_off()
+        result = turn_screen_off(session=session)
         
         # Assert
         assert result is True
-        mock_run.assert_called_once_with(
-            ["adb", "shell", "input", "keyevent", "26"],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
+        session.run.assert_called_once_with("input keyevent 26", timeout=10)
     
-    @patch('subprocess.run')
-    def test_turn_screen_off_failure(self, mock_run):
+    def test_turn_screen_off_failure(self):
         # Setup
-        mock_run.return_value = MagicMock(returncode=1, stderr="error message")
+        session = mock_session(1, "error message")
         
         # Test
-        result = turn_screen_off()
+        result = turn_screen_off(session=session)
         
         # Assert
         assert result is False
     
-    @patch('subprocess.run')
-    def test_send_adb_keyevent_success(self, mock_run):
+    def test_send_adb_keyevent_success(self):
         # Setup
-        mock_run.return_value = MagicMock(returncode=0, stderr="")
+        session = mock_session()
         
         # Test
-        result = send_adb_keyevent(4)  # Back button
+        result = send_adb_keyevent(4, session=session)  # Back button
         
         # Assert
         assert result is True
-        mock_run.assert_called_once_with(
-            ["adb", "shell", "input", "keyevent", "4"],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
+        session.run.assert_called_once_with("input keyevent 4", timeout=10)
     
-    @patch('subprocess.run')
-    def test_send_adb_keyevent_failure(self, mock_run):
+    def test_send_adb_keyevent_failure(self):
         # Setup
-        mock_run.return_value = MagicMock(returncode=1, stderr="error message")
+        session = mock_session(1, "error message")
         
         # Test
-        result = send_adb_keyevent(4)
+        result = send_adb_keyevent(4, session=session)
         
         # Assert
-        assert result is False
\ No newline at end of file
+        assert result is False
+
+@pytest.fixture
+def adb_server():
+    with FakeAdbServer([FakeDevice("device1")]) as server:
+        yield server
+
+
+class TestAdbCommandsOverSocket:
+
+    def test_send_adb_tap(self, adb_server):
+        # Test
+        result = send_adb_tap(100, 200, session=AdbClient(port=adb_server.port))
+
+        # Assert
+        assert result is True
+        assert adb_server.devices["device1"].commands == ["input tap 100 200"]
+        assert adb_server.requests == [
+            "host:transport-any",
+            adb_server.requests[1],
+        ]
+        assert adb_server.requests[1].startswith("shell:{ input tap 100 200 ; }")
+
+    def test_send_adb_tap_to_serial(self, adb_server):
+        adb_server.add_device(FakeDevice("device2"))
+
+        result = send_adb_tap(1, 2, session=AdbClient("device2", port=adb_server.port))
+
+        assert result is True
+        assert adb_server.devices["device2"].commands == ["input tap 1 2"]
+        assert adb_server.devices["device1"].commands == []
+
+    def test_send_adb_tap_unknown_device(self, adb_server):
+        result = send_adb_tap(1, 2, session=AdbClient("missing", port=adb_server.port))
+
+        assert result is False
+
+    def test_send_adb_keyevent_failure(self, adb_server):
+        adb_server.devices["device1"].handlers["input"] = lambda command: (1, "Error: Unknown command\n")
+
+        result = send_adb_keyevent(4, session=AdbClient(port=adb_server.port))
+
+        assert result is False
+
+    def test_turn_screen_off(self, adb_server):
+        result = turn_screen_off(session=AdbClient(port=adb_server.port))
+
+        assert result is True
+        assert adb_server.devices["device1"].commands == ["input keyevent 26"]
+
+    def test_server_not_running(self, adb_server):
+        port = adb_server.port
+        adb_server.stop()
+
+        result = send_adb_tap(1, 2, session=AdbClient(port=port))
+
+        assert result is False
+
+
+class TestGestures:
+
+    def test_script_runs_gestures_in_order_with_delays(self):
+        script = gesture_script([tap(1, 2, delay_after=0.05), keyevent(4)])
+
+        assert script == (
+            "input tap 1 2; echo __GESTURE__ 0 $?; sleep 0.05; input keyevent 4; echo __GESTURE__ 1 $?"
+        )
+
+    def test_gestures_are_sent_as_one_command(self, adb_server):
+        device = adb_server.devices["device1"]
+        device.handlers["input keyevent"] = lambda command: (1, "Error: Unknown keycode\n")
+
+        results = send_gestures([tap(1, 2), keyevent(999), tap(3, 4)], session=AdbClient(port=adb_server.port))
+
+        assert [result.ok for result in results] == [True, False, True]
+        assert results[1].output == "Error: Unknown keycode"
+        assert [command for command in device.commands if command.startswith("input")] == [
+            "input tap 1 2", "input keyevent 999", "input tap 3 4"
+        ]
+        assert len([request for request in adb_server.requests if request.startswith("shell:")]) == 1
+
+    def test_gestures_without_result_on_timeout(self):
+        session = mock_session()
+        session.run.side_effect = subprocess.TimeoutExpired("input tap 1 2", 10)
+
+        results = send_gestures([tap(1, 2), tap(3, 4)], session=session)
+
+        assert [result.returncode for result in results] == [None, None]
+
+    def test_queue_coalesces_gestures_submitted_while_sending(self, adb_server):
+        device = adb_server.devices["device1"]
+        sending = threading.Event()
+        release = threading.Event()
+
+        def run(command, timeout):
+            sending.set()
+            release.wait(5)
+            return 0, device.execute(command)[1]
+
+        session = mock_session()
+        session.run.side_effect = run
+        gestures = GestureQueue(session)
+        try:
+            first = gestures.submit(tap(1, 2))
+            assert sending.wait(5)
+            # Submitted while the first batch is on its way: sent together in the next batch
+            second = gestures.submit(tap(3, 4), tap(5, 6))
+            third = gestures.submit(keyevent(4))
+            release.set()
+
+            assert [result.command for result in second.result(5)] == ["input tap 3 4", "input tap 5 6"]
+            assert [result.ok for result in third.result(5)] == [True]
+            assert first.result(5)[0].ok
+        finally:
+            release.set()
+            gestures.close()
+
+        assert session.run.call_count == 2
+        assert gestures.counters == dict(submitted=4, batches=2, failed=0)
+
+    def test_queue_reports_errors_and_refuses_gestures_after_close(self):
+        session = mock_session()
+        gestures = GestureQueue(session)
+
+        with patch("src.adb_commands.send_gestures", side_effect=ValueError("broken")):
+            failed = gestures.submit(tap(1, 2))
+            with pytest.raises(ValueError):
+                failed.result(5)
+
+        # The sender survived the error
+        assert gestures.submit(tap(3, 4)).result(5)[0].command == "input tap 3 4"
+        gestures.close()
+
+        with pytest.raises(RuntimeError):
+            gestures.submit(tap(5, 6))
@@ -0,0 +1,71 @@
+import pytest
+import subprocess
+import sys
+
+from src.adb_session import AdbSession
+
+
+class LocalShellSession(AdbSession):
+    """AdbSession talking to a local shell instead of `adb shell`."""
+
+    def _shell_command(self):
+        return ["sh"]
+
+
+@pytest.fixture
+def session():
+    session = LocalShellSession()
+    yield session
+    session.close()
+
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="needs a POSIX shell")
+
+
+class TestAdbSession:
+
+    def test_run_returns_output_and_exit_code(self, session):
+        assert session.run("echo hello") == (0, "hello")
+        assert session.run("exit_code() { return 3; }; exit_code")[0] == 3
+
+    def test_run_output_without_trailing_newline(self, session):
+        assert session.run("printf hello") == (0, "hello")
+        assert session.run("echo again") == (0, "again")
+
+    def test_run_includes_stderr(self, session):
+        returncode, output = session.run("echo oops >&2; false")
+
+        assert returncode == 1
+        assert output == "oops"
+
+    def test_run_reuses_one_process(self, session):
+        session.run("echo one")
+        process = session._process
+        session.run("echo two")
+
+        assert session._process is process
+
+    def test_run_reconnects_after_shell_exit(self, session):
+        session.run("echo one")
+        session._process.kill()
+        session._process.wait()
+
+        assert session.run("echo two") == (0, "two")
+
+    def test_run_raises_when_shell_exits_during_command(self, session):
+        with pytest.raises(OSError):
+            session.run("exit 0")
+
+        assert session.run("echo again") == (0, "again")
+
+    def test_run_timeout_restarts_session(self, session):
+        with pytest.raises(subprocess.TimeoutExpired):
+            session.run("sleep 5", timeout=0.2)
+
+        assert session.run("echo after") == (0, "after")
+
+    def test_adb_command_addresses_serial(self):
+        assert AdbSession("abc").adb_command("exec-out", "screencap") == [
+            "adb", "-s", "abc", "exec-out", "screencap"
+        ]
+        assert AdbSession().adb_command("shell") == ["adb", "shell"]
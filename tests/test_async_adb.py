@@ -0,0 +1,199 @@
+import asyncio
+import struct
+from unittest.mock import patch
+
+import cv2
+import numpy as np
+
+from src import async_bot
+from src.adb_checker import get_connected_devices_async, wait_for_device_async
+from src.adb_commands import send_adb_tap_async
+from src.async_adb import AsyncAdbClient, AsyncAdbProcess
+from src.fake_adb_server import FakeAdbServer, FakeDevice
+from src.find_image_result import FindImageResult
+from src.screenshot import capture_frame_async
+
+
+def encode_png(width=4, height=3):
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    image[:, :, 2] = 255
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+def encode_raw(width=4, height=3):
+    header = struct.pack("<IIII", width, height, 1, 1)
+    return header + np.full((height, width, 4), 255, dtype=np.uint8).tobytes()
+
+
+class LocalShellProcess(AsyncAdbProcess):
+    """Runs the commands with the local shell instead of adb."""
+
+    def adb_command(self, *args: str) -> list[str]:
+        return ["sh", "-c", " ".join(args[1:])]
+
+
+def test_async_client_run_and_exec_out():
+    device = FakeDevice("device1", screencap_png=b"png-bytes")
+    device.handlers["false"] = lambda command: (1, "")
+
+    async def main(port):
+        client = AsyncAdbClient(port=port)
+        return (
+            await client.run("echo hello"),
+            await client.run("false"),
+            await client.exec_out(["screencap", "-p"]),
+            await client.server_version(),
+        )
+
+    with FakeAdbServer([device]) as server:
+        hello, failed, screencap, version = asyncio.run(main(server.port))
+
+    assert hello == (0, "hello")
+    assert failed == (1, "")
+    assert screencap.returncode == 0
+    assert screencap.stdout == b"png-bytes"
+    assert version > 0
+
+
+def test_async_client_exec_out_without_device():
+    async def main(port):
+        return await AsyncAdbClient("missing", port=port).exec_out(["screencap"])
+
+    with FakeAdbServer([FakeDevice("device1")]) as server:
+        result = asyncio.run(main(server.port))
+
+    assert result.returncode == 1
+    assert result.stdout == b""
+
+
+def test_capture_frame_async_over_socket():
+    png = encode_png()
+    device = FakeDevice("device1", screencap_png=png, screencap_raw=encode_raw())
+
+    async def main(port):
+        client = AsyncAdbClient(port=port)
+        return await capture_frame_async("png", session=client), await capture_frame_async("raw", session=client)
+
+    with FakeAdbServer([device]) as server:
+        png_frame, raw_frame = asyncio.run(main(server.port))
+
+    assert png_frame.data == png
+    assert raw_frame.channel_order == "RGBA"
+    assert raw_frame.gray.shape == (3, 4)
+
+
+def test_concurrent_taps_on_several_devices():
+    devices = [FakeDevice(f"device{i}") for i in range(3)]
+
+    async def main(port):
+        return await asyncio.gather(*(
+            send_adb_tap_async(10 * i, 20, session=AsyncAdbClient(device.serial, port=port))
+            for i, device in enumerate(devices)
+        ))
+
+    with FakeAdbServer(devices) as server:
+        results = asyncio.run(main(server.port))
+
+    assert results == [True, True, True]
+    for i, device in enumerate(devices):
+        assert device.commands == [f"input tap {10 * i} 20"]
+
+
+def test_device_checks_async():
+    async def main(port):
+        client = AsyncAdbClient(port=port)
+        return await get_connected_devices_async(client), await wait_for_device_async(1, session=client)
+
+    with FakeAdbServer([FakeDevice("device1"), FakeDevice("device2", state="offline")]) as server:
+        (success, devices), ready = asyncio.run(main(server.port))
+
+    assert success is True
+    assert devices == ["device1"]
+    assert ready is True
+
+
+def test_wait_for_device_async_times_out():
+    async def main(port):
+        return await wait_for_device_async(0.2, session=AsyncAdbClient(port=port), poll_interval=0.05)
+
+    with FakeAdbServer([]) as server:
+        assert asyncio.run(main(server.port)) is False
+
+
+
+def test_device_checks_async_use_the_serial():
+    async def main(port):
+        # The session of the default serial cannot pick one of several phones
+        return (
+            await wait_for_device_async(1, session=AsyncAdbClient("device2", port=port), serial="device2"),
+            await wait_for_device_async(0.2, session=AsyncAdbClient("device3", port=port), poll_interval=0.05, serial="device3"),
+        )
+
+    with FakeAdbServer([FakeDevice("device1"), FakeDevice("device2")]) as server:
+        assert asyncio.run(main(server.port)) == (True, False)
+
+
+def test_wait_for_device_async_stops_with_the_stop_event():
+    async def main(port):
+        stop_event = asyncio.Event()
+        asyncio.get_running_loop().call_later(0.1, stop_event.set)
+        return await asyncio.wait_for(
+            wait_for_device_async(None, session=AsyncAdbClient(port=port), poll_interval=5, stop_event=stop_event), 1
+        )
+
+    with FakeAdbServer([]) as server:
+        assert asyncio.run(main(server.port)) is False
+
+def test_async_process_reports_exit_code():
+    async def main():
+        process = LocalShellProcess()
+        return await process.run("echo hello; (exit 3)"), await process.exec_out(["printf", "abc"])
+
+    (returncode, output), result = asyncio.run(main())
+
+    assert (returncode, output) == (3, "hello")
+    assert result.stdout == b"abc"
+
+
+def test_run_device_taps_and_stops():
+    device = FakeDevice("device1", screencap_raw=encode_raw(64, 64))
+    start = ("start_button.png", FindImageResult(0.95, (100, 500), 10, 10))
+
+    async def main(port):
+        stop_event = asyncio.Event()
+        sessions = {"device1": AsyncAdbClient("device1", port=port)}
+
+        async def stop_after_tap():
+            while "input tap 100 500" not in device.commands:
+                await asyncio.sleep(0.05)
+            stop_event.set()
+
+        with patch("src.async_bot.get_async_session", side_effect=sessions.get):
+            await asyncio.wait_for(
+                asyncio.gather(
+                    async_bot.run_device(lambda image: [start], serial="device1", capture_mode="raw", stop_event=stop_event),
+                    stop_after_tap(),
+                ),
+                5,
+            )
+
+    with FakeAdbServer([device]) as server:
+        asyncio.run(main(server.port))
+
+    assert device.commands.count("input tap 100 500") == 1
+
+
+def test_run_device_stops_while_waiting_for_the_phone():
+    async def main(port):
+        stop_event = asyncio.Event()
+        sessions = {"device1": AsyncAdbClient("device1", port=port)}
+        asyncio.get_running_loop().call_later(0.2, stop_event.set)
+
+        with patch("src.async_bot.get_async_session", side_effect=sessions.get):
+            await asyncio.wait_for(
+                async_bot.run_device(lambda image: [], serial="device1", capture_mode="raw", stop_event=stop_event), 2
+            )
+
+    # Capturing fails without a phone, the loop waits for it but still stops at once
+    with FakeAdbServer([]) as server:
+        asyncio.run(main(server.port))
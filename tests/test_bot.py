@@ -0,0 +1,162 @@
+import threading
+from unittest.mock import patch
+
+import numpy as np
+
+from src import bot
+from src import constants
+from src.change_detector import create_change_detector
+from src.find_image_result import FindImageResult
+from src.frame import Frame
+from src.image_decision_maker import DecisionCache
+from src.scene_tracker import SceneTracker
+from src.scheduler import DelayedTaps
+from src.session_recorder import read_session
+
+
+def frame():
+    return Frame(b"", np.zeros((64, 64, 3), dtype=np.uint8))
+
+
+def test_choose_tap_skips_matches_at_top_of_screen():
+    matches = [
+        ("select_hypa.png", FindImageResult(0.99, (100, 200), 10, 10)),
+        ("start_button.png", FindImageResult(0.95, (100, 500), 10, 10)),
+    ]
+
+    img_name, result, action = bot.choose_tap(matches)
+
+    assert img_name == "start_button.png"
+    assert action.position == (100, 500)
+
+
+@patch("src.bot.get_session")
+@patch("src.bot.screenshot.capture_frame", side_effect=lambda *args, **kwargs: frame())
+def test_delayed_tap_does_not_block_capture(mock_capture, mock_get_session):
+    forfeit = ("forfeit_1.png", FindImageResult(0.95, (100, 500), 10, 10))
+    stop_event = threading.Event()
+    tapped = threading.Event()
+
+    with patch("src.adb_commands.send_gestures", side_effect=lambda *args, **kwargs: tapped.set() or []):
+        thread = threading.Thread(
+            target=bot.run_device, args=(lambda image: [forfeit],), kwargs=dict(stop_event=stop_event, polling_policy="fast")
+        )
+        thread.start()
+        try:
+            # Forfeit waits 5 seconds before tapping, capturing goes on in the meantime
+            assert not tapped.wait(0.5)
+            assert mock_capture.call_count >= 2
+        finally:
+            stop_event.set()
+            thread.join(5)
+
+    assert not thread.is_alive()
+    assert not tapped.is_set()
+
+
+@patch("src.bot.get_session")
+@patch("src.bot.screenshot.capture_frame", side_effect=lambda *args, **kwargs: frame())
+def test_matched_frames_are_recorded(mock_capture, mock_get_session, tmp_path):
+    start = ("start_button.png", FindImageResult(0.95, (100, 500), 10, 10))
+    stop_event = threading.Event()
+    path = str(tmp_path / "session.bin")
+
+    with patch("src.adb_commands.send_gestures", side_effect=lambda *args, **kwargs: stop_event.set() or []):
+        bot.run_device(lambda image: [start], stop_event=stop_event, record_session=path)
+
+    recorded = list(read_session(path))
+    assert len(recorded) == 1
+    assert recorded[0].metadata["matches"][0]["template"] == "start_button.png"
+    assert recorded[0].metadata["action"]["position"] == [100, 500]
+
+
+def test_downscaled_find_matches_scales_matches_back_up():
+    shapes = []
+
+    def find_matches(image):
+        shapes.append(image.shape)
+        return [("start_button.png", FindImageResult(0.95, (50, 250), 20, 10))]
+
+    matches = bot.downscaled_find_matches(find_matches, 4)(np.zeros((2400, 1080), dtype=np.uint8))
+
+    assert shapes == [(600, 270)]
+    assert matches == [("start_button.png", FindImageResult(0.95, (202, 1002), 80, 40))]
+
+
+def test_cached_find_matches_skips_matching_of_known_screens():
+    calls = []
+    screen = np.tile(np.arange(256, dtype=np.uint8), (512, 1))
+
+    def find_matches(image):
+        calls.append(image.shape)
+        return [("start_button.png", FindImageResult(0.95, (50, 400), 20, 10))]
+
+    find_cached = bot.cached_find_matches(find_matches, DecisionCache())
+
+    assert find_cached(screen) == find_cached(screen.copy())
+    assert len(calls) == 1
+
+
+def test_screen_to_attack_is_tapped_in_a_burst():
+    opponent = ("ingame_opponent_3_pokemon_left.png", FindImageResult(0.95, (100, 500), 10, 10))
+
+    img_name, result, action = bot.choose_tap([opponent])
+    gestures = bot.gestures_for_tap(img_name, result, action)
+
+    assert [gesture.command for gesture in gestures] == ["input tap 500 1400"] * constants.ATTACK_TAPS
+
+
+def test_cached_screens_update_the_scene():
+    screens = [np.random.default_rng(seed).integers(0, 256, (512, 256), dtype=np.uint8) for seed in range(2)]
+    scene_tracker = SceneTracker(["select_hypa.png", "start_button.png"])
+    decision_cache = DecisionCache()
+    matches = {
+        0: [("select_hypa.png", FindImageResult(0.95, (50, 400), 20, 10))],
+        1: [("start_button.png", FindImageResult(0.95, (50, 400), 20, 10))],
+    }
+    find_matches = bot.cached_find_matches(
+        lambda image: scene_tracker.find_matches(lambda image, names: matches[int(image is screens[1])], image),
+        decision_cache,
+        scene_tracker,
+    )
+    find_matches(screens[0])
+    find_matches(screens[1])
+
+    # The league select is decided from the cache, the tracker still follows it
+    find_matches(screens[0].copy())
+
+    assert decision_cache.counters["hits"] == 1
+    assert scene_tracker.current == "league_select"
+
+
+def test_unchanged_frames_are_not_matched_again():
+    start = ("start_button.png", FindImageResult(0.95, (100, 500), 10, 10))
+    detector = create_change_detector("mad")
+    calls = []
+
+    def find_matches(image):
+        calls.append(image.shape)
+        return [start]
+
+    decision = bot.process_frame(frame(), detector, find_matches)
+
+    assert decision.scene == "start"
+    assert decision.tap[0] == "start_button.png"
+    assert bot.process_frame(frame(), detector, find_matches) is None
+    assert len(calls) == 1
+
+
+def test_delayed_taps_are_dispatched_one_at_a_time():
+    forfeit = ("forfeit_1.png", FindImageResult(0.95, (100, 500), 10, 10))
+    tap = bot.choose_tap([forfeit])
+    delayed_taps = DelayedTaps()
+    tapped = []
+
+    try:
+        assert not bot.dispatch_tap(tap, delayed_taps, tapped.append)
+        assert delayed_taps.pending()
+        assert not bot.dispatch_tap(tap, delayed_taps, tapped.append)
+    finally:
+        delayed_taps.cancel()
+    assert not bot.dispatch_tap(None, delayed_taps, tapped.append)
+    assert tapped == []
@@ -0,0 +1,93 @@
+import threading
+
+import cv2
+import numpy as np
+
+from src import image_service
+from src.buffer_pool import BufferPool, get_buffer_pool
+from src.frame import Frame
+from src.image_template_loader import load_image_templates
+
+
+def test_smaller_arrays_reuse_the_buffer():
+    pool = BufferPool()
+
+    first = pool.get((20, 30))
+    second = pool.get((10, 5))
+
+    assert second.shape == (10, 5)
+    assert np.shares_memory(first, second)
+    assert pool.allocations == 1
+
+
+def test_buffer_grows_to_the_largest_shape():
+    pool = BufferPool()
+
+    pool.get((20, 5))
+    pool.get((10, 30))
+    pool.get((20, 30))
+
+    # The second get grows the buffer to (20, 30), the third fits into it
+    assert pool.allocations == 2
+
+
+def test_slots_and_threads_have_their_own_buffers():
+    pool = BufferPool()
+    main = pool.get((10, 10))
+    other_thread = []
+    thread = threading.Thread(target=lambda: other_thread.append(pool.get((10, 10))))
+    thread.start()
+    thread.join()
+
+    assert not np.shares_memory(main, pool.get((10, 10), slot=1))
+    assert not np.shares_memory(main, other_thread[0])
+
+
+def test_disabled_pool_and_empty_shapes_return_none():
+    pool = BufferPool()
+
+    assert pool.get((0, 10)) is None
+    pool.enabled = False
+    assert pool.get((10, 10)) is None
+
+
+def test_find_image_results_do_not_depend_on_the_pool():
+    screenshot = cv2.imread("./tests/images/choose_ultra_league.png", cv2.IMREAD_GRAYSCALE)
+    template = load_image_templates()["select_hypa.png"]
+    pool = get_buffer_pool()
+
+    try:
+        pool.enabled = False
+        expected = image_service.find_image(screenshot, template)
+        pool.enabled = True
+        pooled = image_service.find_image(screenshot, template)
+    finally:
+        pool.enabled = True
+
+    assert pooled.coords == expected.coords
+    assert pooled.val == expected.val
+
+
+def test_acquired_arrays_are_reused_once_no_view_is_left():
+    pool = BufferPool()
+
+    first = pool.acquire((10, 10))
+    view = first[2:4]
+    del first
+    second = pool.acquire((10, 10))
+    assert not np.shares_memory(view, second)
+
+    del view, second
+    pool.acquire((10, 10))
+    assert pool.allocations == 2
+
+
+def test_frame_greyscale_does_not_change_a_queued_frame():
+    pixels = np.random.default_rng(0).integers(0, 256, (20, 10, 3), dtype=np.uint8)
+    queued = Frame(b"", pixels)
+    expected = cv2.cvtColor(pixels, cv2.COLOR_BGR2GRAY)
+
+    queued.gray
+    Frame(b"", 255 - pixels).gray
+
+    assert np.array_equal(queued.gray, expected)
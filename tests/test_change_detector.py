@@ -0,0 +1,94 @@
+import cv2
+import numpy as np
+import pytest
+
+from src.change_detector import CHANGE_DETECTORS, ChangeDetector, create_change_detector
+
+
+@pytest.fixture(scope="module")
+def frame():
+    return cv2.imread("./tests/images/battle_button_1.png", cv2.IMREAD_GRAYSCALE)
+
+
+def with_changed_area(frame):
+    """Draw a checkerboard over (100, 1900)-(500, 2100)."""
+    other = frame.copy()
+    ys, xs = np.mgrid[1900:2100, 100:500]
+    other[1900:2100, 100:500] = np.where((xs // 40 + ys // 40) % 2 == 0, 0, 255)
+    return other
+
+
+def with_noise(frame):
+    noise = np.random.default_rng(0).integers(-2, 3, frame.shape)
+    return np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("name", list(CHANGE_DETECTORS))
+class TestChangeDetectors:
+
+    def test_first_frame_is_changed(self, name, frame):
+        change = create_change_detector(name).detect(frame)
+
+        assert change.changed
+        assert change.changed_region() == (0, 0, 1080, 2400)
+
+    def test_unchanged_screen_is_matched_again_after_max_age(self, name, frame):
+        # A tap that had no effect leaves the screen as it was
+        detector = create_change_detector(name, max_age=10)
+        detector.detect(frame, now=0)
+
+        assert not detector.detect(frame.copy(), now=5).changed
+        assert detector.detect(frame.copy(), now=11).changed
+        assert not detector.detect(frame.copy(), now=12).changed
+
+    def test_same_frame_is_unchanged(self, name, frame):
+        detector = create_change_detector(name)
+        detector.detect(frame)
+
+        change = detector.detect(frame.copy())
+
+        assert not change.changed
+        assert change.changed_region() is None
+
+    def test_noise_is_unchanged(self, name, frame):
+        if name == "tiles":
+            pytest.skip("checksums only ignore noise that does not cross a quantization step")
+        detector = create_change_detector(name)
+        detector.detect(frame)
+
+        assert not detector.detect(with_noise(frame)).changed
+
+    def test_changed_area_is_reported(self, name, frame):
+        detector = create_change_detector(name)
+        detector.detect(frame)
+        other = with_changed_area(frame)
+
+        change = detector.detect(other)
+
+        assert change.changed
+        x0, y0, x1, y1 = change.changed_region()
+        assert x0 <= 100 and y0 <= 1900 and x1 >= 500 and y1 >= 2100
+        assert y0 >= 1500  # Tiles far away from the change are not reported
+
+    def test_reference_is_last_changed_frame(self, name, frame):
+        detector = create_change_detector(name)
+        detector.detect(frame)
+        other = with_changed_area(frame)
+        detector.detect(other)
+
+        assert not detector.detect(other.copy()).changed
+        assert detector.detect(frame).changed
+
+
+def test_unknown_change_detector():
+    with pytest.raises(ValueError):
+        create_change_detector("md4")
+
+
+def test_detector_without_signatures_can_not_be_created():
+    class ChecksumOnlyDetector(ChangeDetector):
+        def _changed(self, reference, signatures):
+            return reference != signatures
+
+    with pytest.raises(TypeError):
+        ChecksumOnlyDetector()
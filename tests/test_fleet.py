@@ -0,0 +1,68 @@
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from src.adb_client import AdbClient
+from src.fake_adb_server import FakeAdbServer, FakeDevice
+from src.fleet import FleetRunner
+
+
+def idle_bot_loop(find_matches, serial=None, stop_event=None, **kwargs):
+    stop_event.wait()
+
+
+@pytest.fixture
+def adb_server():
+    with FakeAdbServer([FakeDevice("device1"), FakeDevice("device2")]) as server:
+        yield server
+
+
+@pytest.fixture
+def pool():
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        yield pool
+
+
+@patch('src.fleet.close_session')
+@patch('src.bot.run_device', side_effect=idle_bot_loop)
+class TestFleetRunner:
+
+    def test_starts_one_loop_per_device(self, mock_run_device, mock_close, adb_server, pool):
+        runner = FleetRunner(adb_client=AdbClient(port=adb_server.port))
+
+        runner.sync_devices(pool)
+
+        assert sorted(runner.workers) == ["device1", "device2"]
+        serials = sorted(call.kwargs["serial"] for call in mock_run_device.call_args_list)
+        assert serials == ["device1", "device2"]
+
+        runner.stop_device("device1")
+        runner.stop_device("device2")
+
+    def test_adds_and_removes_devices(self, mock_run_device, mock_close, adb_server, pool):
+        runner = FleetRunner(adb_client=AdbClient(port=adb_server.port))
+        runner.sync_devices(pool)
+        device1_thread = runner.workers["device1"][0]
+
+        adb_server.remove_device("device2")
+        adb_server.add_device(FakeDevice("device3"))
+        runner.sync_devices(pool)
+
+        assert sorted(runner.workers) == ["device1", "device3"]
+        assert runner.workers["device1"][0] is device1_thread
+        mock_close.assert_called_once_with("device2")
+
+        runner.stop_device("device1")
+        runner.stop_device("device3")
+
+    def test_keeps_loops_if_device_query_fails(self, mock_run_device, mock_close, adb_server, pool):
+        runner = FleetRunner(adb_client=AdbClient(port=adb_server.port))
+        runner.sync_devices(pool)
+
+        adb_server.stop()
+        runner.sync_devices(pool)
+
+        assert sorted(runner.workers) == ["device1", "device2"]
+
+        runner.stop_device("device1")
+        runner.stop_device("device2")
@@ -1,8 +1,20 @@
+import cv2
+import numpy as np
 import pytest
+from unittest.mock import patch
 
 from src import constants
-from src.game_action import GameActions
-from src.image_decision_maker import is_ingame, make_decision
+from src import image_service
+from src.find_image_result import FindImageResult
+from src.game_action import GameAction, GameActions
+from src.image_decision_maker import (
+    DecisionCache,
+    find_images_over_threshold,
+    find_priority_match,
+    is_ingame,
+    make_decision,
+    select_priority_match,
+)
 from src.image_template_loader import load_image_templates
 
 
@@ -158,3 +170,85 @@ def test_make_decision_returns_game_action_with_no_action_if_no_image_matches(
     assert result.action is not None
     assert result.action == GameActions.no_action
     assert not result.is_ingame
+
+
+@pytest.mark.parametrize("screenshot", ["collect_rewards_1.png", "battle_button_1.png", "no_action_to_take.png"])
+def test_find_priority_match_equals_priority_of_all_matches(template_images, screenshot):
+    path = f"./tests/images/{screenshot}"
+
+    expected = select_priority_match(find_images_over_threshold(template_images, path))
+
+    assert find_priority_match(template_images, path) == expected
+
+
+def test_find_priority_match_stops_at_first_priority_template(template_images):
+    with patch("src.image_service.find_image", wraps=image_service.find_image) as mock_find:
+        match = find_priority_match(template_images, "./tests/images/collect_rewards_1.png")
+
+    assert match[0].startswith("reward_")
+    matched = [call.args[1].name for call in mock_find.call_args_list]
+    assert all(name.startswith(("max_number_of_games_played_text", "reward_")) for name in matched)
+
+
+@pytest.mark.parametrize("screenshot", ["choose_ultra_league.png", "battle_button_1.png", "ingame_opponent_3_pokemon_left.png"])
+@pytest.mark.parametrize("resolution", [(720, 1600), (1440, 3200)])
+def test_make_decision_on_other_resolutions(template_images, screenshot, resolution):
+    image = cv2.imread(f"./tests/images/{screenshot}")
+    expected = make_decision(template_images, image)
+    scale = resolution[0] / image.shape[1]
+
+    result = make_decision(template_images, cv2.resize(image, resolution, interpolation=cv2.INTER_AREA))
+
+    # The same decision, in the pixels of the other screen
+    assert result.action == expected.action
+    assert result.position == pytest.approx(tuple(v * scale for v in expected.position), abs=3)
+
+
+def test_decision_cache_recognizes_nearly_identical_screens():
+    screenshot = cv2.imread("./tests/images/battle_button_1.png", cv2.IMREAD_GRAYSCALE)
+    noisy = cv2.add(screenshot, np.random.default_rng(0).integers(0, 8, screenshot.shape, dtype=np.uint8))
+    # The same background with a dialog on top
+    other = cv2.imread("./tests/images/collect_rewards_1.png", cv2.IMREAD_GRAYSCALE)
+    matches = [("battle_button.png", FindImageResult(0.97, (540, 1200), 300, 80))]
+    action = GameAction(action=GameActions.tap_position, position=(540, 1200))
+    cache = DecisionCache()
+
+    cache.put(screenshot, matches, action)
+
+    assert cache.get(noisy).action == action
+    assert cache.get(noisy).matches == matches
+    assert cache.get(other) is None
+    assert cache.counters["hits"] == 2
+    assert cache.counters["misses"] == 1
+
+
+def test_decision_cache_evicts_least_recently_used_and_expired_decisions():
+    screens = [np.random.default_rng(seed).integers(0, 256, (64, 64), dtype=np.uint8) for seed in range(3)]
+    cache = DecisionCache(max_entries=2, ttl=10, max_distance=0)
+
+    cache.put(screens[0], [], GameAction(), now=0)
+    cache.put(screens[1], [], GameAction(), now=0)
+    assert cache.get(screens[0], now=1) is not None
+    cache.put(screens[2], [], GameAction(), now=1)
+
+    # screens[1] was used least recently, screens[0] expires after the TTL
+    assert cache.get(screens[1], now=1) is None
+    assert cache.get(screens[0], now=11) is None
+    assert cache.counters["evictions"] == 1
+    assert cache.counters["expired"] == 1
+
+
+def test_decision_cache_snapshot_survives_restarts(tmp_path, template_images):
+    snapshot_path = str(tmp_path / "decisions.json")
+    cache = DecisionCache.load(snapshot_path, fingerprint="templates")
+
+    expected = make_decision(template_images, "./tests/images/choose_ultra_league.png", decision_cache=cache)
+    assert cache.save()
+
+    restored = DecisionCache.load(snapshot_path, fingerprint="templates")
+    with patch("src.image_decision_maker.match_templates") as match_templates:
+        assert make_decision(template_images, "./tests/images/choose_ultra_league.png", decision_cache=restored) == expected
+    match_templates.assert_not_called()
+
+    # Decisions made with other templates or options are not used
+    assert len(DecisionCache.load(snapshot_path, fingerprint="other templates")) == 0
@@ -0,0 +1,110 @@
+import cv2
+import pytest
+
+from src import image_service
+from src.image_template_loader import load_image_templates
+
+
+@pytest.fixture(scope="module")
+def template_images():
+    return load_image_templates()
+
+
+@pytest.mark.parametrize(
+    "screenshot_file",
+    [
+        "./tests/images/choose_ultra_league.png",
+        "./tests/images/collect_rewards_1.png",
+        "./tests/images/ingame_opponent_3_pokemon_left.png",
+    ],
+)
+def test_pyramid_matches_equal_full_resolution_matches(template_images, screenshot_file):
+    screenshot = cv2.imread(screenshot_file, cv2.IMREAD_GRAYSCALE)
+    pyramids = [image_service.build_pyramid_level(screenshot, factor) for factor in (2, 4)]
+
+    for name, template in template_images.items():
+        expected = image_service.find_image(screenshot, template)
+        if expected.val <= 0.9:
+            continue
+        for pyramid in pyramids:
+            result = image_service.find_image(screenshot, template, pyramid=pyramid)
+
+            assert result.coords == expected.coords, (name, pyramid.factor)
+            assert result.val == pytest.approx(expected.val, abs=1e-3), (name, pyramid.factor)
+
+
+def test_pyramid_respects_window(template_images):
+    screenshot = cv2.imread("./tests/images/choose_ultra_league.png", cv2.IMREAD_GRAYSCALE)
+    pyramid = image_service.build_pyramid_level(screenshot, 4)
+    template = template_images["select_hypa.png"]
+
+    # A window that does not contain the league button
+    result = image_service.find_image(screenshot, template, (0, 1600, 1080, 2400), pyramid)
+
+    assert result.coords[1] >= 1600 + template.height // 2
+    assert result.val < 0.9
+
+
+def test_find_image_window_offsets_coordinates(template_images):
+    screenshot = cv2.imread("./tests/images/choose_ultra_league.png", cv2.IMREAD_GRAYSCALE)
+    template = template_images["select_hypa.png"]
+
+    result = image_service.find_image(screenshot, template, (0, 900, 1080, 1400))
+
+    assert result.coords == image_service.find_image(screenshot, template).coords
+
+
+@pytest.mark.parametrize(
+    "screenshot_file",
+    [
+        "./tests/images/choose_ultra_league.png",
+        "./tests/images/collect_rewards_1.png",
+    ],
+)
+def test_batched_matches_equal_single_matches(template_images, screenshot_file):
+    screenshot = cv2.imread(screenshot_file, cv2.IMREAD_GRAYSCALE)
+    templates = list(template_images.values())
+
+    results = image_service.find_images_batched(screenshot, templates)
+
+    for template, result in zip(templates, results):
+        expected = image_service.find_image(screenshot, template)
+        assert result.val == pytest.approx(expected.val, abs=1e-3), template.name
+        if expected.val > 0.9:
+            assert result.coords == expected.coords, template.name
+
+
+def test_batched_respects_window(template_images):
+    screenshot = cv2.imread("./tests/images/choose_ultra_league.png", cv2.IMREAD_GRAYSCALE)
+    templates = [template_images["select_hypa.png"], template_images["select_master.png"]]
+    window = (0, 900, 1080, 1400)
+
+    results = image_service.find_images_batched(screenshot, templates, window)
+
+    for template, result in zip(templates, results):
+        expected = image_service.find_image(screenshot, template, window)
+        assert result.coords == expected.coords, template.name
+        assert result.val == pytest.approx(expected.val, abs=1e-3), template.name
+
+
+def test_batched_skips_templates_larger_than_window(template_images):
+    screenshot = cv2.imread("./tests/images/choose_ultra_league.png", cv2.IMREAD_GRAYSCALE)
+    template = template_images["select_hypa.png"]
+
+    assert image_service.find_images_batched(screenshot, [template], (0, 0, 100, 100)) == [None]
+
+
+def test_templates_are_rescaled_once_per_screen_scale(template_images):
+    assert image_service.templates_for_screen(template_images, (2400, 1080)) is template_images
+
+    rescaled = image_service.templates_for_screen(template_images, (1600, 720))
+    again = image_service.templates_for_screen(template_images, (1600, 720, 3))
+
+    template = template_images["start_button.png"]
+    assert rescaled["start_button.png"].shape == (round(template.height * 0.67), round(template.width * 0.67))
+    assert rescaled["start_button.png"] is again["start_button.png"]
+
+
+def test_positions_are_scaled_to_the_screen():
+    assert image_service.screen_scale((1600, 720)) == 0.67
+    assert image_service.to_screen((500, 1400), 0.67) == (335, 938)
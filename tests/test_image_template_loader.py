@@ -0,0 +1,107 @@
+import os
+import shutil
+import threading
+
+import cv2
+import numpy as np
+
+from src.image_template_loader import TEMPLATE_PACK_NAME, build_template_pack, load_image_templates, validate_template
+from src.template import Template
+from src.template_pack import read_template_pack
+
+
+def copy_images(tmp_path, names):
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    for name in names:
+        shutil.copy(os.path.join("images", name), image_dir / name)
+    return str(image_dir)
+
+
+def test_load_image_templates_returns_greyscale_templates():
+    templates = load_image_templates()
+
+    template = templates["start_button.png"]
+    assert isinstance(template, Template)
+    assert template.gray.ndim == 2
+    assert (template.height, template.width) == template.gray.shape
+    assert template.std > 0
+
+
+def test_build_template_pack_does_not_modify_images(tmp_path):
+    image_dir = copy_images(tmp_path, ["start_button.png", "Yes.png"])
+    original = (tmp_path / "images" / "start_button.png").read_bytes()
+
+    build_template_pack(image_dir, str(tmp_path / "cache"))
+
+    assert (tmp_path / "images" / "start_button.png").read_bytes() == original
+
+
+def test_templates_are_loaded_from_the_pack(tmp_path):
+    image_dir = copy_images(tmp_path, ["start_button.png", "Yes.png"])
+    cache_dir = str(tmp_path / "cache")
+
+    decoded = load_image_templates(image_dir, cache_dir)
+    mapped = read_template_pack(os.path.join(cache_dir, TEMPLATE_PACK_NAME))
+
+    assert sorted(mapped) == sorted(decoded)
+    for name, template in decoded.items():
+        assert np.array_equal(template.gray, mapped[name].gray)
+        assert (mapped[name].mean, mapped[name].std) == (template.mean, template.std)
+        assert mapped[name].gray.ctypes.data % 64 == 0
+
+
+def test_pack_is_rebuilt_when_an_image_changes(tmp_path):
+    image_dir = copy_images(tmp_path, ["start_button.png", "Yes.png"])
+    cache_dir = str(tmp_path / "cache")
+    load_image_templates(image_dir, cache_dir)
+
+    shutil.copy(os.path.join("images", "select_hypa.png"), os.path.join(image_dir, "start_button.png"))
+    templates = load_image_templates(image_dir, cache_dir)
+
+    expected = load_image_templates("images")["select_hypa.png"]
+    assert np.array_equal(templates["start_button.png"].gray, expected.gray)
+
+
+
+def test_concurrent_pack_writes_do_not_share_a_temporary_file(tmp_path):
+    image_dir = copy_images(tmp_path, ["start_button.png", "Yes.png"])
+    cache_dir = tmp_path / "cache"
+    threads = [threading.Thread(target=build_template_pack, args=(image_dir, str(cache_dir))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert os.listdir(cache_dir) == [TEMPLATE_PACK_NAME]
+    assert sorted(read_template_pack(str(cache_dir / TEMPLATE_PACK_NAME))) == ["Yes.png", "start_button.png"]
+
+
+def test_templates_can_be_loaded_without_writing_the_pack(tmp_path):
+    image_dir = copy_images(tmp_path, ["start_button.png", "Yes.png"])
+    cache_dir = tmp_path / "cache"
+
+    templates = load_image_templates(image_dir, str(cache_dir), write_pack=False)
+
+    assert sorted(templates) == ["Yes.png", "start_button.png"]
+    assert not cache_dir.exists()
+
+def test_build_template_pack_reports_invalid_templates(tmp_path):
+    image_dir = copy_images(tmp_path, ["start_button.png", "Yes.png"])
+    (tmp_path / "images" / "broken.png").write_bytes(b"not an image")
+    cache_dir = str(tmp_path / "cache")
+
+    problems = build_template_pack(image_dir, cache_dir)
+
+    assert problems == {
+        "Yes.png": ["is a JPEG image with a .png name"],
+        "broken.png": ["not a PNG, JPEG or BMP image"],
+    }
+    assert sorted(read_template_pack(os.path.join(cache_dir, TEMPLATE_PACK_NAME))) == ["Yes.png", "start_button.png"]
+
+
+def test_single_color_template_is_rejected():
+    gray, problems = validate_template("flat.png", cv2.imencode(".png", np.zeros((4, 4), dtype=np.uint8))[1].tobytes())
+
+    assert gray is None
+    assert problems == ["has a single color"]
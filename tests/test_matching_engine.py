@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+
+from src.matching_engine import MatchingEngine, close_matching_engine, get_matching_engine, set_matching_threads
+
+
+@pytest.fixture
+def engine():
+    engine = MatchingEngine(max_workers=4)
+    yield engine
+    engine.close()
+
+
+def test_results_are_in_item_order(engine):
+    def slow_for_small_numbers(number):
+        time.sleep(0.01 * (5 - number))
+        return number * 2
+
+    assert engine.map(slow_for_small_numbers, range(5)) == [0, 2, 4, 6, 8]
+
+
+def test_items_run_on_several_threads(engine):
+    barrier = threading.Barrier(2, timeout=5)
+
+    # Only passes if both items run at the same time
+    assert engine.map(lambda item: barrier.wait() is not None, range(2)) == [True, True]
+
+
+def test_items_not_done_within_timeout_are_none(engine):
+    release = threading.Event()
+
+    def block_odd(number):
+        if number % 2:
+            release.wait(5)
+        return number
+
+    try:
+        assert engine.map(block_odd, range(4), timeout=0.2) == [0, None, 2, None]
+    finally:
+        release.set()
+
+
+def test_exceptions_are_raised(engine):
+    def fail(item):
+        raise ValueError(item)
+
+    with pytest.raises(ValueError):
+        engine.map(fail, ["x"])
+
+
+def test_shared_engine_is_reused_and_resized():
+    try:
+        set_matching_threads(2)
+        engine = get_matching_engine()
+
+        assert get_matching_engine() is engine
+        assert engine.max_workers == 2
+
+        set_matching_threads(None)
+        assert get_matching_engine() is not engine
+    finally:
+        close_matching_engine()
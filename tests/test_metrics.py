@@ -0,0 +1,104 @@
+import json
+from unittest.mock import MagicMock
+
+import cv2
+import pytest
+
+from src import metrics
+from src.adb_commands import send_adb_tap
+from src.image_decision_maker import match_templates
+from src.image_template_loader import load_image_templates
+from src.metrics import Metrics, MetricsExporter
+
+
+def entries_by_key(snapshot):
+    return {(entry["stage"], entry["template"]): entry for entry in snapshot}
+
+
+def test_quantiles_over_recent_samples():
+    recorder = Metrics(window=100)
+    for i in range(200):
+        recorder.record("capture", i / 1000)
+
+    entry = entries_by_key(recorder.snapshot())[("capture", None)]
+
+    # Quantiles only cover the last 100 samples, count and sum cover all of them
+    assert entry["count"] == 200
+    assert entry["sum"] == pytest.approx(sum(range(200)) / 1000)
+    assert entry["p50"] == pytest.approx(0.1495)
+    assert entry["p99"] == pytest.approx(0.19801)
+    assert entry["max"] == pytest.approx(0.199)
+
+
+def test_span_records_even_if_the_body_raises():
+    recorder = Metrics()
+
+    with pytest.raises(ValueError):
+        with recorder.span("tap"):
+            raise ValueError()
+
+    assert entries_by_key(recorder.snapshot())[("tap", None)]["count"] == 1
+
+
+def test_disabled_metrics_record_nothing():
+    recorder = Metrics()
+    recorder.enabled = False
+
+    with recorder.span("tap"):
+        pass
+
+    assert recorder.snapshot() == []
+
+
+def test_prometheus_format():
+    recorder = Metrics()
+    recorder.record("capture", 0.25)
+    recorder.record("find_image", 0.01, template='start "button".png')
+
+    text = recorder.to_prometheus()
+
+    assert "# TYPE pogobot_stage_latency_seconds summary" in text
+    assert 'pogobot_stage_latency_seconds{stage="capture",quantile="0.95"} 0.250000' in text
+    assert 'pogobot_stage_latency_seconds_count{stage="capture"} 1' in text
+    assert 'pogobot_template_latency_seconds_sum{stage="find_image",template="start \\"button\\".png"} 0.010000' in text
+
+
+def test_json_lines_format():
+    recorder = Metrics()
+    recorder.record("capture", 0.25)
+    recorder.record("decode", 0.05)
+
+    lines = [json.loads(line) for line in recorder.to_json_lines(timestamp=1.0).splitlines()]
+
+    assert [line["stage"] for line in lines] == ["capture", "decode"]
+    assert lines[0]["timestamp"] == 1.0
+    assert lines[0]["p99"] == pytest.approx(0.25)
+
+
+def test_exporter_writes_on_stop(tmp_path):
+    recorder = Metrics()
+    recorder.record("capture", 0.25)
+    path = tmp_path / "metrics.jsonl"
+
+    exporter = MetricsExporter(recorder, str(path), "jsonl", interval=60)
+    exporter.start()
+    exporter.stop()
+    recorder.write(str(path), "jsonl")
+
+    # JSON lines are appended, a snapshot per export
+    assert len(path.read_text().splitlines()) == 2
+
+
+def test_hot_paths_are_timed():
+    metrics.get_metrics().reset()
+    session = MagicMock()
+    session.run.return_value = (0, "")
+    template_images = load_image_templates()
+    screenshot = cv2.imread("./tests/images/choose_ultra_league.png", cv2.IMREAD_GRAYSCALE)
+
+    send_adb_tap(1, 2, session=session)
+    match_templates(screenshot, {"select_hypa.png": template_images["select_hypa.png"]}, 0.9)
+
+    recorded = entries_by_key(metrics.get_metrics().snapshot())
+    assert recorded[("tap", None)]["count"] == 1
+    assert recorded[("find_image", "select_hypa.png")]["count"] == 1
@@ -0,0 +1,141 @@
+import queue
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+from src.adb_commands import tap
+from src.find_image_result import FindImageResult
+from src.frame import Frame
+from src.pipeline import _STOP, PipelinedRunner, put_latest
+from src.scheduler import PollingPolicy, PollingScheduler
+
+
+def checkerboard_frame(offset):
+    gray = (np.indices((64, 64)).sum(axis=0) // 8 + offset) % 2 * 255
+    pixels = np.dstack([gray.astype(np.uint8)] * 3)
+    return Frame(b"", pixels)
+
+
+START_BUTTON = ("start_button.png", FindImageResult(0.95, (100, 500), 10, 10))
+
+
+def test_put_latest_replaces_oldest_item():
+    stage_queue = queue.Queue(maxsize=1)
+
+    assert not put_latest(stage_queue, 1)
+    assert put_latest(stage_queue, 2)
+    assert stage_queue.get_nowait() == 2
+
+
+def test_drops_frames_captured_before_tap_settled():
+    runner = PipelinedRunner(MagicMock(return_value=[]))
+    runner.frames = queue.Queue()
+    runner._settled_at = time.monotonic() + 60
+    runner.frames.put((time.monotonic(), checkerboard_frame(0)))
+    runner.frames.put((time.monotonic() + 120, checkerboard_frame(1)))
+    runner.frames.put(_STOP)
+
+    runner._match_stage()
+
+    assert runner.counters["stale"] == 1
+    assert runner.counters["matched"] == 1
+    runner.find_matches.assert_called_once()
+
+
+@patch("src.pipeline.get_session")
+@patch("src.pipeline.send_gestures")
+@patch("src.pipeline.screenshot.capture_frame")
+def test_taps_matches_while_capturing(mock_capture, mock_tap, mock_get_session):
+    frames = iter([checkerboard_frame(offset % 2) for offset in range(1000)])
+    mock_capture.side_effect = lambda *args, **kwargs: next(frames)
+    tapped = threading.Event()
+    mock_tap.side_effect = lambda *args, **kwargs: tapped.set()
+
+    runner = PipelinedRunner(lambda image: [START_BUTTON], settle_time=0.01, polling_policy="fast")
+    thread = threading.Thread(target=runner.run)
+    thread.start()
+    try:
+        assert tapped.wait(5)
+    finally:
+        runner.stop()
+        thread.join(5)
+
+    assert not thread.is_alive()
+    mock_tap.assert_called_with([tap(100, 500)], session=mock_get_session.return_value)
+    assert runner.counters["captured"] >= runner.counters["matched"] >= 1
+
+
+@patch("src.pipeline.get_session")
+@patch("src.pipeline.send_gestures")
+@patch("src.pipeline.screenshot.capture_frame")
+def test_delayed_tap_does_not_block_capture(mock_capture, mock_tap, mock_get_session):
+    frames = iter([checkerboard_frame(offset % 2) for offset in range(1000)])
+    mock_capture.side_effect = lambda *args, **kwargs: next(frames)
+    forfeit = ("forfeit_1.png", FindImageResult(0.95, (100, 500), 10, 10))
+
+    runner = PipelinedRunner(lambda image: [forfeit], settle_time=0.01, polling_policy="fast")
+    thread = threading.Thread(target=runner.run)
+    thread.start()
+    try:
+        # Forfeit waits 5 seconds before tapping, capturing and matching go on in the meantime
+        time.sleep(1)
+        captured = runner.counters["captured"]
+        time.sleep(0.5)
+        assert runner.counters["captured"] > captured
+        assert runner.counters["matched"] >= 2
+    finally:
+        runner.stop()
+        thread.join(5)
+
+    assert not thread.is_alive()
+    mock_tap.assert_not_called()
+
+
+@patch("src.pipeline.get_session")
+@patch("src.pipeline.send_gestures")
+@patch("src.pipeline.screenshot.capture_frame", return_value=None)
+def test_stops_while_waiting_for_device(mock_capture, mock_tap, mock_get_session):
+    runner = PipelinedRunner(MagicMock())
+    thread = threading.Thread(target=runner.run)
+    thread.start()
+    time.sleep(0.1)
+
+    runner.stop()
+    thread.join(5)
+
+    assert not thread.is_alive()
+    mock_tap.assert_not_called()
+
+
+
+@patch("src.pipeline.send_gestures")
+def test_schedules_captures_by_scene_and_after_taps(mock_tap):
+    opponent = ("ingame_opponent_3_pokemon_left.png", FindImageResult(0.95, (100, 500), 10, 10))
+    runner = PipelinedRunner(lambda image: [opponent])
+    policy = PollingPolicy(min_interval=0.01, max_interval=0.1, backoff=2, after_tap=0.05, scene_intervals={"in_battle": 0.02})
+    runner.scheduler = PollingScheduler(policy)
+    runner.taps = queue.Queue()
+
+    def tap_during_capture(*args, **kwargs):
+        runner._match(checkerboard_frame(1))
+        runner.taps.put(_STOP)
+        runner._act_stage(None)
+        runner.stop()
+        return checkerboard_frame(0)
+
+    def capture(*args, **kwargs):
+        runner.stop()
+        return checkerboard_frame(1)
+
+    # The frame captured while the tap is sent does not move the capture after the tap forward
+    with patch("src.pipeline.screenshot.capture_frame", side_effect=tap_during_capture):
+        runner._capture_stage(None)
+    assert mock_tap.call_count == 1
+    assert runner.scheduler.interval == policy.after_tap
+
+    runner.stop_event.clear()
+    with patch("src.pipeline.screenshot.capture_frame", side_effect=capture):
+        runner._capture_stage(None)
+    assert runner.scheduler.interval == policy.scene_intervals["in_battle"]
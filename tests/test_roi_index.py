@@ -0,0 +1,54 @@
+import cv2
+
+from src.find_image_result import FindImageResult
+from src.image_decision_maker import find_images_over_threshold
+from src.image_template_loader import load_image_templates
+from src.roi_index import RoiIndex
+
+SCREEN = (2400, 1080)
+
+
+def test_search_window_uses_longest_declared_prefix():
+    roi_index = RoiIndex({"start_": (0.0, 0.0, 1.0, 1.0), "start_button": (0.0, 0.5, 1.0, 1.0)})
+
+    window = roi_index.search_window("start_button_text.png", SCREEN, (100, 200))
+
+    # Room for half a template above the region so matches centred on its border are found
+    assert window == (0, 1200 - 50 - 1, 1080, 2400)
+
+
+def test_search_window_without_region_is_whole_screen():
+    assert RoiIndex().search_window("unknown.png", SCREEN, (100, 200)) is None
+
+
+def test_learned_region_is_used_after_min_samples():
+    roi_index = RoiIndex(min_samples=2, margin=0.0)
+    result = FindImageResult(0.99, (540, 1200), 200, 100)
+
+    assert roi_index.record("button.png", result, SCREEN)
+    assert roi_index.region_for("button.png") is None
+
+    assert roi_index.record("button.png", result, SCREEN)
+    assert roi_index.region_for("button.png") == (0.5, 0.5, 0.5, 0.5)
+    assert roi_index.search_window("button.png", SCREEN, (100, 200)) == (439, 1149, 641, 1251)
+
+
+def test_whole_screen_is_searched_periodically():
+    roi_index = RoiIndex({"button": (0.0, 0.5, 1.0, 1.0)}, full_search_every=3)
+
+    windows = [roi_index.search_window("button.png", SCREEN, (100, 200)) for _ in range(3)]
+
+    assert windows[0] is not None and windows[1] is not None
+    assert windows[2] is None
+
+
+def test_matches_in_regions_equal_whole_screen_matches():
+    template_images = load_image_templates()
+    screenshot = cv2.imread("./tests/images/choose_ultra_league.png", cv2.IMREAD_GRAYSCALE)
+    roi_index = RoiIndex.load(learned_path=None)
+
+    whole_screen = find_images_over_threshold(template_images, screenshot)
+    in_regions = find_images_over_threshold(template_images, screenshot, roi_index=roi_index)
+
+    assert [(name, r.coords) for name, r in in_regions] == [(name, r.coords) for name, r in whole_screen]
+    assert "select_hypa.png" in roi_index.learned
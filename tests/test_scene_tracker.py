@@ -0,0 +1,79 @@
+from src.find_image_result import FindImageResult
+from src.scene_tracker import SceneTracker, scene_of
+
+TEMPLATE_NAMES = [
+    "welcome_to_gbl_button_text.png",
+    "select_master.png",
+    "start_button.png",
+    "forfeit.png",
+    "ingame_pokemon_menu.png",
+    "reward_1.1_icon.png",
+    "max_number_of_games_played_text.png",
+    "unknown_popup.png",
+]
+
+
+def match(name, y=500, val=0.95):
+    return name, FindImageResult(val, (100, y), 10, 10)
+
+
+class RecordingMatcher:
+    def __init__(self, matches_by_name):
+        self.matches_by_name = matches_by_name
+        self.calls = []
+
+    def __call__(self, image, template_names=None):
+        self.calls.append(template_names)
+        names = TEMPLATE_NAMES if template_names is None else template_names
+        return [self.matches_by_name[name] for name in names if name in self.matches_by_name]
+
+
+def test_scene_of_template_names():
+    assert scene_of("select_master.png") == "league_select"
+    assert scene_of("start_button.png") == "start"
+    assert scene_of("forfeit_yes.png") == "in_battle"
+    assert scene_of("unknown_popup.png") is None
+
+
+def test_matches_all_templates_while_scene_is_unknown():
+    tracker = SceneTracker(TEMPLATE_NAMES)
+    matcher = RecordingMatcher({"select_master.png": match("select_master.png")})
+
+    matches = tracker.find_matches(matcher, None)
+
+    assert matcher.calls == [None]
+    assert [name for name, _ in matches] == ["select_master.png"]
+    assert tracker.current == "league_select"
+
+
+def test_matches_only_plausible_templates_of_known_scene():
+    tracker = SceneTracker(TEMPLATE_NAMES)
+    tracker.current = "league_select"
+    matcher = RecordingMatcher({"start_button.png": match("start_button.png")})
+
+    tracker.find_matches(matcher, None)
+
+    assert matcher.calls == [["unknown_popup.png", "select_master.png", "start_button.png"]]
+    assert tracker.current == "start"
+
+
+def test_widens_search_on_miss():
+    tracker = SceneTracker(TEMPLATE_NAMES)
+    tracker.current = "league_select"
+    matcher = RecordingMatcher({"reward_1.1_icon.png": match("reward_1.1_icon.png")})
+
+    matches = tracker.find_matches(matcher, None)
+
+    assert len(matcher.calls) == 2
+    assert "reward_1.1_icon.png" in matcher.calls[1]
+    assert "select_master.png" not in matcher.calls[1]
+    assert [name for name, _ in matches] == ["reward_1.1_icon.png"]
+    assert tracker.current == "rewards"
+
+
+def test_keeps_scene_if_nothing_matches():
+    tracker = SceneTracker(TEMPLATE_NAMES)
+    tracker.current = "in_battle"
+
+    assert tracker.find_matches(RecordingMatcher({}), None) == []
+    assert tracker.current == "in_battle"
@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+from src.scheduler import POLLING_POLICIES, DelayedTaps, PollingPolicy, PollingScheduler
+
+POLICY = PollingPolicy(min_interval=0.5, max_interval=4.0, backoff=2.0, after_tap=1.0, scene_intervals={"in_battle": 1.5})
+
+
+def test_backs_off_exponentially_on_unchanged_screens():
+    scheduler = PollingScheduler(POLICY)
+
+    intervals = [scheduler.schedule(changed=False) for _ in range(5)]
+
+    assert intervals == [1.0, 2.0, 4.0, 4.0, 4.0]
+
+
+def test_changed_screen_resets_to_scene_interval():
+    scheduler = PollingScheduler(POLICY)
+    scheduler.schedule(changed=False)
+
+    assert scheduler.schedule(changed=True) == 0.5
+    assert scheduler.schedule(changed=True, scene="in_battle") == 1.5
+    assert scheduler.schedule(changed=True, scene="start", tapped=True) == 1.0
+
+
+def test_tapped_moves_next_capture_forward():
+    scheduler = PollingScheduler(POLICY)
+    for _ in range(3):
+        scheduler.schedule(changed=False)
+
+    scheduler.tapped()
+
+    assert scheduler.next_capture_at - time.monotonic() <= POLICY.after_tap
+
+
+def test_wait_returns_when_stopped():
+    scheduler = PollingScheduler(POLICY)
+    scheduler.next_capture_at = time.monotonic() + 60
+    stop_event = threading.Event()
+    stop_event.set()
+
+    scheduler.wait(stop_event)
+
+
+def test_cadence_statistics():
+    scheduler = PollingScheduler(POLLING_POLICIES["fast"])
+    assert scheduler.cadence() == dict(captures=0)
+
+    for _ in range(3):
+        scheduler.captured()
+        time.sleep(0.01)
+
+    cadence = scheduler.cadence()
+    assert cadence["captures"] == 2
+    assert cadence["p50"] == pytest.approx(0.01, abs=0.01)
+
+
+def test_delayed_taps_run_one_at_a_time():
+    delayed_taps = DelayedTaps()
+    tapped = threading.Event()
+
+    assert delayed_taps.schedule(0.05, tapped.set)
+    assert not delayed_taps.schedule(0.05, tapped.set)
+    assert delayed_taps.pending()
+    assert tapped.wait(5)
+
+
+def test_delayed_taps_can_be_cancelled():
+    delayed_taps = DelayedTaps()
+    tapped = threading.Event()
+    delayed_taps.schedule(0.2, tapped.set)
+
+    delayed_taps.cancel()
+
+    assert not tapped.wait(0.4)
+    assert not delayed_taps.pending()
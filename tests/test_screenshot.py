@@ -0,0 +1,169 @@
+from unittest.mock import patch, MagicMock
+import subprocess
+
+import cv2
+import numpy as np
+
+import struct
+
+from src.adb_client import AdbClient
+from src.fake_adb_server import FakeAdbServer, FakeDevice
+from src.screenshot import capture_frame, capture_screenshot, decode_png, decode_raw
+
+
+def encode_png(width=4, height=3):
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    image[:, :, 2] = 255
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+def encode_raw(width=4, height=3, pixel_format=1, with_colorspace=True):
+    header = struct.pack("<III", width, height, pixel_format)
+    if with_colorspace:
+        header += struct.pack("<I", 1)
+    pixels = np.zeros((height, width, 4), dtype=np.uint8)
+    pixels[:, :, 0] = 255  # red in RGBA
+    pixels[:, :, 3] = 255
+    return header + pixels.tobytes()
+
+
+class TestScreenshot:
+
+    @patch('subprocess.run')
+    def test_capture_frame_success(self, mock_run):
+        # Setup
+        png = encode_png()
+        mock_run.return_value = MagicMock(returncode=0, stdout=png)
+
+        # Test
+        frame = capture_frame()
+
+        # Assert
+        assert frame is not None
+        assert frame.data == png
+        assert frame.image.shape == (3, 4, 3)
+        mock_run.assert_called_once_with(
+            ["adb", "exec-out", "screencap", "-p"],
+            capture_output=True,
+            timeout=15
+        )
+
+    @patch('subprocess.run')
+    def test_capture_frame_failure(self, mock_run):
+        # Setup
+        mock_run.return_value = MagicMock(returncode=1, stdout=b"", stderr=b"error")
+
+        # Test
+        frame = capture_frame()
+
+        # Assert
+        assert frame is None
+
+    @patch('subprocess.run')
+    def test_capture_frame_undecodable_output(self, mock_run):
+        # Setup
+        mock_run.return_value = MagicMock(returncode=0, stdout=b"error: no devices")
+
+        # Test
+        frame = capture_frame()
+
+        # Assert
+        assert frame is None
+
+    @patch('subprocess.run')
+    def test_capture_frame_timeout(self, mock_run):
+        # Setup
+        mock_run.side_effect = subprocess.TimeoutExpired(["adb"], 15)
+
+        # Test
+        frame = capture_frame()
+
+        # Assert
+        assert frame is None
+
+    @patch('subprocess.run')
+    def test_capture_screenshot_writes_file(self, mock_run, tmp_path):
+        # Setup
+        png = encode_png()
+        mock_run.return_value = MagicMock(returncode=0, stdout=png)
+        filename = tmp_path / "screenshot.png"
+
+        # Test
+        result = capture_screenshot(str(filename))
+
+        # Assert
+        assert result is True
+        assert filename.read_bytes() == png
+
+    def test_decode_png_empty(self):
+        assert decode_png(b"") is None
+
+    def test_decode_raw_with_colorspace_header(self):
+        frame = decode_raw(encode_raw())
+
+        assert frame is not None
+        assert frame.channel_order == "RGBA"
+        assert frame.pixels.shape == (3, 4, 4)
+        assert not frame.pixels.flags.owndata
+        assert tuple(frame.image[0, 0]) == (0, 0, 255)
+
+    def test_decode_raw_without_colorspace_header(self):
+        frame = decode_raw(encode_raw(with_colorspace=False))
+
+        assert frame is not None
+        assert frame.image.shape == (3, 4, 3)
+
+    def test_decode_raw_unknown_format(self):
+        assert decode_raw(encode_raw(pixel_format=4)) is None
+
+    def test_decode_raw_truncated(self):
+        assert decode_raw(encode_raw()[:-1]) is None
+
+    @patch('subprocess.run')
+    def test_capture_frame_raw(self, mock_run):
+        # Setup
+        mock_run.return_value = MagicMock(returncode=0, stdout=encode_raw())
+
+        # Test
+        frame = capture_frame("raw")
+
+        # Assert
+        assert frame.channel_order == "RGBA"
+        mock_run.assert_called_once_with(
+            ["adb", "exec-out", "screencap"],
+            capture_output=True,
+            timeout=15
+        )
+
+    @patch('subprocess.run')
+    def test_capture_frame_raw_falls_back_to_png(self, mock_run):
+        # Setup
+        png = encode_png()
+        mock_run.side_effect = [
+            MagicMock(returncode=0, stdout=b"garbage"),
+            MagicMock(returncode=0, stdout=png),
+        ]
+
+        # Test
+        frame = capture_frame("raw")
+
+        # Assert
+        assert frame.data == png
+        assert frame.channel_order == "BGR"
+        assert mock_run.call_count == 2
+
+    def test_capture_frame_over_socket(self):
+        png = encode_png()
+        device = FakeDevice("device1", screencap_png=png, screencap_raw=encode_raw())
+        with FakeAdbServer([device]) as server:
+            client = AdbClient(port=server.port)
+
+            png_frame = capture_frame("png", session=client)
+            raw_frame = capture_frame("raw", session=client)
+
+        assert png_frame.data == png
+        assert raw_frame.channel_order == "RGBA"
+        assert server.requests == [
+            "host:transport-any", "exec:screencap -p",
+            "host:transport-any", "exec:screencap",
+        ]
@@ -0,0 +1,102 @@
+import struct
+import threading
+
+import cv2
+import numpy as np
+
+from src.find_image_result import FindImageResult
+from src.frame import Frame
+from src.game_action import GameAction, GameActions
+from src.screenshot import decode_raw
+from src.session_recorder import SessionRecorder, is_session_file, read_session, session_file_name
+
+
+def png_frame():
+    image = np.zeros((3, 4, 3), dtype=np.uint8)
+    data = cv2.imencode(".png", image)[1].tobytes()
+    return Frame(data, image)
+
+
+def raw_frame():
+    data = struct.pack("<IIII", 4, 3, 1, 1) + np.full((3, 4, 4), 255, dtype=np.uint8).tobytes()
+    return decode_raw(data)
+
+
+def test_recorded_frames_are_read_back(tmp_path):
+    path = str(tmp_path / "session.bin")
+    match = ("start_button.png", FindImageResult(0.95, (100, 500), 10, 10))
+    action = GameAction(GameActions.tap_position, (100, 500))
+
+    recorder = SessionRecorder(path, "device1")
+    assert recorder.record(png_frame(), [match], action, timestamp=1.0)
+    assert recorder.record(raw_frame(), [], GameAction(), timestamp=2.0)
+    recorder.close()
+
+    recorded = list(read_session(path))
+    assert is_session_file(path)
+    assert [r.capture_mode for r in recorded] == ["png", "raw"]
+    assert recorded[0].data == png_frame().data
+    assert recorded[0].metadata["serial"] == "device1"
+    assert recorded[0].metadata["matches"] == [dict(template="start_button.png", val=0.95, coords=[100, 500])]
+    assert recorded[0].metadata["action"] == dict(action="tap_position", position=[100, 500], delay_before_tap=0.0)
+    # Raw framebuffers are compressed in the file, but read back as captured
+    assert recorded[1].data == raw_frame().data
+    assert decode_raw(recorded[1].data).channel_order == "RGBA"
+
+
+def test_sessions_are_appended(tmp_path):
+    path = str(tmp_path / "session.bin")
+    for timestamp in (1.0, 2.0):
+        recorder = SessionRecorder(path)
+        recorder.record(png_frame(), [], timestamp=timestamp)
+        recorder.close()
+
+    assert [r.metadata["timestamp"] for r in read_session(path)] == [1.0, 2.0]
+
+
+def test_incomplete_record_ends_the_session(tmp_path):
+    path = tmp_path / "session.bin"
+    recorder = SessionRecorder(str(path))
+    recorder.record(png_frame(), [], timestamp=1.0)
+    recorder.record(png_frame(), [], timestamp=2.0)
+    recorder.close()
+    path.write_bytes(path.read_bytes()[:-5])
+
+    assert [r.metadata["timestamp"] for r in read_session(str(path))] == [1.0]
+
+
+class SlowFile:
+    """A file whose writes wait until they are released."""
+
+    def __init__(self, file):
+        self.file = file
+        self.released = threading.Event()
+
+    def write(self, data):
+        self.released.wait()
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def test_frames_are_dropped_when_the_writer_falls_behind(tmp_path):
+    path = str(tmp_path / "session.bin")
+    recorder = SessionRecorder(path, max_pending=2)
+    recorder._file = slow_file = SlowFile(recorder._file)
+
+    results = [recorder.record(png_frame(), [], timestamp=float(i)) for i in range(10)]
+    slow_file.released.set()
+    recorder.close()
+
+    # Recording never waits for the writer: what does not fit in the queue is dropped
+    assert results.count(False) == recorder.counters["dropped"] >= 7
+    assert recorder.counters["written"] == recorder.counters["recorded"] == len(list(read_session(path)))
+
+
+def test_session_file_name_per_phone():
+    assert session_file_name("sessions/run.bin") == "sessions/run.bin"
+    assert session_file_name("sessions/run.bin", "device1") == "sessions/run.device1.bin"